@@ -0,0 +1,188 @@
+"""
+本地模拟的OpenAI兼容/chat/completions服务，用于基准测试
+
+    python -m benchmarks.mock_server --port 8765 --latency-ms 300 --chunk-interval-ms 20 --error-rate 0.05
+
+译文内容由输入机械生成，长度与输入成正比；支持流式（SSE）和非流式响应，
+可配置首token延迟、分块间隔以及按比例注入错误。
+"""
+import json
+import time
+import random
+import socket
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+class MockSettings:
+    def __init__(self, latency_ms=50, chunk_interval_ms=5, chunk_chars=4,
+                 error_rate=0.0, error_status=503, retry_after=None, seed=None):
+        # 非流式响应的总延迟，同时也是流式响应的首token延迟
+        self.latency_ms = latency_ms
+        self.chunk_interval_ms = chunk_interval_ms
+        self.chunk_chars = chunk_chars
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+
+
+def _fake_translation(text):
+    return "译文: " + text[::-1]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        # 响应头和响应体分开发送，关闭Nagle算法以免与延迟ACK叠加产生额外延迟
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload, extra_headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (extra_headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_GET(self):
+        self._send_json(200, {"object": "list", "data": [{"id": "mock-model", "object": "model"}]})
+
+    def do_POST(self):
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        with server.lock:
+            server.request_count += 1
+            fail = server.settings.random.random() < server.settings.error_rate
+        settings = server.settings
+
+        if not self.path.rstrip('/').endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "not found"}})
+            return
+        if fail:
+            with server.lock:
+                server.error_count += 1
+            headers = {}
+            if settings.retry_after is not None:
+                headers["Retry-After"] = str(settings.retry_after)
+            self._send_json(settings.error_status, {"error": {"message": "injected error"}}, headers)
+            return
+
+        prompt = body.get("messages", [{}])[-1].get("content", "")
+        content = _fake_translation(prompt)
+        usage = {
+            "prompt_tokens": sum(len(m.get("content", "")) for m in body.get("messages", [])) // 2,
+            "completion_tokens": len(content) // 2,
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+
+        time.sleep(settings.latency_ms / 1000)
+        if not body.get("stream"):
+            self._send_json(200, {
+                "id": "mock",
+                "object": "chat.completion",
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": usage
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for i in range(0, len(content), settings.chunk_chars):
+                if i:
+                    time.sleep(settings.chunk_interval_ms / 1000)
+                chunk = {"choices": [{"index": 0, "delta": {"content": content[i:i + settings.chunk_chars]}}]}
+                self._write_chunk(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n")
+            if (body.get("stream_options") or {}).get("include_usage"):
+                self._write_chunk(f"data: {json.dumps({'choices': [], 'usage': usage})}\n\n")
+            self._write_chunk("data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端取消了请求
+            pass
+
+    def _write_chunk(self, text):
+        data = text.encode('utf-8')
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+
+class MockOpenAIServer:
+    """在后台线程中运行的模拟服务"""
+
+    def __init__(self, settings=None, host="127.0.0.1", port=0):
+        self.httpd = ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.settings = settings or MockSettings()
+        self.httpd.lock = threading.Lock()
+        self.httpd.request_count = 0
+        self.httpd.error_count = 0
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    @property
+    def settings(self):
+        return self.httpd.settings
+
+    @property
+    def request_count(self):
+        return self.httpd.request_count
+
+    def reset_counters(self):
+        with self.httpd.lock:
+            self.httpd.request_count = 0
+            self.httpd.error_count = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="mock-openai", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="模拟的OpenAI兼容接口")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=300, help="响应延迟（流式为首token延迟）")
+    parser.add_argument("--chunk-interval-ms", type=float, default=20, help="流式分块间隔")
+    parser.add_argument("--chunk-chars", type=int, default=4, help="每个流式分块的字符数")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="注入错误的比例")
+    parser.add_argument("--error-status", type=int, default=503, help="注入错误的HTTP状态码")
+    parser.add_argument("--retry-after", type=float, help="错误响应携带的Retry-After秒数")
+    args = parser.parse_args()
+
+    settings = MockSettings(args.latency_ms, args.chunk_interval_ms, args.chunk_chars,
+                            args.error_rate, args.error_status, args.retry_after)
+    server = MockOpenAIServer(settings, port=args.port)
+    print(f"模拟服务已启动: {server.base_url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
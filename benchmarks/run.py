@@ -0,0 +1,343 @@
+"""
+CutEng性能基准测试
+
+启动本地模拟接口，在不同场景下驱动translate_text和热键翻译流程（不含真实键盘），
+统计吞吐量、延迟分位数和内存占用，并写入JSON文件：
+
+    python -m benchmarks.run -o bench_results.json
+    python -m benchmarks.run --quick --compare bench_results.json
+
+使用--compare时，p95延迟或吞吐量比基线差超过--tolerance的场景会被标记为回退，
+并以非零状态码退出，可在打包前执行。
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import platform
+import tempfile
+import threading
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.mock_server import MockOpenAIServer, MockSettings
+
+SHORT_TEXT = "The quick brown fox jumps over the lazy dog {}"
+LONG_TEXT = ("Performance engineering is the practice of making software fast and keeping it fast. "
+             "It involves measuring, profiling and iterating on real workloads. ") * 12 + "{}"
+
+
+def _percentile(samples, p):
+    if not samples:
+        return None
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(round(p / 100 * (len(samples) - 1))))]
+
+
+def _summarize(latencies, duration, errors, extra=None):
+    result = {
+        "requests": len(latencies),
+        "errors": errors,
+        "duration_s": round(duration, 4),
+        "throughput_rps": round(len(latencies) / duration, 2) if duration else None,
+        "latency_ms": {
+            "p50": _percentile(latencies, 50),
+            "p95": _percentile(latencies, 95),
+            "p99": _percentile(latencies, 99),
+            "mean": sum(latencies) / len(latencies) if latencies else None
+        }
+    }
+    result.update(extra or {})
+    return result
+
+
+def _is_error(result):
+    return result.startswith("翻译出错") or result.startswith("错误")
+
+
+def _run_calls(fn, items, concurrency):
+    """以指定并发数调用fn，返回(各次延迟毫秒列表, 总耗时, 错误数)"""
+    def one(item):
+        start = time.perf_counter()
+        result = fn(item)
+        return (time.perf_counter() - start) * 1000, result
+
+    start = time.perf_counter()
+    if concurrency <= 1:
+        outcomes = [one(item) for item in items]
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            outcomes = list(executor.map(one, items))
+    duration = time.perf_counter() - start
+    latencies = [latency for latency, _ in outcomes]
+    errors = sum(1 for _, result in outcomes if _is_error(result))
+    return latencies, duration, errors
+
+
+class BenchmarkRunner:
+    def __init__(self, server, workdir, scale=1.0):
+        self.server = server
+        self.workdir = workdir
+        self.scale = scale
+        self.results = {}
+
+        # 配置、缓存、翻译记忆库、花费记录和历史记录都使用工作目录中的独立文件，
+        # 不影响用户自己的数据，用户的数据也不会影响测试结果
+        from utils import config as config_module
+        from utils import cache as cache_module
+        from utils import history, quota, translation_memory
+        config_module.CONFIG_FILE = os.path.join(workdir, "config.json")
+        cache_module.CACHE_FILE = os.path.join(workdir, "translation_cache.db")
+        translation_memory.MEMORY_FILE = os.path.join(workdir, "translation_memory.db")
+        quota.SPEND_FILE = os.path.join(workdir, "daily_spend.json")
+        history.HISTORY_FILE = os.path.join(workdir, "history.db")
+        self.config_module = config_module
+        self.configure()
+
+    def count(self, n):
+        return max(1, int(n * self.scale))
+
+    def configure(self, **overrides):
+        config = self.config_module.get_config()
+        config.update({
+            "api_base_url": self.server.base_url,
+            "api_key": "benchmark",
+            "model": "mock-model",
+            "stream": True,
+            "cache_enabled": False,
+            # 翻译记忆库会直接返回相同原文的译文、给请求附加参考译文，预翻译会额外发请求，
+            # 都会让"冷启动"场景测到的不是它声称的内容；需要时由专门的场景打开
+            "tm_enabled": False,
+            "prefetch_enabled": False,
+            # 工作目录中没有词典文件，相当于不使用离线词典
+            "dictionary_file": os.path.join(self.workdir, "dictionary.db"),
+            "retry_base_delay_ms": 10,
+            "retry_max_delay_ms": 100,
+            # 基准测试中避免熔断影响后续场景
+            "circuit_failure_threshold": 1000000,
+            "max_concurrent_translations": 4
+        })
+        config.update(overrides)
+        self.config_module.save_config(config)
+
+    def scenario(self, name, fn):
+        self.server.reset_counters()
+        if hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        result = fn()
+        result["server_requests"] = self.server.request_count
+        result["peak_traced_kb"] = round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+        self.results[name] = result
+        latency = result.get("latency_ms", {})
+        print(f"{name:<28} {result.get('throughput_rps') or 0:>8.1f} req/s   "
+              f"p50 {latency.get('p50') or 0:>8.1f}ms   p95 {latency.get('p95') or 0:>8.1f}ms   "
+              f"错误 {result.get('errors', 0)}")
+
+    def run_all(self):
+        from utils.llm import translate_text, translate_text_async
+
+        # 先各走一遍同步和异步路径，避免把创建HTTP客户端的一次性开销计入第一个场景
+        self.configure(cache_enabled=False)
+        translate_text(SHORT_TEXT.format("warmup"))
+        translate_text_async(SHORT_TEXT.format("warmup"), on_delta=lambda delta: None).result()
+
+        def translate_many(template, n, concurrency, prefix):
+            items = [template.format(f"{prefix}-{i}") for i in range(n)]
+            return _summarize(*_run_calls(translate_text, items, concurrency))
+
+        # 冷启动：无缓存，逐条请求
+        self.scenario("serial_short_cold", lambda: translate_many(SHORT_TEXT, self.count(40), 1, "cold"))
+        self.scenario("serial_long_cold", lambda: translate_many(LONG_TEXT, self.count(10), 1, "long"))
+        self.scenario("concurrent_short_cold", lambda: translate_many(SHORT_TEXT, self.count(160), 8, "conc"))
+
+        # 热缓存：先翻译一遍写入缓存，再测量重复查询
+        self.configure(cache_enabled=True)
+        translate_many(SHORT_TEXT, self.count(40), 4, "warm")
+        self.scenario("serial_short_warm", lambda: translate_many(SHORT_TEXT, self.count(40), 1, "warm"))
+        self.configure(cache_enabled=False)
+
+        # 翻译记忆库：先翻译一遍写入记忆库，再测量原文相同时直接使用历史译文
+        self.configure(tm_enabled=True)
+        translate_many(SHORT_TEXT, self.count(40), 4, "tm")
+        self.scenario("serial_short_tm_exact", lambda: translate_many(SHORT_TEXT, self.count(40), 1, "tm"))
+        self.configure(tm_enabled=False)
+
+        self.scenario("stream_long_ttft", self.stream_ttft)
+        self.scenario("hotkey_pipeline_serial", self.hotkey_serial)
+        self.scenario("hotkey_pipeline_mashing", self.hotkey_mashing)
+
+        # 错误注入：20%的请求返回503，依赖重试恢复
+        self.server.settings.error_rate = 0.2
+        self.scenario("serial_short_errors", lambda: translate_many(SHORT_TEXT, self.count(40), 1, "err"))
+        self.server.settings.error_rate = 0.0
+        return self.results
+
+    def close(self):
+        """在删除工作目录之前写入花费记录，避免定时器或退出时再写入已删除的目录"""
+        from utils import quota
+        quota.get_spend().close()
+
+    def stream_ttft(self):
+        """流式翻译长文本，统计首个token和完成的延迟"""
+        from utils.llm import translate_text_async
+
+        ttfts = []
+        latencies = []
+        errors = 0
+        start_all = time.perf_counter()
+        for i in range(self.count(10)):
+            first = []
+            start = time.perf_counter()
+            future = translate_text_async(
+                LONG_TEXT.format(f"stream-{i}"),
+                on_delta=lambda delta: first or first.append(time.perf_counter())
+            )
+            result = future.result()
+            latencies.append((time.perf_counter() - start) * 1000)
+            if first:
+                ttfts.append((first[0] - start) * 1000)
+            errors += _is_error(result)
+        duration = time.perf_counter() - start_all
+        return _summarize(latencies, duration, errors, {
+            "ttft_ms": {"p50": _percentile(ttfts, 50), "p95": _percentile(ttfts, 95)}
+        })
+
+    def _scheduler(self, on_result):
+        from utils.scheduler import TranslationScheduler
+        config = self.config_module.get_config()
+        return TranslationScheduler(
+            on_result=on_result,
+            on_delta=lambda delta: None,
+            max_concurrent=config["max_concurrent_translations"],
+            deadline=config["translation_deadline_seconds"]
+        )
+
+    def hotkey_serial(self):
+        """按热键流程逐次翻译：提交到调度器直到结果送达"""
+        from utils import metrics
+
+        done = threading.Event()
+        results = []
+        scheduler = self._scheduler(lambda result, trace: (results.append(result), trace.finish(), done.set()))
+        latencies = []
+        start_all = time.perf_counter()
+        for i in range(self.count(30)):
+            done.clear()
+            start = time.perf_counter()
+            scheduler.submit(SHORT_TEXT.format(f"hotkey-{i}"), metrics.Trace("hotkey"))
+            done.wait(30)
+            latencies.append((time.perf_counter() - start) * 1000)
+        duration = time.perf_counter() - start_all
+        return _summarize(latencies, duration, sum(1 for r in results if _is_error(r)))
+
+    def hotkey_mashing(self):
+        """连续快速按下热键：只应显示最后一次的结果，且被取代的请求应被取消"""
+        delivered = []
+        done = threading.Event()
+        scheduler = self._scheduler(lambda result, trace: (delivered.append(result), done.set()))
+        presses = 10
+        start = time.perf_counter()
+        for i in range(presses):
+            scheduler.submit(SHORT_TEXT.format(f"mash-{i}"))
+            time.sleep(0.005)
+        done.wait(30)
+        latency = (time.perf_counter() - start) * 1000
+        # 等待被取消的请求全部结束，再统计服务端收到的请求数
+        time.sleep(0.2)
+        return _summarize([latency], latency / 1000, 0, {
+            "presses": presses,
+            "delivered": len(delivered)
+        })
+
+
+def compare(results, baseline, tolerance, min_delta_ms=5.0):
+    """
+    与基线结果比较，返回回退的场景列表
+
+    亚毫秒级的场景（如命中缓存）抖动很大，变化小于min_delta_ms时不视为回退。
+    """
+    regressions = []
+    print(f"\n{'场景':<28}{'p95基线':>10}{'p95当前':>10}{'吞吐基线':>10}{'吞吐当前':>10}")
+    for name, current in results["scenarios"].items():
+        old = baseline.get("scenarios", {}).get(name)
+        if not old:
+            continue
+        old_p95 = old["latency_ms"]["p95"]
+        new_p95 = current["latency_ms"]["p95"]
+        old_rps = old["throughput_rps"]
+        new_rps = current["throughput_rps"]
+        flag = ""
+        if old_p95 and new_p95 and new_p95 > old_p95 * (1 + tolerance) and new_p95 - old_p95 > min_delta_ms:
+            flag = "  <- p95回退"
+        elif (old_rps and new_rps and new_rps < old_rps * (1 - tolerance)
+              and (1 / new_rps - 1 / old_rps) * 1000 > min_delta_ms):
+            flag = "  <- 吞吐回退"
+        if flag:
+            regressions.append(name)
+        print(f"{name:<28}{old_p95 or 0:>10.1f}{new_p95 or 0:>10.1f}{old_rps or 0:>10.1f}{new_rps or 0:>10.1f}{flag}")
+    return regressions
+
+
+def _max_rss_kb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS返回字节，Linux返回KB
+    return rss // 1024 if sys.platform == "darwin" else rss
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="CutEng性能基准测试")
+    parser.add_argument("-o", "--output", default="bench_results.json", help="结果输出文件")
+    parser.add_argument("--compare", help="与之比较的基线结果文件")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="允许的性能下降比例")
+    parser.add_argument("--min-delta-ms", type=float, default=5.0, help="小于该毫秒数的变化不视为回退")
+    parser.add_argument("--quick", action="store_true", help="减少请求数，快速运行")
+    parser.add_argument("--latency-ms", type=float, default=50, help="模拟接口的响应延迟")
+    parser.add_argument("--chunk-interval-ms", type=float, default=5, help="模拟接口的流式分块间隔")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.ERROR)
+    tracemalloc.start()
+
+    settings = MockSettings(latency_ms=args.latency_ms, chunk_interval_ms=args.chunk_interval_ms,
+                            retry_after=0, seed=1234)
+    server = MockOpenAIServer(settings).start()
+    try:
+        with tempfile.TemporaryDirectory(prefix="cuteng-bench-") as workdir:
+            runner = BenchmarkRunner(server, workdir, scale=0.25 if args.quick else 1.0)
+            try:
+                scenarios = runner.run_all()
+            finally:
+                runner.close()
+    finally:
+        server.stop()
+
+    results = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "mock_server": {"latency_ms": args.latency_ms, "chunk_interval_ms": args.chunk_interval_ms},
+        "max_rss_kb": _max_rss_kb(),
+        "scenarios": scenarios
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+    print(f"\n结果已写入 {args.output}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance, args.min_delta_ms)
+        if regressions:
+            print(f"\n性能回退: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,32 @@
 import os
+import re
 import sys
+import ast
+import json
+import time
 import shutil
+import pkgutil
+import tempfile
 import subprocess
 import argparse
 
+APP_NAME = "CutEng划词翻译"
+
+# 精简构建时额外排除的标准库和第三方模块（程序运行时用不到）
+# 不排除numpy：ctranslate2本地后端导入时需要它，排除后本地模型会被静默禁用
+LEAN_EXCLUDES = [
+    "tkinter", "unittest", "pydoc", "pydoc_data", "doctest", "lib2to3", "test",
+    "distutils", "setuptools", "pip", "PIL", "IPython", "curses",
+    "xmlrpc", "ftplib", "imaplib", "poplib", "smtplib", "nntplib", "telnetlib",
+]
+
+# 精简构建（onedir）时保留的Qt插件目录，其余插件和Qt自带的翻译文件会被删除
+QT_PLUGINS_KEEP = {
+    "platforms", "platformthemes", "platforminputcontexts", "styles",
+    "xcbglintegrations", "wayland-decoration-client",
+    "wayland-graphics-integration-client", "wayland-shell-integration",
+}
+
 def clean_build_dirs():
     """清理构建目录"""
     dirs_to_clean = ['build', 'dist']
@@ -12,9 +35,157 @@ def clean_build_dirs():
             print(f"清理目录: {dir_name}")
             shutil.rmtree(dir_name)
 
-def build_exe(one_file=False, console=False, icon=True):
-    """构建可执行文件"""
-    print("开始构建可执行文件...")
+def used_qt_modules(sources=("main.py", "utils")):
+    """扫描源代码中导入的PyQt5模块"""
+    files = []
+    for source in sources:
+        if os.path.isdir(source):
+            files.extend(os.path.join(root, name) for root, _, names in os.walk(source)
+                         for name in names if name.endswith(".py"))
+        else:
+            files.append(source)
+    used = set()
+    for path in files:
+        with open(path, 'r', encoding='utf-8') as f:
+            tree = ast.parse(f.read(), path)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.ImportFrom) and node.module and node.module.startswith("PyQt5."):
+                used.add(node.module.split(".")[1])
+            elif isinstance(node, ast.Import):
+                used.update(alias.name.split(".")[1] for alias in node.names
+                            if alias.name.startswith("PyQt5."))
+    return used
+
+def compute_excludes():
+    """
+    计算精简构建要排除的模块
+
+    已安装的PyQt5模块中，源代码没有导入的全部排除（sip除外），
+    再加上LEAN_EXCLUDES中的模块。
+    """
+    try:
+        import PyQt5
+        installed = {module.name for module in pkgutil.iter_modules(PyQt5.__path__)}
+    except ImportError:
+        installed = set()
+    keep = used_qt_modules() | {"QtCore", "QtGui", "QtWidgets", "sip"}
+    qt_excludes = sorted(f"PyQt5.{name}" for name in installed - keep)
+    return qt_excludes + LEAN_EXCLUDES
+
+def prune_qt_files(dist_dir):
+    """删除onedir构建中用不到的Qt插件和Qt自带的翻译文件，返回删除的字节数"""
+    removed = 0
+    for root, dirs, _ in os.walk(dist_dir):
+        parts = root.replace("\\", "/").split("/")
+        if parts[-1] == "plugins" and "Qt5" in parts:
+            for name in list(dirs):
+                if name not in QT_PLUGINS_KEEP:
+                    path = os.path.join(root, name)
+                    removed += dir_size(path)
+                    shutil.rmtree(path)
+                    dirs.remove(name)
+        elif parts[-1] == "translations" and "Qt5" in parts:
+            removed += dir_size(root)
+            shutil.rmtree(root)
+            dirs.clear()
+    return removed
+
+def dir_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, name))
+               for root, _, names in os.walk(path) for name in names)
+
+def _component(relpath):
+    """按路径把构建产物归类"""
+    path = relpath.replace("\\", "/")
+    name = os.path.basename(path).lower()
+    if "/plugins/" in path:
+        return "Qt插件"
+    if "/translations/" in path:
+        return "Qt翻译"
+    if re.match(r"(lib)?qt5\w*\.(dll|so)", name) or "/qt5/lib/" in path.lower():
+        return "Qt库"
+    if "pyqt5" in path.lower():
+        return "PyQt5绑定"
+    if re.match(r"(lib)?python\d", name) or name == "base_library.zip":
+        return "Python运行时"
+    if path.startswith("assets/") or "/assets/" in path:
+        return "资源文件"
+    if name.startswith(APP_NAME.lower()) or name.endswith(".pyz"):
+        return "主程序和Python模块"
+    return "其他"
+
+def size_report(dist_path):
+    """打印构建产物按组成部分统计的大小"""
+    if os.path.isfile(dist_path):
+        print(f"\n单文件大小: {os.path.getsize(dist_path) / 1024 / 1024:.1f} MB")
+        return
+    sizes = {}
+    for root, _, names in os.walk(dist_path):
+        for name in names:
+            path = os.path.join(root, name)
+            component = _component(os.path.relpath(path, dist_path))
+            sizes[component] = sizes.get(component, 0) + os.path.getsize(path)
+    total = sum(sizes.values())
+    print("\n构建产物大小:")
+    for component, size in sorted(sizes.items(), key=lambda item: -item[1]):
+        print(f"  {component:<16}{size / 1024 / 1024:>8.1f} MB  {size / total:>5.0%}")
+    print(f"  {'合计':<16}{total / 1024 / 1024:>8.1f} MB")
+
+def measure_launch(exe_path, runs=3, timeout=60):
+    """
+    测量从启动到托盘和热键可用的耗时
+
+    通过CUTENG_STARTUP_REPORT环境变量让程序在热键可用后写出启动记录并退出。
+    """
+    results = []
+    for _ in range(runs):
+        with tempfile.TemporaryDirectory(prefix="cuteng-launch-") as workdir:
+            report = os.path.join(workdir, "startup.json")
+            env = dict(os.environ, CUTENG_STARTUP_REPORT=report)
+            start = time.perf_counter()
+            try:
+                subprocess.run([exe_path], cwd=workdir, env=env, timeout=timeout,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            except subprocess.TimeoutExpired:
+                print("警告: 程序在超时前没有退出")
+                continue
+            wall = (time.perf_counter() - start) * 1000
+            if not os.path.exists(report):
+                print("警告: 程序没有写出启动记录")
+                continue
+            with open(report, 'r', encoding='utf-8') as f:
+                record = json.load(f)
+            results.append((wall, record.get("interactive_ms")))
+    if results:
+        walls = sorted(wall for wall, _ in results)
+        inner = sorted(ms for _, ms in results if ms is not None)
+        print(f"\n启动到托盘可用: 中位数 {walls[len(walls) // 2]:.0f} ms（含进程启动和解包，共{len(results)}次）")
+        if inner:
+            print(f"其中程序内部耗时: 中位数 {inner[len(inner) // 2]:.0f} ms")
+    return results
+
+def pyinstaller_command(optimize=0):
+    """返回调用PyInstaller的命令，optimize为字节码优化级别"""
+    import PyInstaller
+    major = int(PyInstaller.__version__.split(".")[0])
+    if optimize and major < 6:
+        # 旧版本没有--optimize参数，以优化模式运行PyInstaller本身达到同样效果
+        return [sys.executable, "-" + "O" * optimize, "-m", "PyInstaller"]
+    cmd = [sys.executable, "-m", "PyInstaller"]
+    if optimize:
+        cmd.extend(["--optimize", str(optimize)])
+    return cmd
+
+def build_exe(one_file=False, console=False, icon=True, profile="full", upx=False):
+    """
+    构建可执行文件
+
+    profile为lean时排除用不到的Qt模块和标准库模块、以-OO优化字节码，
+    onedir构建后再删除用不到的Qt插件；返回构建产物的路径。
+    """
+    print(f"开始构建可执行文件（{profile}）...")
     
     # 确保PyInstaller已安装
     try:
@@ -24,9 +195,8 @@ def build_exe(one_file=False, console=False, icon=True):
         subprocess.check_call([sys.executable, "-m", "pip", "install", "PyInstaller"])
     
     # 构建命令
-    cmd = [
-        "pyinstaller",
-        "--name=CutEng划词翻译",
+    cmd = pyinstaller_command(optimize=2 if profile == "lean" else 0) + [
+        f"--name={APP_NAME}",
         "--noconfirm",
     ]
     
@@ -49,12 +219,21 @@ def build_exe(one_file=False, console=False, icon=True):
         else:
             print(f"警告: 图标文件 {icon_path} 不存在")
     
-    # 添加数据文件
+    # 添加数据文件（utils是代码，由PyInstaller分析导入自动收集，无需再作为数据复制一份）
     cmd.extend([
-        "--add-data", f"assets{os.pathsep}assets",
-        "--add-data", f"utils{os.pathsep}utils"
+        "--add-data", f"assets{os.pathsep}assets"
     ])
     
+    if profile == "lean":
+        excludes = compute_excludes()
+        print(f"排除 {len(excludes)} 个模块")
+        for module in excludes:
+            cmd.extend(["--exclude-module", module])
+    
+    # UPX压缩会拖慢每次启动时的解压，也容易被杀毒软件误报，默认不使用
+    if not upx:
+        cmd.append("--noupx")
+    
     # 是否打包成单个文件
     if one_file:
         cmd.append("--onefile")
@@ -72,8 +251,20 @@ def build_exe(one_file=False, console=False, icon=True):
     print("执行命令:", " ".join(cmd))
     subprocess.check_call(cmd)
     
+    exe_name = APP_NAME + (".exe" if sys.platform == "win32" else "")
+    if one_file:
+        dist_path = os.path.join("dist", exe_name)
+        exe_path = dist_path
+    else:
+        dist_path = os.path.join("dist", APP_NAME)
+        exe_path = os.path.join(dist_path, exe_name)
+        if profile == "lean":
+            removed = prune_qt_files(dist_path)
+            print(f"已删除用不到的Qt插件和翻译文件: {removed / 1024 / 1024:.1f} MB")
+    
     print("\n构建完成!")
     print("可执行文件位于 dist 目录")
+    return dist_path, exe_path
 
 def create_installer(name="CutEng划词翻译安装程序"):
     """创建安装程序 (使用NSIS)"""
@@ -87,15 +278,27 @@ def main():
     parser.add_argument("--console", action="store_true", help="显示控制台窗口")
     parser.add_argument("--no-icon", action="store_false", dest="icon", help="不使用图标")
     parser.add_argument("--installer", action="store_true", help="创建安装程序")
+    parser.add_argument("--profile", choices=["full", "lean"], default="full",
+                        help="lean: 排除用不到的Qt模块和插件并优化字节码")
+    parser.add_argument("--upx", action="store_true", help="使用UPX压缩（启动会变慢）")
+    parser.add_argument("--no-launch-test", action="store_false", dest="launch_test",
+                        help="构建后不测量启动耗时")
     
     args = parser.parse_args()
     
+    if args.profile == "lean" and args.onefile:
+        print("提示: 单文件每次启动都要解包，启动更快的布局请去掉--onefile；单文件构建无法删除多余的Qt插件")
+    
     # 清理目录
     if args.clean:
         clean_build_dirs()
     
     # 构建可执行文件
-    build_exe(one_file=args.onefile, console=args.console, icon=args.icon)
+    dist_path, exe_path = build_exe(one_file=args.onefile, console=args.console, icon=args.icon,
+                                    profile=args.profile, upx=args.upx)
+    size_report(dist_path)
+    if args.launch_test and os.path.exists(exe_path):
+        measure_launch(exe_path)
     
     # 创建安装程序
     if args.installer:
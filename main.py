@@ -1,47 +1,41 @@
+import time
+# 启动计时从导入模块之前开始
+STARTUP_STARTED = time.perf_counter()
 import sys
 import os
+import json
 import threading
 import pyperclip
-import keyboard
 import logging
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QSystemTrayIcon, QMenu, 
                             QAction, QWidget, QVBoxLayout, QHBoxLayout, QLabel, 
-                            QLineEdit, QPushButton, QMessageBox, QTextEdit)
-from PyQt5.QtCore import Qt, QTimer, QRect, pyqtSignal, QObject
-from PyQt5.QtGui import QIcon, QFont, QCursor, QPixmap, QColor, QPainter, QBrush, QPen
-import time
+                            QLineEdit, QPushButton, QMessageBox, QTextEdit,
+                            QListWidget, QListWidgetItem)
+from PyQt5.QtCore import Qt, QTimer, pyqtSignal, QObject
+from PyQt5.QtGui import QIcon, QFont, QCursor, QTextCursor
 # 导入自定义模块
+# HTTP相关模块（requests、httpx）较重，由init_backend在后台线程中导入
 from utils.config import get_config, save_config
-from utils.llm import translate_text
+from utils.selection import get_selected_text, set_modifiers_check
+from utils.hotkey import create_hotkey
+from utils.cache import get_cache
+from utils import metrics, quota
+from utils.logger import setup_logging, snippet
+IMPORTS_DONE = time.perf_counter()
 
-# 配置日志
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("translator.log", encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
-def get_selected_text():
-    """获取当前选中的文本并进行处理"""
-    try:
-        old_clipboard = pyperclip.paste()
-        time.sleep(0.5)
-        keyboard.press_and_release('ctrl+c')
-        time.sleep(0.5)  # 增加更多等待时间
-        selected_text = pyperclip.paste()
-        pyperclip.copy(old_clipboard)
-        
-        return selected_text
-    except Exception as e:
-        logging.error(f"获取选中文本时出错: {str(e)}")
-        return None
+# 配置日志：写文件和控制台都在后台线程中进行
+setup_logging(get_config())
 class SignalManager(QObject):
-    translation_ready = pyqtSignal(str)
+    translation_ready = pyqtSignal(str, object)
+    translation_delta = pyqtSignal(str)
     copy_to_clipboard = pyqtSignal(str)
     show_window = pyqtSignal()
     set_translating = pyqtSignal()
+    budget_warning = pyqtSignal(str)
+    # 热键后端在自己的线程中发射，由主线程处理
+    hotkey_activated = pyqtSignal()
+    # 托盘提示（标题、内容、图标、显示毫秒数），后台线程中也可以发射
+    tray_message = pyqtSignal(str, str, object, int)
     
 signal_manager = SignalManager()
 
@@ -183,11 +177,13 @@ class ConfigWindow(QMainWindow):
         self.model_input.setText(config["model"])
         
     def save_config(self):
-        config = {
+        # 在现有配置基础上修改，保留界面中没有的配置项
+        config = get_config()
+        config.update({
             "api_base_url": self.url_input.text(),
             "api_key": self.key_input.text(),
             "model": self.model_input.text()
-        }
+        })
         
         if save_config(config):
             QMessageBox.information(self, "成功", "配置已保存")
@@ -196,6 +192,22 @@ class ConfigWindow(QMainWindow):
             QMessageBox.warning(self, "错误", "保存配置失败")
 
 class TranslationWindow(QWidget):
+    """
+    翻译结果弹窗
+
+    窗口和其中的控件在启动时一次性创建并反复使用；流式内容追加到文档末尾，
+    只重新排版新增的部分；窗口高度和宽度随内容调整，显示在光标所在的屏幕上。
+    """
+    hidden = pyqtSignal()
+    
+    # 文本区域的宽度范围和默认宽度，以及最小高度
+    MIN_TEXT_WIDTH = 220
+    MAX_TEXT_WIDTH = 520
+    DEFAULT_TEXT_WIDTH = 340
+    MIN_TEXT_HEIGHT = 60
+    # 文本区域最多占屏幕可用高度的比例，超出后出现滚动条
+    MAX_HEIGHT_RATIO = 0.6
+    
     def __init__(self):
         super().__init__()
         self.setWindowFlags(Qt.FramelessWindowHint | Qt.WindowStaysOnTopHint | Qt.Tool)
@@ -219,7 +231,8 @@ class TranslationWindow(QWidget):
         
         self.text_display = QTextEdit()
         self.text_display.setReadOnly(True)
-        self.text_display.setFixedSize(300, 200)
+        self.text_display.setAcceptRichText(False)
+        self.text_display.setFixedSize(self.DEFAULT_TEXT_WIDTH, self.MIN_TEXT_HEIGHT)
         self.layout.addWidget(self.text_display)
         
         button_layout = QHBoxLayout()
@@ -259,18 +272,70 @@ class TranslationWindow(QWidget):
         button_layout.addWidget(close_button)
         
         self.layout.addLayout(button_layout)
+        self.layout.setSizeConstraint(QVBoxLayout.SetFixedSize)
         
-        self.setFixedSize(330, 250)
+        # “已复制!”提示，预先创建，复制时只显示
+        self.copy_feedback = QLabel("已复制!", self)
+        self.copy_feedback.setStyleSheet("""
+            background-color: rgba(0, 0, 0, 0.7);
+            color: white;
+            border-radius: 4px;
+            padding: 5px;
+        """)
+        self.copy_feedback.adjustSize()
+        self.copy_feedback.hide()
+        self.feedback_timer = QTimer(self)
+        self.feedback_timer.setSingleShot(True)
+        self.feedback_timer.timeout.connect(self.copy_feedback.hide)
+        
+        # 同一帧内的多段流式内容只调整一次窗口大小
+        self.fit_timer = QTimer(self)
+        self.fit_timer.setSingleShot(True)
+        self.fit_timer.timeout.connect(self.fit_to_content)
+        
+        # 各屏幕的可用区域，屏幕增减或分辨率变化时清空
+        self._screen_rects = None
+        self._screen_rect = None
+        self._cursor_pos = None
+        app = QApplication.instance()
+        app.screenAdded.connect(self._on_screen_added)
+        app.screenRemoved.connect(self.invalidate_screens)
+        app.primaryScreenChanged.connect(self.invalidate_screens)
+        for screen in app.screens():
+            self._watch_screen(screen)
+        
+        self.waiting_first_delta = False
         signal_manager.translation_ready.connect(self.update_translation)
+    
+    def _watch_screen(self, screen):
+        screen.geometryChanged.connect(self.invalidate_screens)
+        screen.availableGeometryChanged.connect(self.invalidate_screens)
+    
+    def _on_screen_added(self, screen):
+        self._watch_screen(screen)
+        self.invalidate_screens()
+    
+    def invalidate_screens(self, *args):
+        self._screen_rects = None
+    
+    def screen_rect_at(self, pos):
+        """返回pos所在屏幕的可用区域（不含任务栏）"""
+        if self._screen_rects is None:
+            app = QApplication.instance()
+            primary = app.primaryScreen()
+            # 主屏幕放在最前面，光标不在任何屏幕内时使用主屏幕
+            screens = [primary] + [screen for screen in app.screens() if screen is not primary]
+            self._screen_rects = [screen.availableGeometry() for screen in screens]
+        for rect in self._screen_rects:
+            if rect.contains(pos):
+                return rect
+        return self._screen_rects[0]
         
     def show_at_cursor(self):
         cursor_pos = QCursor.pos()
-        screen_rect = QApplication.desktop().screenGeometry()
-        
-        x = min(cursor_pos.x(), screen_rect.width() - self.width())
-        y = min(cursor_pos.y(), screen_rect.height() - self.height())
-        
-        self.move(x, y)
+        self._screen_rect = self.screen_rect_at(cursor_pos)
+        self._cursor_pos = cursor_pos
+        self.place()
         self.show()
         self.raise_()  # 确保窗口显示在最前面
         self.activateWindow()  # 激活窗口
@@ -278,13 +343,85 @@ class TranslationWindow(QWidget):
         # 额外的激活措施
         QTimer.singleShot(50, self.force_activate)
     
+    def place(self):
+        """把窗口放在光标右下方，超出屏幕时向左/向上移动"""
+        if self._screen_rect is None:
+            return
+        rect = self._screen_rect
+        x = min(self._cursor_pos.x(), rect.right() - self.width() + 1)
+        y = self._cursor_pos.y()
+        if y + self.height() > rect.bottom() + 1:
+            # 下方放不下时显示在光标上方
+            y = max(rect.top(), y - self.height())
+        self.move(max(rect.left(), x), y)
+    
     def force_activate(self):
         """强制激活窗口"""
         self.raise_()
         self.activateWindow()
-        
-    def update_translation(self, text):
-        self.text_display.setText(text)
+    
+    def _max_text_height(self):
+        if self._screen_rect is None:
+            return 400
+        return int(self._screen_rect.height() * self.MAX_HEIGHT_RATIO)
+    
+    def fit_to_content(self, fit_width=False):
+        """
+        按文档内容调整文本区域大小
+        
+        fit_width为True时（翻译完成后）让较短的结果收窄、较长的单行结果加宽；
+        流式输出过程中只调整高度，避免整篇文档反复重新换行。
+        """
+        display = self.text_display
+        document = display.document()
+        if fit_width:
+            text = document.toPlainText()
+            width = self.DEFAULT_TEXT_WIDTH
+            if len(text) <= 200:
+                font_metrics = display.fontMetrics()
+                longest = max((font_metrics.horizontalAdvance(line) for line in text.split("\n")), default=0)
+                width = max(self.MIN_TEXT_WIDTH, min(self.MAX_TEXT_WIDTH, longest + 40))
+            if width != display.width():
+                display.setFixedWidth(width)
+                # 宽度变化后立即按新宽度排版，才能得到正确的文档高度
+                document.setTextWidth(display.viewport().width())
+        frame = display.frameWidth() * 2 + int(document.documentMargin())
+        height = int(document.size().height()) + frame
+        height = max(self.MIN_TEXT_HEIGHT, min(self._max_text_height(), height))
+        if height != display.height():
+            display.setFixedHeight(height)
+        self.adjustSize()
+        if self.isVisible():
+            self.place()
+    
+    def set_result(self, text):
+        """显示完整的翻译结果；流式输出已经完整显示时不再重新排版"""
+        self.fit_timer.stop()
+        self.waiting_first_delta = False
+        if self.text_display.toPlainText() != text:
+            self.text_display.setPlainText(text)
+        self.fit_to_content(fit_width=True)
+        
+    def update_translation(self, text, trace=None):
+        self.set_result(text)
+        
+    def show_translating(self):
+        """显示等待提示，收到第一段流式内容时清除"""
+        self.text_display.setFixedWidth(self.DEFAULT_TEXT_WIDTH)
+        self.text_display.setPlainText("正在翻译...")
+        self.waiting_first_delta = True
+        self.fit_to_content()
+        
+    def append_delta(self, text):
+        """追加流式翻译的增量内容，只排版新增部分"""
+        if self.waiting_first_delta:
+            self.text_display.clear()
+            self.waiting_first_delta = False
+        cursor = self.text_display.textCursor()
+        cursor.movePosition(QTextCursor.End)
+        cursor.insertText(text)
+        if not self.fit_timer.isActive():
+            self.fit_timer.start(0)
         
     def copy_result(self):
         text = self.text_display.toPlainText()
@@ -295,37 +432,176 @@ class TranslationWindow(QWidget):
             self.show_copy_feedback()
     
     def show_copy_feedback(self):
-        feedback = QLabel("已复制!", self)
-        feedback.setStyleSheet("""
-            background-color: rgba(0, 0, 0, 0.7);
-            color: white;
-            border-radius: 4px;
-            padding: 5px;
-        """)
-        feedback.adjustSize()
-        
-        # 在窗口中间显示
-        feedback.move(
-            (self.width() - feedback.width()) // 2,
-            (self.height() - feedback.height()) // 2
+        # 在窗口中间显示，1秒后隐藏
+        self.copy_feedback.move(
+            (self.width() - self.copy_feedback.width()) // 2,
+            (self.height() - self.copy_feedback.height()) // 2
         )
+        self.copy_feedback.show()
+        self.copy_feedback.raise_()
+        self.feedback_timer.start(1000)
         
-        feedback.show()
-        # 1秒后隐藏
-        QTimer.singleShot(1000, feedback.deleteLater)
+    def hideEvent(self, event):
+        super().hideEvent(event)
+        self.hidden.emit()
         
     def closeEvent(self, event):
         # 拦截关闭事件，改为隐藏
         event.ignore()
         self.hide()
 
+class HistoryWindow(QWidget):
+    """
+    托盘“历史记录”窗口
+
+    输入关键词时即时搜索，每次只加载一页，滚动到底部或点击“加载更多”时再加载下一页；
+    双击记录复制译文。
+    """
+    def __init__(self, history):
+        super().__init__()
+        self.history = history
+        self.query = ""
+        self.next_before = None
+        self.setWindowTitle("划词翻译 - 历史记录")
+        self.resize(640, 520)
+        
+        layout = QVBoxLayout(self)
+        self.search_box = QLineEdit()
+        self.search_box.setPlaceholderText("搜索原文或译文，多个关键词用空格分隔")
+        self.result_list = QListWidget()
+        self.detail = QTextEdit()
+        self.detail.setReadOnly(True)
+        self.detail.setMaximumHeight(160)
+        bottom_layout = QHBoxLayout()
+        self.status_label = QLabel()
+        self.more_button = QPushButton("加载更多")
+        bottom_layout.addWidget(self.status_label, 1)
+        bottom_layout.addWidget(self.more_button)
+        layout.addWidget(self.search_box)
+        layout.addWidget(self.result_list, 1)
+        layout.addWidget(self.detail)
+        layout.addLayout(bottom_layout)
+        
+        # 输入停顿片刻再搜索，连续输入时不重复查询
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(80)
+        self.search_timer.timeout.connect(self.run_search)
+        self.search_box.textChanged.connect(self.search_timer.start)
+        self.more_button.clicked.connect(self.load_more)
+        self.result_list.verticalScrollBar().valueChanged.connect(self.on_scroll)
+        self.result_list.currentItemChanged.connect(self.show_detail)
+        self.result_list.itemDoubleClicked.connect(self.copy_entry)
+        
+    def showEvent(self, event):
+        super().showEvent(event)
+        # 每次打开时刷新，显示最新的记录
+        self.run_search()
+        self.search_box.setFocus()
+        
+    def run_search(self):
+        self.query = self.search_box.text().strip()
+        self.result_list.clear()
+        self.detail.clear()
+        self.load_page(None)
+        
+    def load_more(self):
+        if self.next_before is not None:
+            self.load_page(self.next_before)
+            
+    def on_scroll(self, value):
+        if value == self.result_list.verticalScrollBar().maximum():
+            self.load_more()
+        
+    def load_page(self, before_id):
+        start = time.perf_counter()
+        entries, self.next_before = self.history.search(self.query, before_id)
+        elapsed = (time.perf_counter() - start) * 1000
+        for entry in entries:
+            created = time.strftime("%m-%d %H:%M", time.localtime(entry.created))
+            summary = " ".join(entry.source.split())
+            item = QListWidgetItem(f"{created}  {summary[:80]}")
+            item.setData(Qt.UserRole, entry)
+            self.result_list.addItem(item)
+        self.more_button.setEnabled(self.next_before is not None)
+        self.status_label.setText(f"已显示 {self.result_list.count()} 条（{elapsed:.1f} ms）")
+        
+    def show_detail(self, item, previous=None):
+        if item is None:
+            return
+        entry = item.data(Qt.UserRole)
+        info = entry.model or "未知模型"
+        if entry.latency_ms is not None:
+            info += f"，{entry.latency_ms:.0f} ms"
+        self.detail.setPlainText(f"{entry.source}\n\n{entry.result}\n\n({info})")
+        
+    def copy_entry(self, item):
+        signal_manager.copy_to_clipboard.emit(item.data(Qt.UserRole).result)
+
+# 翻译调度器在后台线程中创建，创建完成前按下热键会等待
+scheduler = None
+prefetcher = None
+backend_ready = threading.Event()
+
+def init_backend(config, clipboard_notified=()):
+    """
+    在后台线程中导入HTTP相关模块、创建翻译调度器并预热API连接
+
+    clipboard_notified为主线程会通过notify_clipboard_changed通知变化的来源
+    """
+    global scheduler, prefetcher
+    start = time.perf_counter()
+    from utils.llm import prewarm
+    from utils.scheduler import TranslationScheduler
+    from utils.prefetch import create_watcher
+    from utils.backends import warm_local_backend
+    from utils.history import get_history
+    from utils.daemon import start_daemon
+    
+    # 可选的预翻译：热键翻译进行中时让路
+    prefetcher = create_watcher(config, is_busy=lambda: scheduler.is_busy(), notified=clipboard_notified)
+    # 翻译调度器：限制并发数，只显示最新一次请求的结果
+    scheduler = TranslationScheduler(
+        on_result=signal_manager.translation_ready.emit,
+        on_delta=signal_manager.translation_delta.emit,
+        max_concurrent=config["max_concurrent_translations"],
+        deadline=config["translation_deadline_seconds"],
+        prefetcher=prefetcher,
+        history=get_history(config)
+    )
+    backend_ready.set()
+    # 可选的本地翻译服务，供脚本和编辑器插件使用
+    start_daemon(config, scheduler)
+    # 提前建立API连接，第一次翻译无需等待握手
+    prewarm(force=True)
+    # 加载本地翻译模型，之后一直保持加载状态
+    warm_local_backend(config)
+    if prefetcher is not None:
+        prefetcher.start()
+    metrics.record_startup(backend_ms=(time.perf_counter() - start) * 1000)
+
+def notify_clipboard_changed(source):
+    """Qt通知剪贴板或PRIMARY选区发生变化时转告预翻译，它只在变化后读取"""
+    if prefetcher is not None:
+        prefetcher.changed(source)
+
+def cancel_translations():
+    """关闭翻译窗口时中断进行中的翻译"""
+    if scheduler is not None:
+        scheduler.cancel_all()
+
 def handle_hotkey():
     """处理热键触发的翻译请求，从剪贴板获取文本"""
+    trace = metrics.Trace()
     try:
+        if backend_ready.is_set():
+            # 连接空闲过久时，在获取选中文本的同时重新建立API连接
+            from utils.llm import prewarm
+            prewarm()
         # 直接从剪贴板获取内容
-        selected_text = get_selected_text()
-        print("selected_text",selected_text)
-        logging.info(f"从剪贴板获取内容: {'有内容' if selected_text else '无内容'}")
+        with trace.span("capture"):
+            selected_text = get_selected_text()
+        logging.info(f"从剪贴板获取内容: {snippet(selected_text) if selected_text else '无内容'}")
         
         if selected_text and selected_text.strip():
             # 在主线程中显示窗口和设置状态
@@ -333,27 +609,15 @@ def handle_hotkey():
             signal_manager.show_window.emit()
             signal_manager.set_translating.emit()
             
-            # 在后台线程中执行翻译，避免阻塞UI
-            def do_translation():
-                try:
-                    result = translate_text(selected_text)
-                    # 通过信号更新翻译结果
-                    signal_manager.translation_ready.emit(result)
-                    # 不在线程中使用QSystemTrayIcon，改为设置一个标志
-                    logging.info("翻译完成")
-                except Exception as e:
-                    logging.error(f"翻译线程中发生错误: {str(e)}")
-                    signal_manager.translation_ready.emit(f"翻译过程中发生错误: {str(e)}")
-            
-            # 创建并启动线程
-            translation_thread = threading.Thread(target=do_translation)
-            translation_thread.daemon = True
-            translation_thread.start()
+            # 交给调度器在后台线程池中翻译，避免阻塞UI
+            backend_ready.wait()
+            scheduler.submit(selected_text, trace)
         else:
             # 提示用户先复制文本
             logging.warning("剪贴板中没有内容")
-            # 直接在主线程调用通知函数
-            tray_icon.showMessage(
+            trace.finish("empty")
+            # 托盘提示经信号在主线程中显示
+            signal_manager.tray_message.emit(
                 "划词翻译", 
                 "剪贴板中没有文本，请先选中并复制(Ctrl+C)文本",
                 QSystemTrayIcon.Warning, 
@@ -361,21 +625,69 @@ def handle_hotkey():
             )
     except Exception as e:
         logging.error(f"热键处理过程中发生错误: {str(e)}")
-        # 直接在主线程调用通知函数
-        tray_icon.showMessage(
+        signal_manager.tray_message.emit(
             "划词翻译出错", 
             f"发生错误: {str(e)}",
             QSystemTrayIcon.Critical, 
             3000
         )
 
+def on_hotkey_activated():
+    """
+    热键信号的处理函数，在主线程中执行
+
+    获取选中文本可能要等待修饰键松开和剪贴板变化，放到后台线程中进行，不阻塞界面。
+    """
+    threading.Thread(target=handle_hotkey, name="hotkey-capture", daemon=True).start()
+
+config_window = None
+
+def show_config_window():
+    """托盘“设置”菜单：设置窗口在第一次打开时才创建"""
+    global config_window
+    if config_window is None:
+        config_window = ConfigWindow()
+    else:
+        config_window.load_config()
+    config_window.show()
+    config_window.raise_()
+    config_window.activateWindow()
+
+history_window = None
+
+def show_history_window():
+    """托盘“历史记录”菜单"""
+    global history_window
+    from utils.history import get_history
+    history = get_history(get_config())
+    if history is None:
+        QMessageBox.information(None, "划词翻译", "翻译历史未启用（history_enabled）")
+        return
+    if history_window is None:
+        history_window = HistoryWindow(history)
+    history_window.show()
+    history_window.raise_()
+    history_window.activateWindow()
+
+def show_statistics():
+    """托盘“统计”菜单：显示各阶段耗时分位数、token用量和缓存命中情况"""
+    text = metrics.format_summary()
+    config = get_config()
+    if config["cache_enabled"]:
+        stats = get_cache(config).stats()
+        text += f"\n缓存: 命中 {stats['hits']} 次，未命中 {stats['misses']} 次，命中率 {stats['hit_rate']:.0%}"
+    text += "\n" + quota.format_spend(config)
+    box = QMessageBox()
+    box.setWindowTitle("划词翻译 - 统计")
+    box.setText(text)
+    box.setFont(QFont("Consolas", 10))
+    box.exec_()
 
 
 if __name__ == "__main__":
     # 全局异常处理
     def exception_hook(exctype, value, traceback):
-        print(f"未捕获的异常: {exctype}, {value}")
-        sys.__excepthook__(exctype, value, traceback)
+        logging.critical(f"未捕获的异常: {exctype.__name__}: {value}", exc_info=(exctype, value, traceback))
         # 对于严重错误，可以显示错误消息
         if exctype not in (KeyboardInterrupt,):  # 忽略键盘中断
             QMessageBox.critical(None, "错误", f"发生错误: {value}")
@@ -398,51 +710,109 @@ if __name__ == "__main__":
         tray_menu = QMenu()
         
         config_action = QAction("设置")
+        stats_action = QAction("统计")
+        history_action = QAction("历史记录")
         quit_action = QAction("退出")
+        # 今日API花费，打开菜单时刷新
+        spend_action = QAction("今日花费")
+        spend_action.setEnabled(False)
         
+        tray_menu.addAction(spend_action)
+        tray_menu.addSeparator()
         tray_menu.addAction(config_action)
+        tray_menu.addAction(history_action)
+        tray_menu.addAction(stats_action)
         tray_menu.addAction(quit_action)
         
         tray_icon.setContextMenu(tray_menu)
         tray_icon.show()
+        config = get_config()
+        metrics.configure(config)
+        metrics.record_startup(
+            import_ms=(IMPORTS_DONE - STARTUP_STARTED) * 1000,
+            tray_ms=(time.perf_counter() - STARTUP_STARTED) * 1000
+        )
         
-        # 创建窗口
-        config_window = ConfigWindow()
+        # 翻译窗口预先创建以便热键响应时立即显示；设置窗口在打开时才创建
         translation_window = TranslationWindow()
         
         # 连接信号
-        config_action.triggered.connect(config_window.show)
+        config_action.triggered.connect(show_config_window)
         quit_action.triggered.connect(app.quit)
+        stats_action.triggered.connect(show_statistics)
+        history_action.triggered.connect(show_history_window)
+        tray_menu.aboutToShow.connect(lambda: spend_action.setText(quota.format_spend(get_config())))
+        # 花费超过上限时在托盘提示（回调来自翻译线程，经信号转到主线程）
+        signal_manager.budget_warning.connect(
+            lambda message: tray_icon.showMessage("划词翻译", message, QSystemTrayIcon.Warning, 5000)
+        )
+        quota.set_budget_listener(signal_manager.budget_warning.emit)
+        signal_manager.tray_message.connect(tray_icon.showMessage)
         signal_manager.copy_to_clipboard.connect(lambda text: pyperclip.copy(text))
         signal_manager.show_window.connect(translation_window.show_at_cursor)
-        signal_manager.set_translating.connect(lambda: translation_window.text_display.setText("正在翻译..."))
+        signal_manager.set_translating.connect(translation_window.show_translating)
+        signal_manager.translation_delta.connect(translation_window.append_delta)
         
         # 添加翻译完成时的通知
-        def on_translation_ready(text):
+        def on_translation_ready(text, trace):
             # 先更新翻译窗口
-            translation_window.text_display.setText(text)
+            start = time.perf_counter()
+            translation_window.set_result(text)
+            if trace is not None:
+                trace.add("render", (time.perf_counter() - start) * 1000)
+                trace.finish("error" if "error" in trace.attributes else "ok")
         
         # 重新连接translation_ready信号
         signal_manager.translation_ready.disconnect()  # 断开原来的连接
         signal_manager.translation_ready.connect(on_translation_ready)
         
-        # 注册热键 - 只使用win+空格
-        keyboard.add_hotkey('win+space', handle_hotkey)
-        # 启动剪贴板监控线程 感觉没有什么用？？？
-        # clipboard_thread = threading.Thread(target=monitor_clipboard)
-        # clipboard_thread.daemon = True
-        # clipboard_thread.start()
+        # 关闭翻译窗口时中断进行中的翻译
+        translation_window.hidden.connect(cancel_translations)
+        
+        # 注册热键：只向系统注册这一个组合键，触发时经信号转到主线程
+        signal_manager.hotkey_activated.connect(on_hotkey_activated)
+        hotkey = create_hotkey(config, signal_manager.hotkey_activated.emit)
+        if hotkey is not None:
+            set_modifiers_check(hotkey.modifiers_pressed)
+            app.aboutToQuit.connect(hotkey.unregister)
+        metrics.record_startup(interactive_ms=(time.perf_counter() - STARTUP_STARTED) * 1000)
+        # build.py测量启动耗时时，热键可用后写出启动记录并退出
+        startup_report = os.environ.get("CUTENG_STARTUP_REPORT")
+        if startup_report:
+            with open(startup_report, 'w', encoding='utf-8') as f:
+                json.dump(metrics.registry.startup, f)
+            QTimer.singleShot(0, app.quit)
+        # Linux下由Qt通知剪贴板和PRIMARY选区的变化，预翻译不必每次轮询都启动子进程读取
+        clipboard_notified = ()
+        if sys.platform.startswith("linux"):
+            clipboard = app.clipboard()
+            clipboard.dataChanged.connect(lambda: notify_clipboard_changed("clipboard"))
+            clipboard_notified = ("clipboard",)
+            if clipboard.supportsSelection():
+                clipboard.selectionChanged.connect(lambda: notify_clipboard_changed("primary"))
+                clipboard_notified += ("primary",)
+        # 托盘和热键可用后再在后台准备翻译引擎
+        threading.Thread(target=init_backend, args=(config, clipboard_notified), name="init-backend",
+                         daemon=True).start()
         
         # 启动时显示托盘提示
-        tray_icon.showMessage(
-            "划词翻译已启动", 
-            "使用方法: 按Win+空格翻译",
-            QSystemTrayIcon.Information, 
-            300
-        )
+        if hotkey is not None:
+            tray_icon.showMessage(
+                "划词翻译已启动", 
+                f"使用方法: 按{hotkey.chord.display()}翻译",
+                QSystemTrayIcon.Information, 
+                300
+            )
+        else:
+            tray_icon.showMessage(
+                "划词翻译", 
+                f"无法注册热键 {config['hotkey']}，请在config.json中修改hotkey",
+                QSystemTrayIcon.Warning, 
+                5000
+            )
         
         sys.exit(app.exec_())
     except Exception as e:
-        print(f"发生致命错误: {e}")
+        logging.critical(f"发生致命错误: {e}", exc_info=True)
         QMessageBox.critical(None, "错误", f"发生致命错误: {e}")
         sys.exit(1) 
\ No newline at end of file
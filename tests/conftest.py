@@ -0,0 +1,75 @@
+"""
+测试公用的夹具
+
+每个测试都在独立的临时目录中运行：配置、缓存、翻译记忆库、花费记录和历史记录都使用其中的文件，
+熔断器、限流器等进程内的全局状态也会重置，测试之间互不影响。
+"""
+import copy
+
+import pytest
+
+from benchmarks.mock_server import MockOpenAIServer, MockSettings
+from utils import cache, config as config_module, history, quota, resilience, translation_memory
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(config_module, "CONFIG_FILE", str(tmp_path / "config.json"))
+    monkeypatch.setattr(config_module, "_snapshot", None)
+    monkeypatch.setattr(cache, "CACHE_FILE", str(tmp_path / "translation_cache.db"))
+    monkeypatch.setattr(cache, "_cache", None)
+    monkeypatch.setattr(translation_memory, "MEMORY_FILE", str(tmp_path / "translation_memory.db"))
+    monkeypatch.setattr(translation_memory, "_memory", None)
+    monkeypatch.setattr(history, "HISTORY_FILE", str(tmp_path / "history.db"))
+    monkeypatch.setattr(history, "_history", None)
+    monkeypatch.setattr(quota, "SPEND_FILE", str(tmp_path / "daily_spend.json"))
+    monkeypatch.setattr(quota, "_spend", None)
+    monkeypatch.setattr(quota, "_limiters", {})
+    monkeypatch.setattr(quota, "_notified", set())
+    monkeypatch.setattr(resilience, "_breakers", {})
+    monkeypatch.setattr(resilience, "_trackers", {})
+    yield tmp_path
+    # 临时目录删除之前写出花费记录并取消定时写入
+    if quota._spend is not None:
+        quota._spend.close()
+
+
+@pytest.fixture
+def mock_server():
+    """启动模拟接口的工厂：mock_server(latency_ms=..., error_rate=...)，测试结束后全部停止"""
+    servers = []
+
+    def start(**settings):
+        server = MockOpenAIServer(MockSettings(**settings)).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.stop()
+
+
+@pytest.fixture
+def make_config(workdir):
+    """生成指向模拟接口的配置：make_config(server, **overrides)，不使用缓存、记忆库和词典"""
+
+    def make(server, **overrides):
+        config = copy.deepcopy(config_module.DEFAULT_CONFIG)
+        config.update({
+            "api_base_url": server.base_url,
+            "api_key": "test",
+            "model": "mock-model",
+            "stream": False,
+            "cache_enabled": False,
+            "tm_enabled": False,
+            "history_enabled": False,
+            "quota_enabled": False,
+            "dictionary_file": str(workdir / "dictionary.db"),
+            "retry_base_delay_ms": 1,
+            "retry_max_delay_ms": 10
+        })
+        config.update(overrides)
+        return config
+
+    return make
@@ -0,0 +1,137 @@
+import json
+import time
+import threading
+
+import pytest
+
+from utils import llm, metrics, quota
+
+MESSAGES = [{"role": "user", "content": "hello"}]
+
+
+def test_rate_limiter_enforces_rpm():
+    limiter = quota.RateLimiter(rpm=3)
+    for _ in range(3):
+        limiter.acquire(1, timeout=0.1)
+    with pytest.raises(quota.QuotaExceeded):
+        limiter.acquire(1, timeout=0.1)
+
+
+def test_rate_limiter_adjusts_tokens_to_actual_usage():
+    limiter = quota.RateLimiter(tpm=1000)
+    limiter.acquire(600, timeout=0.1)
+    with pytest.raises(quota.QuotaExceeded):
+        limiter.acquire(600, timeout=0.1)
+    # 实际只用了100个token，多预留的额度退回
+    limiter.adjust(600, 100)
+    limiter.acquire(600, timeout=0.1)
+
+
+def test_interactive_requests_jump_the_queue():
+    limiter = quota.RateLimiter(rpm=60)
+    for _ in range(60):
+        limiter.acquire(1, timeout=0.1)
+    order = []
+
+    def acquire(name, priority):
+        limiter.acquire(1, priority, timeout=5)
+        order.append(name)
+
+    batch = threading.Thread(target=acquire, args=("batch", quota.BATCH))
+    batch.start()
+    time.sleep(0.1)
+    interactive = threading.Thread(target=acquire, args=("interactive", quota.INTERACTIVE))
+    interactive.start()
+    batch.join(5)
+    interactive.join(5)
+    assert order == ["interactive", "batch"]
+
+
+def test_daily_spend_merges_with_file(workdir):
+    path = str(workdir / "spend.json")
+    spend = quota.DailySpend(path, flush_interval=60)
+    spend.add(100, 50, 0.25)
+    # 另一个进程（如批量翻译）在此期间写入了花费
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({"date": spend.date, "prompt_tokens": 10, "completion_tokens": 5, "cost": 0.5}, f)
+    spend.close()
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    assert (data["prompt_tokens"], data["completion_tokens"], data["cost"]) == (110, 55, 0.75)
+    assert spend.snapshot()["cost"] == pytest.approx(0.75)
+
+
+def test_daily_spend_flushes_on_timer(workdir):
+    path = workdir / "spend.json"
+    spend = quota.DailySpend(str(path), flush_interval=0.05)
+    spend.add(1, 1, 0.01)
+    time.sleep(0.3)
+    assert json.loads(path.read_text(encoding='utf-8'))["prompt_tokens"] == 1
+    spend.close()
+
+
+def _config(**overrides):
+    config = {"daily_budget_soft": 0.0, "daily_budget_hard": 0.0}
+    config.update(overrides)
+    return config
+
+
+def test_budget_caps():
+    quota.get_spend().add(0, 0, 2.0)
+    quota.check_budget(_config(daily_budget_soft=5.0), quota.BATCH)
+    with pytest.raises(quota.QuotaExceeded):
+        quota.check_budget(_config(daily_budget_soft=1.0), quota.BATCH)
+    # 超过软上限后仍允许热键翻译
+    quota.check_budget(_config(daily_budget_soft=1.0), quota.INTERACTIVE)
+    with pytest.raises(quota.QuotaExceeded):
+        quota.check_budget(_config(daily_budget_hard=1.0), quota.INTERACTIVE)
+
+
+def test_budget_listener_notified_once_per_day():
+    messages = []
+    quota.set_budget_listener(messages.append)
+    try:
+        quota.get_spend().add(0, 0, 2.0)
+        for _ in range(3):
+            quota.check_budget(_config(daily_budget_soft=1.0), quota.INTERACTIVE)
+    finally:
+        quota.set_budget_listener(None)
+    assert len(messages) == 1
+
+
+def test_priority_follows_trace_source():
+    assert quota.current_priority() == quota.BATCH
+    metrics.use_trace(metrics.Trace("hotkey"))
+    try:
+        assert quota.current_priority() == quota.INTERACTIVE
+        metrics.use_trace(metrics.Trace("prefetch"))
+        assert quota.current_priority() == quota.BACKGROUND
+    finally:
+        metrics.use_trace(None)
+
+
+def test_requests_charge_reported_usage(mock_server, make_config):
+    server = mock_server(latency_ms=0)
+    config = make_config(server, quota_enabled=True, price_prompt_per_1k=1.0, price_completion_per_1k=2.0)
+    llm.chat_completion(MESSAGES, config, timeout=5)
+    spend = quota.get_spend().snapshot()
+    assert spend["prompt_tokens"] > 0 and spend["completion_tokens"] > 0
+    assert spend["cost"] == pytest.approx((spend["prompt_tokens"] + 2 * spend["completion_tokens"]) / 1000)
+
+
+def test_hard_cap_blocks_requests(mock_server, make_config):
+    server = mock_server(latency_ms=0)
+    config = make_config(server, quota_enabled=True, daily_budget_hard=1.0)
+    quota.get_spend().add(0, 0, 1.5)
+    with pytest.raises(quota.QuotaExceeded):
+        llm.chat_completion(MESSAGES, config, timeout=5)
+    assert server.request_count == 0
+
+
+def test_rate_limit_wait_times_out(mock_server, make_config):
+    server = mock_server(latency_ms=0)
+    config = make_config(server, quota_enabled=True, rate_limit_rpm=1, rate_limit_max_wait_seconds=0.1)
+    llm.chat_completion(MESSAGES, config, timeout=5)
+    with pytest.raises(quota.QuotaExceeded):
+        llm.chat_completion(MESSAGES, config, timeout=5)
+    assert server.request_count == 1
@@ -0,0 +1,187 @@
+import time
+import random
+import contextvars
+
+import pytest
+import requests
+
+from utils import llm
+from utils.resilience import (AllEndpointsUnavailable, CircuitBreaker, backoff_delay, get_endpoints,
+                              get_latency_tracker, parse_retry_after)
+
+MESSAGES = [{"role": "user", "content": "hello"}]
+
+
+def _seed_failing_first(failures, error_rate=0.5):
+    """返回一个随机种子，使模拟接口的前failures次请求出错、下一次成功"""
+    for seed in range(10000):
+        rng = random.Random(seed)
+        draws = [rng.random() for _ in range(failures + 1)]
+        if all(draw < error_rate for draw in draws[:-1]) and draws[-1] >= error_rate:
+            return seed
+    raise AssertionError("找不到合适的随机种子")
+
+
+def _run_async(coro):
+    return llm.get_async_client().submit(coro).result(timeout=10)
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("2") == 2.0
+    assert parse_retry_after("-1") == 0.0
+    assert parse_retry_after("") is None
+    assert parse_retry_after("soon") is None
+    assert 0 < parse_retry_after(time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.gmtime(time.time() + 60))) <= 60
+
+
+def test_backoff_delay_respects_bounds_and_retry_after():
+    for attempt in range(6):
+        assert 0 <= backoff_delay(attempt, 0.5, 8) <= min(8, 0.5 * 2 ** attempt)
+    assert backoff_delay(0, 0.01, 8, retry_after=3) >= 3
+    # Retry-After也不超过最大等待时间
+    assert backoff_delay(0, 0.01, 1, retry_after=30) <= 1
+
+
+def test_retries_transient_errors(mock_server, make_config):
+    server = mock_server(latency_ms=0, error_rate=0.5, seed=_seed_failing_first(2))
+    result = llm.chat_completion(MESSAGES, make_config(server), timeout=5)
+    assert result.startswith("译文")
+    assert server.request_count == 3
+
+
+def test_gives_up_after_max_attempts(mock_server, make_config):
+    server = mock_server(latency_ms=0, error_rate=1.0)
+    with pytest.raises(requests.exceptions.HTTPError):
+        llm.chat_completion(MESSAGES, make_config(server, retry_max_attempts=3), timeout=5)
+    assert server.request_count == 3
+
+
+def test_does_not_retry_client_errors(mock_server, make_config):
+    server = mock_server(latency_ms=0, error_rate=1.0, error_status=400)
+    with pytest.raises(requests.exceptions.HTTPError):
+        llm.chat_completion(MESSAGES, make_config(server), timeout=5)
+    assert server.request_count == 1
+
+
+def test_waits_for_retry_after(mock_server, make_config):
+    server = mock_server(latency_ms=0, error_rate=1.0, error_status=429, retry_after=0.3)
+    config = make_config(server, retry_max_attempts=2, retry_max_delay_ms=1000)
+    start = time.monotonic()
+    with pytest.raises(requests.exceptions.HTTPError):
+        llm.chat_completion(MESSAGES, config, timeout=5)
+    assert time.monotonic() - start >= 0.3
+    assert server.request_count == 2
+
+
+def test_breaker_opens_and_probes_once():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.is_open and not breaker.allow()
+
+    time.sleep(0.06)
+    # 熔断超时后只放行一次试探请求
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert not breaker.allow()
+
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_success()
+    assert not breaker.is_open and breaker.allow()
+
+
+def test_breaker_release_probe():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert not breaker.allow()
+    # 试探请求被取消后，下一次请求可以重新试探
+    breaker.release_probe()
+    assert breaker.allow()
+
+
+def test_open_breaker_skips_endpoint(mock_server, make_config):
+    server = mock_server(latency_ms=0, error_rate=1.0)
+    config = make_config(server, retry_max_attempts=1, circuit_failure_threshold=1, circuit_reset_seconds=60)
+    with pytest.raises(requests.exceptions.HTTPError):
+        llm.chat_completion(MESSAGES, config, timeout=5)
+    with pytest.raises(AllEndpointsUnavailable):
+        llm.chat_completion(MESSAGES, config, timeout=5)
+    assert server.request_count == 1
+
+
+def test_get_endpoints_marks_fallbacks(mock_server, make_config):
+    primary, secondary = mock_server(), mock_server()
+    config = make_config(primary, endpoints=[{"api_base_url": primary.base_url},
+                                             {"api_base_url": secondary.base_url, "model": "backup"}])
+    endpoints = get_endpoints(config)
+    assert [endpoint["fallback"] for endpoint in endpoints] == [False, True]
+    assert endpoints[1]["model"] == "backup" and endpoints[1]["api_key"] == "test"
+
+
+def test_failover_to_next_endpoint(mock_server, make_config):
+    primary = mock_server(latency_ms=0, error_rate=1.0)
+    secondary = mock_server(latency_ms=0)
+    config = make_config(primary, endpoints=[{"api_base_url": primary.base_url},
+                                             {"api_base_url": secondary.base_url}])
+
+    def translate():
+        served = llm.track_fallback()
+        return llm.chat_completion(MESSAGES, config, timeout=5), served.fallback
+
+    # 在独立的上下文中记录备用端点，不影响之后的测试
+    result, fallback = contextvars.copy_context().run(translate)
+    assert result.startswith("译文")
+    assert fallback
+    assert primary.request_count == config["retry_max_attempts"]
+    assert secondary.request_count == 1
+
+
+def test_async_failover_to_next_endpoint(mock_server, make_config):
+    primary = mock_server(latency_ms=0, error_rate=1.0)
+    secondary = mock_server(latency_ms=0)
+    config = make_config(primary, endpoints=[{"api_base_url": primary.base_url},
+                                             {"api_base_url": secondary.base_url}])
+
+    async def translate():
+        served = llm.track_fallback()
+        result = await llm.get_async_client().chat_completion(MESSAGES, config, timeout=5)
+        return result, served.fallback
+
+    result, fallback = _run_async(translate())
+    assert result.startswith("译文")
+    assert fallback
+    assert secondary.request_count == 1
+
+
+def test_hedges_slow_primary(mock_server, make_config):
+    primary = mock_server(latency_ms=2000)
+    secondary = mock_server(latency_ms=0)
+    config = make_config(primary, hedge_enabled=True, hedge_min_samples=5,
+                         endpoints=[{"api_base_url": primary.base_url},
+                                    {"api_base_url": secondary.base_url}])
+    tracker = get_latency_tracker(get_endpoints(config)[0], False)
+    for _ in range(5):
+        tracker.record(0.05)
+
+    start = time.monotonic()
+    result = _run_async(llm.get_async_client().chat_completion(MESSAGES, config, timeout=5))
+    assert result.startswith("译文")
+    # 主端点超过p95（约50毫秒）仍未返回，由备用端点的对冲请求先完成
+    assert time.monotonic() - start < 1.5
+    assert primary.request_count == 1
+    assert secondary.request_count == 1
+
+
+def test_no_hedge_without_enough_samples(mock_server, make_config):
+    primary = mock_server(latency_ms=100)
+    secondary = mock_server(latency_ms=0)
+    config = make_config(primary, hedge_enabled=True, hedge_min_samples=5,
+                         endpoints=[{"api_base_url": primary.base_url},
+                                    {"api_base_url": secondary.base_url}])
+    assert _run_async(llm.get_async_client().chat_completion(MESSAGES, config, timeout=5)).startswith("译文")
+    assert secondary.request_count == 0
@@ -0,0 +1,80 @@
+import time
+import threading
+
+import pytest
+
+from utils import llm
+from utils.config import save_config
+from utils.scheduler import TranslationScheduler
+
+
+class _Results:
+    """收集送达界面的翻译结果"""
+
+    def __init__(self):
+        self.items = []
+        self.event = threading.Event()
+
+    def __call__(self, result, trace):
+        self.items.append(result)
+        self.event.set()
+
+
+@pytest.fixture
+def server(mock_server, make_config):
+    server = mock_server(latency_ms=300)
+    save_config(make_config(server))
+    return server
+
+
+@pytest.fixture
+def results():
+    return _Results()
+
+
+def _scheduler(results, **kwargs):
+    return TranslationScheduler(on_result=results, client=llm.get_async_client(), **kwargs)
+
+
+def test_same_text_shares_one_request(server, results):
+    scheduler = _scheduler(results)
+    first = scheduler.submit("Hello world")
+    second = scheduler.submit("Hello  world")
+    assert second == first + 1
+    assert results.event.wait(5)
+    time.sleep(0.1)
+    # 两次提交共用同一个请求，被取代的第一次不再送达
+    assert server.request_count == 1
+    assert len(results.items) == 1 and results.items[0].startswith("译文")
+
+
+def test_newer_request_supersedes_older(server, results):
+    scheduler = _scheduler(results)
+    scheduler.submit("First sentence")
+    time.sleep(0.05)
+    scheduler.submit("Second sentence")
+    assert results.event.wait(5)
+    time.sleep(0.4)
+    assert len(results.items) == 1
+    assert "ecnetnes dnoceS" in results.items[0]
+
+
+def test_cancel_all_drops_results(server, results):
+    scheduler = _scheduler(results)
+    scheduler.submit("Hello world")
+    time.sleep(0.05)
+    assert scheduler.is_busy()
+    scheduler.cancel_all()
+    assert not scheduler.is_busy()
+    assert not results.event.wait(0.6)
+
+
+def test_translate_shares_concurrency_limit(server, results):
+    scheduler = _scheduler(results, max_concurrent=1)
+    start = time.monotonic()
+    futures = [scheduler.translate(f"Sentence number {i}") for i in range(2)]
+    assert all(future.result(timeout=5).startswith("译文") for future in futures)
+    # 并发上限为1时两次请求依次进行
+    assert time.monotonic() - start >= 0.6
+    # translate()不参与代号和取消，结果也不送达界面
+    assert not results.items
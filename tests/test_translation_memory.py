@@ -0,0 +1,119 @@
+import sqlite3
+
+import pytest
+
+from utils import llm
+from utils.translation_memory import TranslationMemory, get_memory, minhash, similarity, _fuzzy_form
+
+
+@pytest.fixture
+def memory(workdir):
+    return TranslationMemory(str(workdir / "memory.db"))
+
+
+def test_exact_lookup_ignores_whitespace_and_case(memory):
+    memory.add("Build finished in 12 seconds", "构建在12秒内完成", "zh", "mock-model", 2)
+    match = memory.lookup("build  finished in 12 SECONDS", "zh")
+    assert match.exact and match.score == 1.0
+    assert (match.target, match.model, match.prompt_version) == ("构建在12秒内完成", "mock-model", 2)
+
+
+def test_fuzzy_lookup_finds_similar_segments(memory):
+    memory.add("Build finished in 12 seconds", "构建在12秒内完成", "zh")
+    match = memory.lookup("Build finished in 31 seconds", "zh")
+    assert not match.exact
+    assert match.score >= 0.7 and not match.same_numbers
+    assert memory.lookup("Completely unrelated sentence here", "zh") is None
+
+
+def test_lookup_respects_threshold(memory):
+    memory.add("The server is running on port 8080", "服务器运行在8080端口", "zh")
+    text = "The server was stopped on port 8080 yesterday"
+    score = similarity(_fuzzy_form(text), _fuzzy_form("The server is running on port 8080"))
+    assert memory.lookup(text, "zh", threshold=score + 0.01) is None
+
+
+def test_directions_are_separate(memory):
+    memory.add("Hello world", "你好，世界", "zh")
+    assert memory.lookup("Hello world", "en") is None
+    assert memory.lookup("Hello world", "zh").target == "你好，世界"
+
+
+def test_newer_translation_replaces_older(memory):
+    memory.add("Hello world", "你好世界", "zh", "old-model", 1)
+    memory.add("Hello world", "你好，世界", "zh", "new-model", 2)
+    match = memory.lookup("Hello world", "zh")
+    assert (match.target, match.model, match.prompt_version) == ("你好，世界", "new-model", 2)
+
+
+def test_minhash_is_stable():
+    form = _fuzzy_form("Build finished in 12 seconds")
+    assert minhash(form) == minhash(_fuzzy_form("build finished in 99 seconds"))
+
+
+def _create_legacy(path, version):
+    db = sqlite3.connect(path)
+    if version == 1:
+        db.execute("CREATE TABLE segments (id INTEGER PRIMARY KEY, source TEXT NOT NULL, target TEXT NOT NULL, "
+                   "key TEXT NOT NULL UNIQUE, form TEXT NOT NULL, created REAL NOT NULL)")
+        db.execute("INSERT INTO segments (source, target, key, form, created) "
+                   "VALUES ('Hello world', '你好世界', 'hello world', 'hello world', 1)")
+    else:
+        db.execute("CREATE TABLE segments (id INTEGER PRIMARY KEY, source TEXT NOT NULL, target TEXT NOT NULL, "
+                   "target_lang TEXT NOT NULL, key TEXT NOT NULL, form TEXT NOT NULL, created REAL NOT NULL, "
+                   "UNIQUE (target_lang, key))")
+        db.execute("INSERT INTO segments (source, target, target_lang, key, form, created) "
+                   "VALUES ('Hello world', '你好世界', 'zh', 'hello world', 'hello world', 1)")
+    db.execute("CREATE TABLE buckets (key INTEGER NOT NULL, segment_id INTEGER NOT NULL, "
+               "PRIMARY KEY (key, segment_id)) WITHOUT ROWID")
+    db.execute(f"PRAGMA user_version = {version}")
+    db.commit()
+    db.close()
+
+
+@pytest.mark.parametrize("version", [1, 2])
+def test_migrates_old_schema(workdir, version):
+    path = str(workdir / f"memory_v{version}.db")
+    _create_legacy(path, version)
+    memory = TranslationMemory(path)
+    match = memory.lookup("Hello world", "zh")
+    assert match.exact and match.target == "你好世界"
+    # 旧记录不知道来自哪个模型，只作为参考
+    assert (match.model, match.prompt_version) == ("", 0)
+    if version == 1:
+        # 第1版升级时重建了分桶索引，记录可以被模糊查找到
+        assert memory.lookup("Hello worlds", "zh").target == "你好世界"
+    memory.add("Hello world", "你好，世界", "zh", "mock-model", 2)
+    reopened = TranslationMemory(path)
+    assert reopened.lookup("Hello world", "zh").model == "mock-model"
+
+
+def test_import_pairs_are_reference_only(memory):
+    assert memory.import_pairs([("Hello world", "你好，世界"), ("你好", "Hello")]) == 2
+    assert memory.lookup("Hello world", "zh").model == ""
+    assert memory.lookup("你好", "en").target == "Hello"
+
+
+@pytest.fixture
+def tm_config(mock_server, make_config):
+    return make_config(mock_server(), tm_enabled=True)
+
+
+def test_exact_match_reused_for_same_model_and_prompt(tm_config):
+    get_memory(tm_config).add("Hello world", "你好，世界", "zh", tm_config["model"], llm.PROMPT_VERSION)
+    translation, messages = llm._prepare("Hello world", tm_config)
+    assert translation == "你好，世界" and messages is None
+
+
+@pytest.mark.parametrize("model, prompt_version", [("other-model", llm.PROMPT_VERSION), ("mock-model", 0)])
+def test_exact_match_from_other_model_or_prompt_is_reference(tm_config, model, prompt_version):
+    get_memory(tm_config).add("Hello world", "你好，世界", "zh", model, prompt_version)
+    translation, messages = llm._prepare("Hello world", tm_config)
+    assert translation is None
+    assert "你好，世界" in messages[-1]["content"]
+
+
+def test_new_translations_are_remembered_with_model(tm_config):
+    llm._remember("Hello world", "你好，世界", tm_config)
+    match = get_memory(tm_config).lookup("Hello world", "zh")
+    assert (match.model, match.prompt_version) == (tm_config["model"], llm.PROMPT_VERSION)
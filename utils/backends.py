@@ -0,0 +1,217 @@
+"""
+翻译后端
+
+远程的OpenAI兼容接口（由utils.llm直接调用）之外，还可以使用本机的模型：
+
+- llama_cpp: 本机运行的llama.cpp服务（llama-server，提供OpenAI兼容接口），
+  模型由服务常驻内存，并发请求由服务端连续批处理
+- ctranslate2: 进程内运行的MarianMT模型（如opus-mt-en-zh/zh-en转换为CTranslate2格式），
+  仅用CPU，首次使用前加载一次，并发请求在后台线程中合并成批次翻译
+
+较短的文本（不超过local_max_chars）交给本地后端，较长或本地翻译失败的文本仍走远程API。
+"""
+import os
+import queue
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future
+
+from utils.cache import normalize_text
+from utils.langdetect import detect, choose_target
+
+try:
+    import ctranslate2
+    import sentencepiece
+except ImportError:
+    # 未安装时ctranslate2后端不可用
+    ctranslate2 = None
+    sentencepiece = None
+
+
+class TranslationBackend:
+    """
+    翻译后端接口
+
+    translate()在调用线程中同步翻译，translate_async()在事件循环中使用；
+    cache_id用于区分不同后端的缓存结果。
+    """
+    name = ""
+
+    def __init__(self, config):
+        self.config = config
+
+    @property
+    def cache_id(self):
+        """返回(模型, 地址)，参与缓存键的计算"""
+        return (self.name, "local")
+
+    def available(self):
+        return True
+
+    def warm(self):
+        """预先加载模型或建立连接"""
+
+    def translate(self, text, on_delta=None, timeout=10):
+        raise NotImplementedError
+
+    async def translate_async(self, text, on_delta=None, timeout=10):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.translate, text, on_delta, timeout)
+
+
+class CTranslate2Backend(TranslationBackend):
+    """
+    进程内的CTranslate2机器翻译模型
+
+    模型目录由ct2-transformers-converter转换得到，需包含source.spm和target.spm
+    （转换时加--copy_files source.spm target.spm）。请求先放入队列，后台线程等待
+    local_batch_window_ms收集同一时间到达的请求，再按方向合并成一个批次翻译。
+    """
+    name = "ctranslate2"
+
+    def __init__(self, config):
+        super().__init__(config)
+        self._models = {}
+        self._load_lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._worker = None
+
+    @property
+    def cache_id(self):
+        return (self.name, self.config["local_ct2_en_zh_model"] + "|" + self.config["local_ct2_zh_en_model"])
+
+    def _model_dir(self, direction):
+        return self.config["local_ct2_en_zh_model" if direction == "en-zh" else "local_ct2_zh_en_model"]
+
+    def available(self):
+        if ctranslate2 is None:
+            return False
+        return any(os.path.isdir(self._model_dir(direction)) for direction in ("en-zh", "zh-en"))
+
+    def _load(self, direction):
+        """加载指定方向的模型，只加载一次"""
+        with self._load_lock:
+            model = self._models.get(direction)
+            if model is not None:
+                return model
+            model_dir = self._model_dir(direction)
+            if not os.path.isdir(model_dir):
+                raise RuntimeError(f"未配置{direction}方向的本地模型")
+            translator = ctranslate2.Translator(
+                model_dir, device="cpu", inter_threads=1,
+                intra_threads=self.config["local_ct2_threads"]
+            )
+            source = sentencepiece.SentencePieceProcessor(model_file=os.path.join(model_dir, "source.spm"))
+            target = sentencepiece.SentencePieceProcessor(model_file=os.path.join(model_dir, "target.spm"))
+            prefix = self.config["local_ct2_en_zh_prefix"] if direction == "en-zh" else ""
+            model = (translator, source, target, prefix)
+            self._models[direction] = model
+            logging.info(f"已加载本地翻译模型: {model_dir}")
+            return model
+
+    def warm(self):
+        for direction in ("en-zh", "zh-en"):
+            if os.path.isdir(self._model_dir(direction)):
+                self._load(direction)
+        self._ensure_worker()
+
+    def _ensure_worker(self):
+        if self._worker is None:
+            with self._load_lock:
+                if self._worker is None:
+                    self._worker = threading.Thread(target=self._run, name="ct2-batcher", daemon=True)
+                    self._worker.start()
+
+    def submit(self, text):
+        """提交一条翻译请求，返回concurrent.futures.Future"""
+        self._ensure_worker()
+        future = Future()
+        target = choose_target(detect(text), self.config["target_language"])
+        direction = "zh-en" if target == "en" else "en-zh"
+        self._queue.put((direction, normalize_text(text), future))
+        return future
+
+    def translate(self, text, on_delta=None, timeout=10):
+        return self.submit(text).result(timeout)
+
+    async def translate_async(self, text, on_delta=None, timeout=10):
+        return await asyncio.wait_for(asyncio.wrap_future(self.submit(text)), timeout)
+
+    def _run(self):
+        window = self.config["local_batch_window_ms"] / 1000
+        max_batch = self.config["local_batch_max"]
+        while True:
+            batch = [self._queue.get()]
+            # 收集同一时间窗口内到达的其他请求
+            try:
+                while len(batch) < max_batch:
+                    batch.append(self._queue.get(timeout=window))
+            except queue.Empty:
+                pass
+            for direction in ("en-zh", "zh-en"):
+                items = [item for item in batch if item[0] == direction and item[2].set_running_or_notify_cancel()]
+                if items:
+                    self._translate_batch(direction, items)
+
+    def _translate_batch(self, direction, items):
+        try:
+            translator, source, target, prefix = self._load(direction)
+            tokens = [([prefix] if prefix else []) + source.encode(text, out_type=str) for _, text, _ in items]
+            results = translator.translate_batch(tokens, beam_size=2, max_batch_size=len(tokens))
+        except Exception as e:
+            for _, _, future in items:
+                future.set_exception(e)
+            return
+        for (_, _, future), result in zip(items, results):
+            future.set_result(target.decode(result.hypotheses[0]))
+
+
+_factories = {"ctranslate2": CTranslate2Backend}
+_instances = {}
+_instances_lock = threading.Lock()
+
+
+def register_backend(name, factory):
+    """注册后端，factory接收配置并返回TranslationBackend实例"""
+    _factories[name] = factory
+
+
+def get_backend(name, config):
+    """获取指定名称的后端实例（每种后端只创建一次），未知名称返回None"""
+    backend = _instances.get(name)
+    if backend is None:
+        factory = _factories.get(name)
+        if factory is None:
+            logging.error(f"未知的翻译后端: {name}")
+            return None
+        with _instances_lock:
+            backend = _instances.get(name)
+            if backend is None:
+                backend = factory(config)
+                _instances[name] = backend
+    backend.config = config
+    return backend
+
+
+def route(text, config):
+    """返回应使用的本地后端名称，应交给远程API时返回None"""
+    name = config["local_backend"]
+    if not name or len(normalize_text(text)) > config["local_max_chars"]:
+        return None
+    return name
+
+
+def warm_local_backend(config):
+    """启动时在后台加载本地模型，之后一直保持加载状态"""
+    name = config["local_backend"]
+    if not name:
+        return
+    backend = get_backend(name, config)
+    if backend is None or not backend.available():
+        logging.warning(f"本地翻译后端不可用: {name}")
+        return
+    try:
+        backend.warm()
+    except Exception as e:
+        logging.error(f"加载本地翻译后端失败: {str(e)}")
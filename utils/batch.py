@@ -0,0 +1,288 @@
+"""
+批量翻译命令行工具
+
+不启动图形界面，直接对文件或标准输入中的文本逐行翻译，例如：
+
+    python -m utils.batch glossary.txt -o glossary.zh.txt
+    python -m utils.batch strings.jsonl --jsonl --field text -o strings.out.jsonl
+    cat lines.txt | python -m utils.batch --concurrency 8
+
+多条较短的文本按翻译方向分组，用编号标记打包进同一次请求，返回后再按标记拆分；
+多个请求并发执行，结果按输入顺序逐批写出。
+"""
+import re
+import sys
+import json
+import logging
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.config import get_config
+from utils.cache import get_cache
+from utils.llm import (TRANSLATION_SYSTEM_PROMPT, DIRECTION_PROMPTS, cache_key_for, chat_completion,
+                       track_fallback, _untranslatable, _lookup_dictionary, _target_language, _prepare,
+                       _single_config, _remember)
+
+# 批量翻译提示词：在翻译方向的提示词之后说明打包格式
+BATCH_INSTRUCTIONS = """
+输入包含多段文本，每段以<<<编号>>>开头。请逐段翻译，每段译文前保留原来的<<<编号>>>标记，
+不要合并、拆分或遗漏任何一段
+"""
+
+_MARKER_PATTERN = re.compile(r"<<<(\d+)>>>")
+
+
+def pack_segments(segments):
+    """将多段文本用编号标记拼接成一条请求内容"""
+    return "\n".join(f"<<<{i}>>>\n{segment}" for i, segment in enumerate(segments, 1))
+
+
+def split_response(content, count):
+    """按编号标记拆分模型返回的内容，段数或编号不符时返回None"""
+    pieces = _MARKER_PATTERN.split(content)
+    # split结果为: [前缀, 编号1, 内容1, 编号2, 内容2, ...]
+    numbers = [int(n) for n in pieces[1::2]]
+    if numbers != list(range(1, count + 1)):
+        return None
+    return [piece.strip() for piece in pieces[2::2]]
+
+
+def _batch_messages(texts, target):
+    prompt = DIRECTION_PROMPTS.get(target, TRANSLATION_SYSTEM_PROMPT)
+    return [
+        {"role": "system", "content": prompt.rstrip("\n") + "\n" + BATCH_INSTRUCTIONS},
+        {"role": "user", "content": pack_segments(texts)}
+    ]
+
+
+def _plan(segments, config):
+    """
+    处理不需要请求的文本，并把其余文本按翻译方向分组
+
+    与translate_text相同：不需要翻译的文本原样返回，单词和短语先查离线词典，再查缓存。
+
+    Returns:
+        (结果列表, {目标语言: 待翻译的下标列表}, 缓存实例, 缓存键列表)
+    """
+    results = [None] * len(segments)
+    cache = get_cache(config) if config["cache_enabled"] else None
+    keys = [cache_key_for(s, config) for s in segments]
+
+    groups = {}
+    for i, segment in enumerate(segments):
+        if not segment.strip() or (config["skip_untranslatable"] and _untranslatable(segment, config)):
+            results[i] = (segment, None)
+            continue
+        entry = _lookup_dictionary(segment, config)
+        cached = entry if entry is not None else cache.get(keys[i]) if cache is not None else None
+        if cached is not None:
+            results[i] = (cached, None)
+        else:
+            groups.setdefault(_target_language(segment, config), []).append(i)
+    return results, groups, cache, keys
+
+
+def _single_failed(e):
+    logging.error(f"翻译失败: {str(e)}")
+    return "", str(e)
+
+
+def translate_segments(segments, config):
+    """
+    翻译一组文本，返回与输入一一对应的(译文, 错误信息)列表
+
+    已缓存的文本直接取缓存，其余按翻译方向打包，每个方向一次请求；
+    拆分失败时逐条重新翻译（与热键翻译使用相同的提示词和翻译记忆库）。
+    """
+    results, groups, cache, keys = _plan(segments, config)
+    served = track_fallback()
+
+    for target, pending in groups.items():
+        translations = None
+        if len(pending) > 1:
+            messages = _batch_messages([segments[i] for i in pending], target)
+            try:
+                translations = split_response(chat_completion(messages, config, timeout=60), len(pending))
+                if translations is None:
+                    logging.warning(f"批量翻译结果无法按标记拆分，改为逐条翻译 ({len(pending)} 条)")
+            except Exception as e:
+                logging.warning(f"批量翻译请求失败，改为逐条翻译: {str(e)}")
+
+        for n, i in enumerate(pending):
+            if translations is not None:
+                results[i] = (translations[n], None)
+            else:
+                try:
+                    translation, messages = _prepare(segments[i], config, target=target)
+                    if translation is None:
+                        translation = chat_completion(messages, _single_config(segments[i], config), timeout=60)
+                        _remember(segments[i], translation, config, target)
+                    results[i] = (translation, None)
+                except Exception as e:
+                    results[i] = _single_failed(e)
+                    continue
+            # 由备用端点完成的译文不以主端点模型的缓存键保存
+            if cache is not None and not served.fallback:
+                cache.put(keys[i], results[i][0])
+    return results
+
+
+async def translate_segments_async(segments, config, client):
+    """
+    translate_segments的异步版本，通过异步客户端（AsyncLLMClient）发送请求
+
+    供本地翻译服务使用，与热键翻译共用连接池；并发上限由调用方控制。
+    """
+    results, groups, cache, keys = _plan(segments, config)
+    served = track_fallback()
+
+    for target, pending in groups.items():
+        translations = None
+        if len(pending) > 1:
+            messages = _batch_messages([segments[i] for i in pending], target)
+            try:
+                translations = split_response(await client.chat_completion(messages, config, timeout=60),
+                                              len(pending))
+                if translations is None:
+                    logging.warning(f"批量翻译结果无法按标记拆分，改为逐条翻译 ({len(pending)} 条)")
+            except Exception as e:
+                logging.warning(f"批量翻译请求失败，改为逐条翻译: {str(e)}")
+
+        for n, i in enumerate(pending):
+            if translations is not None:
+                results[i] = (translations[n], None)
+            else:
+                try:
+                    translation, messages = await client._blocking(_prepare, segments[i], config, "", target)
+                    if translation is None:
+                        translation = await client.chat_completion(
+                            messages, _single_config(segments[i], config), timeout=60)
+                        client._remember_later(segments[i], translation, config, target)
+                    results[i] = (translation, None)
+                except Exception as e:
+                    results[i] = _single_failed(e)
+                    continue
+            # 由备用端点完成的译文不以主端点模型的缓存键保存
+            if cache is not None and not served.fallback:
+                cache.put(keys[i], results[i][0])
+    return results
+
+
+def _read_records(streams, jsonl, field):
+    """逐条读取输入，返回(原始记录, 待翻译文本)"""
+    for stream in streams:
+        for line in stream:
+            line = line.rstrip("\r\n")
+            if not jsonl:
+                yield line, line
+            elif line.strip():
+                record = json.loads(line)
+                yield record, str(record.get(field, ""))
+
+
+def _group_records(records, batch_size, max_chars):
+    """把连续的记录打包成组，每组不超过batch_size条且总长度不超过max_chars"""
+    group = []
+    chars = 0
+    for record in records:
+        length = len(record[1])
+        if group and (len(group) >= batch_size or chars + length > max_chars):
+            yield group
+            group = []
+            chars = 0
+        group.append(record)
+        chars += length
+    if group:
+        yield group
+
+
+def run_batch(inputs, output, jsonl=False, field="text", output_field="translation",
+              batch_size=20, max_chars=2000, concurrency=4, config=None):
+    """
+    批量翻译inputs中的所有记录并按输入顺序写入output
+
+    Returns:
+        (成功条数, 失败条数)
+    """
+    config = config or get_config()
+    succeeded = failed = 0
+    # 限制已提交但未写出的组数，避免一次性把整个文件读入内存
+    window = deque()
+
+    def write_group(group, future):
+        nonlocal succeeded, failed
+        for (record, text), (translation, error) in zip(group, future.result()):
+            if error is None:
+                succeeded += 1
+            else:
+                failed += 1
+            if jsonl:
+                record[output_field] = translation
+                if error is not None:
+                    record["error"] = error
+                output.write(json.dumps(record, ensure_ascii=False) + "\n")
+            else:
+                output.write(translation.replace("\n", " ") + "\n")
+        output.flush()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for group in _group_records(_read_records(inputs, jsonl, field), batch_size, max_chars):
+            future = executor.submit(translate_segments, [text for _, text in group], config)
+            window.append((group, future))
+            while window and (len(window) > concurrency * 2 or window[0][1].done()):
+                write_group(*window.popleft())
+        while window:
+            write_group(*window.popleft())
+    return succeeded, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="CutEng批量翻译")
+    parser.add_argument("inputs", nargs="*", help="输入文件，省略时从标准输入读取")
+    parser.add_argument("-o", "--output", help="输出文件，省略时写到标准输出")
+    parser.add_argument("--jsonl", action="store_true", help="输入输出均为JSONL格式")
+    parser.add_argument("--field", default="text", help="JSONL中待翻译文本的字段名")
+    parser.add_argument("--output-field", default="translation", help="JSONL中写入译文的字段名")
+    parser.add_argument("--batch-size", type=int, default=20, help="每次请求最多打包的文本条数")
+    parser.add_argument("--max-chars", type=int, default=2000, help="每次请求打包文本的最大总字符数")
+    parser.add_argument("--concurrency", type=int, default=4, help="同时进行的请求数")
+    parser.add_argument("-v", "--verbose", action="store_true", help="输出详细日志")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.WARNING,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+
+    config = get_config()
+    if not config["api_key"]:
+        print("错误: 请先在config.json中设置API密钥", file=sys.stderr)
+        return 1
+
+    inputs = [open(path, 'r', encoding='utf-8') for path in args.inputs] or [sys.stdin]
+    output = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    try:
+        succeeded, failed = run_batch(
+            inputs, output,
+            jsonl=args.jsonl,
+            field=args.field,
+            output_field=args.output_field,
+            batch_size=args.batch_size,
+            max_chars=args.max_chars,
+            concurrency=args.concurrency,
+            config=config
+        )
+    finally:
+        for stream in inputs:
+            if stream is not sys.stdin:
+                stream.close()
+        if output is not sys.stdout:
+            output.close()
+
+    print(f"完成: 成功 {succeeded} 条，失败 {failed} 条", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,216 @@
+import time
+import atexit
+import sqlite3
+import hashlib
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+
+# 缓存数据库路径
+CACHE_FILE = "translation_cache.db"
+
+
+def normalize_text(text):
+    """规范化待翻译文本：统一全半角、去除首尾空白并合并连续空白"""
+    text = unicodedata.normalize("NFKC", text)
+    return " ".join(text.split())
+
+
+def make_cache_key(text, model, api_base_url, prompt_version, target_lang=""):
+    """根据规范化文本、模型、接口地址、提示词版本和翻译方向（目标语言）生成缓存键"""
+    raw = "\x1f".join([
+        normalize_text(text),
+        model,
+        api_base_url.rstrip('/'),
+        str(prompt_version),
+        target_lang or ""
+    ])
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class TranslationCache:
+    """
+    两级翻译缓存：内存LRU + SQLite磁盘缓存
+
+    内存层按最近使用淘汰，磁盘层按条目数和过期时间淘汰，重启后依然有效。
+    命中时的访问时间先记在内存中，写入新条目、清理或退出时再批量写入磁盘，
+    查找缓存不会产生写事务。
+    """
+
+    def __init__(self, path=CACHE_FILE, max_memory_entries=512,
+                 max_disk_entries=20000, ttl_seconds=30 * 24 * 3600):
+        self.path = path
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.ttl_seconds = ttl_seconds
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        # 尚未写入磁盘的访问时间: key -> accessed
+        self._accessed = {}
+        self._puts_since_prune = 0
+        self._stats = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "writes": 0,
+            "evictions": 0
+        }
+
+        self._db = None
+        try:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_cache_accessed ON cache(accessed)")
+            self._db.commit()
+            self._prune()
+        except sqlite3.Error as e:
+            logging.error(f"打开翻译缓存数据库失败，仅使用内存缓存: {str(e)}")
+            self._db = None
+        if self._db is not None:
+            atexit.register(self.flush)
+
+    def _expired(self, created, now):
+        return self.ttl_seconds > 0 and now - created > self.ttl_seconds
+
+    def get(self, key):
+        """查找缓存，未命中或已过期返回None"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, created = entry
+                if not self._expired(created, now):
+                    self._memory.move_to_end(key)
+                    self._accessed[key] = now
+                    self._stats["memory_hits"] += 1
+                    return value
+                del self._memory[key]
+
+            if self._db is not None:
+                try:
+                    row = self._db.execute(
+                        "SELECT value, created FROM cache WHERE key = ?", (key,)
+                    ).fetchone()
+                    if row is not None:
+                        value, created = row
+                        # 过期的条目留给_prune()删除
+                        if not self._expired(created, now):
+                            self._accessed[key] = now
+                            self._remember(key, value, created)
+                            self._stats["disk_hits"] += 1
+                            return value
+                except sqlite3.Error as e:
+                    logging.error(f"读取翻译缓存失败: {str(e)}")
+
+            self._stats["misses"] += 1
+            return None
+
+    def put(self, key, value):
+        """写入缓存（内存和磁盘）"""
+        now = time.time()
+        with self._lock:
+            self._remember(key, value, now)
+            self._stats["writes"] += 1
+            if self._db is None:
+                return
+            self._accessed.pop(key, None)
+            try:
+                self._write_accessed()
+                self._db.execute(
+                    "INSERT OR REPLACE INTO cache (key, value, created, accessed) VALUES (?, ?, ?, ?)",
+                    (key, value, now, now)
+                )
+                self._db.commit()
+                self._puts_since_prune += 1
+                if self._puts_since_prune >= 100:
+                    self._prune()
+            except sqlite3.Error as e:
+                logging.error(f"写入翻译缓存失败: {str(e)}")
+
+    def _remember(self, key, value, created):
+        """放入内存LRU，超出容量时淘汰最久未使用的条目"""
+        self._memory[key] = (value, created)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def _write_accessed(self):
+        """把内存中记下的访问时间写入磁盘（不提交，随后续的写入一起提交）"""
+        if self._accessed:
+            self._db.executemany("UPDATE cache SET accessed = ? WHERE key = ?",
+                                 [(accessed, key) for key, accessed in self._accessed.items()])
+            self._accessed.clear()
+
+    def flush(self):
+        """把尚未写入的访问时间写入磁盘"""
+        with self._lock:
+            if self._db is None or not self._accessed:
+                return
+            try:
+                self._write_accessed()
+                self._db.commit()
+            except sqlite3.Error as e:
+                logging.error(f"写入翻译缓存失败: {str(e)}")
+
+    def _prune(self):
+        """清理磁盘中过期和超出数量上限的条目"""
+        self._puts_since_prune = 0
+        # 按访问时间淘汰之前先写入最新的访问时间
+        self._write_accessed()
+        if self.ttl_seconds > 0:
+            self._db.execute("DELETE FROM cache WHERE created < ?", (time.time() - self.ttl_seconds,))
+        count = self._db.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+        overflow = count - self.max_disk_entries
+        if overflow > 0:
+            self._db.execute(
+                "DELETE FROM cache WHERE key IN "
+                "(SELECT key FROM cache ORDER BY accessed ASC LIMIT ?)",
+                (overflow,)
+            )
+            self._stats["evictions"] += overflow
+        self._db.commit()
+
+    def clear(self):
+        """清空全部缓存"""
+        with self._lock:
+            self._memory.clear()
+            self._accessed.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM cache")
+                self._db.commit()
+
+    def stats(self):
+        """返回命中统计"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._memory)
+        stats["hits"] = stats["memory_hits"] + stats["disk_hits"]
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache(config):
+    """获取全局翻译缓存实例，首次调用时根据配置创建"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = TranslationCache(
+                    path=CACHE_FILE,
+                    max_memory_entries=config["cache_memory_entries"],
+                    max_disk_entries=config["cache_disk_entries"],
+                    ttl_seconds=config["cache_ttl_days"] * 24 * 3600
+                )
+    return _cache
@@ -0,0 +1,206 @@
+"""
+本地翻译服务（utils.daemon）的客户端
+
+只依赖标准库，导入和调用都很快，适合在脚本和编辑器插件中使用。地址和访问令牌默认从
+正在运行的CutEng写出的daemon.json中读取：
+
+    from utils.client import Client
+
+    with Client() as client:
+        print(client.translate("connection refused"))
+        for delta in client.translate_stream("a longer paragraph ..."):
+            print(delta, end="", flush=True)
+        print(client.translate_batch(["open", "save", "close"]))
+
+也可以在命令行中使用：
+
+    python -m utils.client "connection refused"
+    cat lines.txt | python -m utils.client --batch
+
+Client对象复用同一个长连接，不是线程安全的，每个线程应使用自己的Client。
+"""
+import os
+import sys
+import json
+import socket
+import argparse
+import http.client
+
+
+def _default_daemon_file():
+    """固定放在当前用户的目录下，客户端在任何工作目录中运行都能找到"""
+    if sys.platform == "win32" and os.environ.get("APPDATA"):
+        directory = os.path.join(os.environ["APPDATA"], "CutEng")
+    else:
+        directory = os.path.join(os.path.expanduser("~"), ".cuteng")
+    return os.path.join(directory, "daemon.json")
+
+
+# 本地翻译服务的地址和访问令牌，由utils.daemon在启动时写出
+DAEMON_FILE = _default_daemon_file()
+
+
+class DaemonError(Exception):
+    """连接本地翻译服务失败、请求被拒绝或翻译出错"""
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    """通过Unix套接字发送HTTP请求"""
+
+    def __init__(self, path, timeout):
+        super().__init__("localhost", timeout=timeout)
+        self._path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self._path)
+
+
+def read_daemon_file(path=DAEMON_FILE):
+    """读取本地翻译服务的地址和访问令牌，返回(address, token)"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            info = json.load(f)
+    except (OSError, ValueError) as e:
+        raise DaemonError(f"找不到本地翻译服务（{path}），请确认CutEng正在运行且已启用daemon_port或daemon_socket: {e}")
+    return info["address"], info["token"]
+
+
+class Client:
+    """
+    本地翻译服务的客户端
+
+    Args:
+        address: "http://127.0.0.1:<端口>"或"unix:<套接字路径>"，省略时从daemon_file读取
+        token: 访问令牌，省略时从daemon_file读取
+        timeout: 单次请求的超时（秒）
+    """
+
+    def __init__(self, address=None, token=None, timeout=60, daemon_file=DAEMON_FILE):
+        if address is None or token is None:
+            file_address, file_token = read_daemon_file(daemon_file)
+            address = address or file_address
+            token = token or file_token
+        self.address = address
+        self.timeout = timeout
+        self._headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
+        self._conn = None
+
+    def _connection(self):
+        if self._conn is None:
+            if self.address.startswith("unix:"):
+                self._conn = _UnixHTTPConnection(self.address[len("unix:"):], self.timeout)
+            else:
+                host_port = self.address.split("://", 1)[-1].rstrip("/")
+                self._conn = http.client.HTTPConnection(host_port, timeout=self.timeout)
+        return self._conn
+
+    def _request(self, method, path, payload=None):
+        """发送请求并返回响应；复用的长连接已被服务端关闭时重新连接一次"""
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8') if payload is not None else None
+        for attempt in range(2):
+            conn = self._connection()
+            try:
+                conn.request(method, path, body=body, headers=self._headers)
+                response = conn.getresponse()
+                break
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                self.close()
+                if attempt == 1:
+                    raise DaemonError("本地翻译服务断开了连接")
+            except OSError as e:
+                self.close()
+                raise DaemonError(f"无法连接本地翻译服务: {e}")
+        if response.status != 200:
+            message = response.read().decode('utf-8', 'replace')
+            raise DaemonError(f"本地翻译服务返回 {response.status}: {message}")
+        return response
+
+    def _json(self, method, path, payload=None):
+        return json.loads(self._request(method, path, payload).read())
+
+    def health(self):
+        """服务正常时返回True"""
+        return self._json("GET", "/health").get("status") == "ok"
+
+    def translate(self, text):
+        """翻译一段文本，返回译文"""
+        data = self._json("POST", "/translate", {"text": text})
+        if data.get("error"):
+            raise DaemonError(data["translation"])
+        return data["translation"]
+
+    def translate_stream(self, text):
+        """流式翻译，逐个返回增量译文"""
+        response = self._request("POST", "/translate", {"text": text, "stream": True})
+        finished = False
+        try:
+            for line in response:
+                data = json.loads(line)
+                if "delta" in data:
+                    yield data["delta"]
+                    continue
+                finished = True
+                response.read()
+                if data.get("error"):
+                    raise DaemonError(data["translation"])
+                return
+        finally:
+            # 提前停止读取时响应没有读完，连接不能再复用；服务端会随之取消翻译
+            if not finished:
+                self.close()
+
+    def translate_batch(self, texts):
+        """
+        批量翻译，多条短文本打包进同一次请求
+
+        Returns:
+            与texts一一对应的(译文, 错误信息)列表，成功时错误信息为None
+        """
+        data = self._json("POST", "/batch", {"texts": list(texts)})
+        return [(item["translation"], item["error"]) for item in data["results"]]
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="CutEng本地翻译服务客户端")
+    parser.add_argument("text", nargs="*", help="要翻译的文本，省略时从标准输入读取")
+    parser.add_argument("--batch", action="store_true", help="逐行批量翻译标准输入或参数中的每一条")
+    parser.add_argument("--no-stream", action="store_true", help="等翻译完成后一次输出")
+    parser.add_argument("--address", help="服务地址，省略时从daemon.json读取")
+    parser.add_argument("--token", help="访问令牌，省略时从daemon.json读取")
+    args = parser.parse_args(argv)
+
+    try:
+        with Client(args.address, args.token) as client:
+            if args.batch:
+                lines = args.text or [line.rstrip("\r\n") for line in sys.stdin]
+                for translation, error in client.translate_batch(lines):
+                    print(translation.replace("\n", " ") if error is None else f"错误: {error}")
+                return 0
+            text = " ".join(args.text) or sys.stdin.read()
+            if args.no_stream:
+                print(client.translate(text))
+            else:
+                for delta in client.translate_stream(text):
+                    print(delta, end="", flush=True)
+                print()
+    except DaemonError as e:
+        print(f"错误: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,33 +1,212 @@
 import os
+import copy
 import json
 import logging
+import tempfile
+import threading
 
 # 配置文件路径和默认设置
 CONFIG_FILE = "config.json"
 DEFAULT_CONFIG = {
     "api_base_url": "https://api.openai.com/v1",
     "api_key": "",
-    "model": "gpt-3.5-turbo"
+    "model": "gpt-3.5-turbo",
+    # 备用端点列表，按顺序失败切换，每项可包含api_base_url、api_key、model
+    "endpoints": [],
+    # 重试与熔断设置
+    "retry_max_attempts": 3,
+    "retry_base_delay_ms": 500,
+    "retry_max_delay_ms": 8000,
+    "circuit_failure_threshold": 5,
+    "circuit_reset_seconds": 30,
+    # 对冲请求：主端点耗时超过该百分位时同时请求下一个端点
+    "hedge_enabled": False,
+    "hedge_percentile": 95,
+    "hedge_min_samples": 20,
+    # 客户端限流（0为不限制）：每分钟请求数、每分钟token数，等待额度的最长秒数
+    "quota_enabled": True,
+    "rate_limit_rpm": 0,
+    "rate_limit_tpm": 0,
+    "rate_limit_max_wait_seconds": 30,
+    # 每日花费：每千个输入/输出token的单价（美元），超过软上限后暂停预翻译和批量翻译，
+    # 超过硬上限后暂停所有翻译（0为不限制）
+    "price_prompt_per_1k": 0.0005,
+    "price_completion_per_1k": 0.0015,
+    "daily_budget_soft": 0.0,
+    "daily_budget_hard": 0.0,
+    # 全局热键：组合键、注册方式（auto优先使用系统原生注册，失败时退回keyboard库的全局钩子；
+    # native或keyboard只使用指定方式），以及忽略重复触发的间隔
+    "hotkey": "win+space",
+    "hotkey_backend": "auto",
+    "hotkey_debounce_ms": 300,
+    # 翻译方向：auto为中文译成英文、其他语言译成中文；zh或en为固定的目标语言
+    "target_language": "auto",
+    # 本地判断为数字、网址、路径、代码或已是目标语言的文本原样返回，不调用API
+    "skip_untranslatable": True,
+    # 每次请求的输出token上限（0为不限制），单个词的请求使用single_token_max_tokens
+    "max_tokens": 0,
+    "single_token_max_tokens": 64,
+    # 流式输出设置
+    "stream": True,
+    "stream_flush_interval_ms": 50,
+    # 流式输出时请求返回token用量（stream_options.include_usage）
+    "stream_include_usage": True,
+    # 同时进行的翻译请求上限
+    "max_concurrent_translations": 2,
+    # 单次翻译的总时限（秒）
+    "translation_deadline_seconds": 30,
+    # HTTP连接设置
+    "http_pool_size": 4,
+    "http_idle_rewarm_seconds": 60,
+    # 异步客户端是否启用HTTP/2（需要安装h2）
+    "http2": False,
+    # 性能指标：每次翻译的JSONL记录文件（留空不导出）和本地Prometheus接口端口（0为关闭）
+    "metrics_export_file": "",
+    "metrics_port": 0,
+    # 预翻译：监视剪贴板和PRIMARY选区，提前把新内容翻译进缓存（默认关闭）
+    "prefetch_enabled": False,
+    "prefetch_primary_selection": True,
+    "prefetch_poll_interval_ms": 400,
+    "prefetch_debounce_ms": 500,
+    "prefetch_max_per_minute": 6,
+    "prefetch_max_chars": 2000,
+    # 长文本分段：每段的token预算、同时翻译的段数、作为上下文附带的前文句子数
+    "long_text_max_tokens": 800,
+    "long_text_concurrency": 4,
+    "long_text_overlap_sentences": 1,
+    # 翻译记忆库：原文完全相同时直接使用历史译文，相似度不低于reference阈值的历史译文
+    # 作为参考提供给模型
+    "tm_enabled": True,
+    "tm_reference_threshold": 0.7,
+    # 离线词典：单词和短语优先查本地词典（由python -m utils.dictionary build生成）
+    "dictionary_enabled": True,
+    "dictionary_file": "dictionary.db",
+    # 本地翻译后端（""为不使用，可选llama_cpp、ctranslate2）：不超过local_max_chars的文本
+    # 交给本机模型翻译，较长或本地翻译失败的文本仍使用远程API
+    "local_backend": "",
+    "local_max_chars": 200,
+    "local_timeout_seconds": 10,
+    # llama.cpp服务（llama-server）的OpenAI兼容接口地址和模型名
+    "local_llama_url": "http://127.0.0.1:8080/v1",
+    "local_llama_model": "local",
+    # CTranslate2格式的MarianMT模型目录，英译中模型需要目标语言前缀时填写
+    "local_ct2_en_zh_model": "",
+    "local_ct2_zh_en_model": "",
+    "local_ct2_en_zh_prefix": "",
+    "local_ct2_threads": 4,
+    # 本地模型合并批次：等待同时到达的请求的时间和每批最多条数
+    "local_batch_window_ms": 10,
+    "local_batch_max": 16,
+    # 翻译历史：记录每次翻译的原文和译文，可在托盘“历史记录”中搜索
+    "history_enabled": True,
+    # 日志：级别、格式（json或text）、是否同时输出到控制台；
+    # 日志文件超过log_max_mb或使用超过log_max_age_days天后压缩轮转，保留log_backup_count个
+    "log_level": "INFO",
+    "log_format": "json",
+    "log_console": True,
+    "log_max_mb": 5,
+    "log_max_age_days": 7,
+    "log_backup_count": 5,
+    # 选中文本在日志中的记录方式：truncate只记录前log_text_max_chars个字符，
+    # redact只记录长度和摘要，full完整记录
+    "log_text_mode": "truncate",
+    "log_text_max_chars": 30,
+    # 本地翻译服务：在127.0.0.1的端口（0为关闭）或Unix套接字（留空不使用，优先于端口）上
+    # 提供翻译接口，地址和访问令牌写入daemon.json
+    "daemon_port": 0,
+    "daemon_socket": "",
+    # 翻译缓存设置
+    "cache_enabled": True,
+    "cache_memory_entries": 512,
+    "cache_disk_entries": 20000,
+    "cache_ttl_days": 30
 }
 
+# 内存中的配置快照，以及生成快照时配置文件的状态
+_snapshot = None
+_snapshot_stamp = None
+_lock = threading.Lock()
+
+def _file_stamp():
+    """返回配置文件的(修改时间, inode, 大小)，文件不存在时返回None"""
+    try:
+        st = os.stat(CONFIG_FILE)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_ino, st.st_size)
+
+def _type_matches(value, default):
+    if isinstance(default, bool):
+        return isinstance(value, bool)
+    if isinstance(default, (int, float)):
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+    return isinstance(value, type(default))
+
+def _validate(raw):
+    """将读取到的配置合并到默认配置之上，类型不符的项保留默认值"""
+    config = copy.deepcopy(DEFAULT_CONFIG)
+    if not isinstance(raw, dict):
+        logging.error("配置文件格式错误，使用默认配置")
+        return config
+    for key, value in raw.items():
+        if key in DEFAULT_CONFIG and not _type_matches(value, DEFAULT_CONFIG[key]):
+            logging.warning(f"配置项 {key} 的值类型错误，使用默认值")
+            continue
+        config[key] = value
+    return config
+
+def _load():
+    if not os.path.exists(CONFIG_FILE):
+        return copy.deepcopy(DEFAULT_CONFIG)
+    try:
+        with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
+            return _validate(json.load(f))
+    except Exception as e:
+        logging.error(f"读取配置文件失败: {str(e)}")
+        return copy.deepcopy(DEFAULT_CONFIG)
+
 def get_config():
-    """读取配置文件，如果不存在则返回默认配置"""
-    if os.path.exists(CONFIG_FILE):
-        try:
-            with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except Exception as e:
-            logging.error(f"读取配置文件失败: {str(e)}")
-            return DEFAULT_CONFIG
-    else:
-        return DEFAULT_CONFIG
+    """
+    获取当前配置
+
+    配置只在首次调用、配置文件被修改或替换后重新读取，其余时候直接返回内存快照。
+    返回值是合并了默认配置的新字典，缺失的配置项不会引发KeyError。
+    """
+    global _snapshot, _snapshot_stamp
+    stamp = _file_stamp()
+    with _lock:
+        if _snapshot is None or stamp != _snapshot_stamp:
+            _snapshot = _load()
+            _snapshot_stamp = stamp
+        return dict(_snapshot)
+
+def _overrides(config):
+    """只保留与默认配置不同的配置项；用户没有改过的项以后会随默认值的调整而更新"""
+    return {key: value for key, value in config.items()
+            if key not in DEFAULT_CONFIG or value != DEFAULT_CONFIG[key]}
 
 def save_config(config):
-    """保存配置到文件"""
+    """
+    保存配置到文件（先写临时文件再替换，避免读到写了一半的文件）
+
+    文件中只写入与默认配置不同的配置项，读取时再合并到默认配置之上。
+    """
+    global _snapshot, _snapshot_stamp
+    config = _validate(config)
+    directory = os.path.dirname(os.path.abspath(CONFIG_FILE))
     try:
-        with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
-            json.dump(config, f, indent=4)
+        with _lock:
+            fd, tmp_path = tempfile.mkstemp(prefix=".config-", suffix=".tmp", dir=directory)
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    json.dump(_overrides(config), f, indent=4)
+                os.replace(tmp_path, CONFIG_FILE)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+            _snapshot = config
+            _snapshot_stamp = _file_stamp()
         return True
     except Exception as e:
         logging.error(f"保存配置文件失败: {str(e)}")
-        return False 
\ No newline at end of file
+        return False
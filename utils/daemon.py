@@ -0,0 +1,272 @@
+"""
+本地翻译服务
+
+让正在运行的CutEng在127.0.0.1的HTTP端口或Unix套接字上提供翻译接口，脚本和编辑器插件
+可以直接使用已经预热的连接池、缓存和并发限制，不必每次重新导入模块、建立连接。
+
+接口（请求和响应均为JSON，请求需带上"Authorization: Bearer <令牌>"）：
+
+- GET /health: {"status": "ok"}
+- POST /translate {"text": ..., "stream": false}: {"translation": ..., "error": null}
+  stream为true时以分块传输逐行返回{"delta": ...}，最后一行为{"translation": ..., "error": ...}
+- POST /batch {"texts": [...]}: {"results": [{"translation": ..., "error": ...}, ...]}
+
+启动时把地址和随机生成的访问令牌写入当前用户目录下的daemon.json（仅当前用户可读，
+见utils.client.DAEMON_FILE），utils.client从中读取。
+"""
+import os
+import json
+import stat
+import atexit
+import queue
+import logging
+import secrets
+import threading
+import socketserver
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from utils import metrics
+from utils.batch import _group_records
+from utils.client import DAEMON_FILE
+
+# 请求体大小上限
+_MAX_BODY = 4 * 1024 * 1024
+
+# 批量翻译时每次请求打包的条数和字符数
+_BATCH_SIZE = 20
+_BATCH_MAX_CHARS = 2000
+
+_DONE = object()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # 使用HTTP/1.1，客户端可以复用同一个连接
+    protocol_version = "HTTP/1.1"
+    server_version = "CutEng"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _authorized(self):
+        expected = f"Bearer {self.server.daemon.token}"
+        if secrets.compare_digest(self.headers.get("Authorization", ""), expected):
+            return True
+        self._send_json(401, {"error": "访问令牌错误"})
+        return False
+
+    def _read_json(self):
+        """读取请求体，格式错误时返回错误响应并返回None"""
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+        except ValueError:
+            length = -1
+        if length < 0 or length > _MAX_BODY:
+            self.close_connection = True
+            self._send_json(413 if length > _MAX_BODY else 400, {"error": "请求体长度错误"})
+            return None
+        try:
+            data = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send_json(400, {"error": "请求体不是有效的JSON"})
+            return None
+        if not isinstance(data, dict):
+            self._send_json(400, {"error": "请求体应为JSON对象"})
+            return None
+        return data
+
+    def do_GET(self):
+        if not self._authorized():
+            return
+        if self.path == "/health":
+            self._send_json(200, {"status": "ok"})
+        else:
+            self._send_json(404, {"error": "未知接口"})
+
+    def do_POST(self):
+        if not self._authorized():
+            return
+        if self.path not in ("/translate", "/batch"):
+            self._send_json(404, {"error": "未知接口"})
+            return
+        data = self._read_json()
+        if data is None:
+            return
+        if self.path == "/batch":
+            self._batch(data)
+            return
+        text = data.get("text")
+        if not isinstance(text, str):
+            self._send_json(400, {"error": "缺少text"})
+            return
+        if data.get("stream"):
+            self._translate_stream(text)
+        else:
+            self._translate(text)
+
+    def _translate(self, text):
+        trace = metrics.Trace("daemon")
+        future = self.server.daemon.scheduler.translate(text, trace=trace)
+        translation, error = _result(future, trace)
+        self._send_json(200, {"translation": translation, "error": error})
+
+    def _write_chunk(self, payload):
+        line = json.dumps(payload, ensure_ascii=False).encode('utf-8') + b"\n"
+        self.wfile.write(f"{len(line):X}\r\n".encode('ascii') + line + b"\r\n")
+
+    def _translate_stream(self, text):
+        trace = metrics.Trace("daemon")
+        deltas = queue.SimpleQueue()
+        future = self.server.daemon.scheduler.translate(text, on_delta=deltas.put, trace=trace)
+        future.add_done_callback(lambda f: deltas.put(_DONE))
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson; charset=utf-8")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        streamed = False
+        try:
+            while True:
+                delta = deltas.get()
+                if delta is _DONE:
+                    break
+                self._write_chunk({"delta": delta})
+                streamed = True
+            translation, error = _result(future, trace)
+            # 命中缓存等没有增量输出的情况，把整段译文作为一个增量发出
+            if not streamed and error is None:
+                self._write_chunk({"delta": translation})
+            self._write_chunk({"translation": translation, "error": error})
+            self.wfile.write(b"0\r\n\r\n")
+        except OSError:
+            # 客户端断开连接：取消翻译
+            logging.info("本地翻译服务的客户端已断开，取消翻译")
+            future.cancel()
+            trace.finish("cancelled")
+            self.close_connection = True
+
+    def _batch(self, data):
+        texts = data.get("texts")
+        if not isinstance(texts, list) or not all(isinstance(text, str) for text in texts):
+            self._send_json(400, {"error": "texts应为字符串列表"})
+            return
+        # 各组交给调度器并发翻译，与热键翻译和单条请求共用异步客户端和并发上限
+        scheduler = self.server.daemon.scheduler
+        trace = metrics.Trace("daemon")
+        futures = [scheduler.translate_batch([text for _, text in group], trace)
+                   for group in _group_records(((text, text) for text in texts), _BATCH_SIZE, _BATCH_MAX_CHARS)]
+        results = []
+        try:
+            for future in futures:
+                results.extend(future.result())
+        except Exception as e:
+            logging.error(f"本地翻译服务批量翻译失败: {str(e)}")
+            trace.finish("error")
+            self._send_json(500, {"error": f"批量翻译失败: {str(e)}"})
+            return
+        trace.finish("ok")
+        self._send_json(200, {"results": [{"translation": t, "error": e} for t, e in results]})
+
+
+class _TcpHandler(_Handler):
+    # 响应头和响应体分两次写出，关闭Nagle算法避免等待对方的延迟确认
+    disable_nagle_algorithm = True
+
+
+def _result(future, trace):
+    """等待翻译完成并结束trace，返回(译文或错误信息, 错误类型或None)"""
+    try:
+        translation = future.result()
+    except Exception as e:
+        logging.error(f"本地翻译服务翻译失败: {str(e)}")
+        trace.finish("error")
+        return f"翻译过程中发生错误: {str(e)}", type(e).__name__
+    error = trace.attributes.get("error")
+    trace.finish("error" if error else "ok")
+    return translation, error
+
+
+if hasattr(socketserver, "ThreadingUnixStreamServer"):
+    class _UnixServer(socketserver.ThreadingUnixStreamServer):
+        daemon_threads = True
+else:
+    _UnixServer = None
+
+
+class TranslationDaemon:
+    """
+    本地翻译服务
+
+    翻译请求交给热键翻译使用的TranslationScheduler.translate()，与热键翻译共用
+    异步客户端的连接池、翻译缓存和并发上限；批量请求按utils.batch的打包逻辑分组后
+    交给TranslationScheduler.translate_batch()，同样受并发上限约束。
+    """
+
+    def __init__(self, scheduler, config, daemon_file=DAEMON_FILE):
+        self.scheduler = scheduler
+        self.config = config
+        self.daemon_file = daemon_file
+        self.token = secrets.token_urlsafe(24)
+        self.address = None
+        self._server = None
+        self._socket_path = None
+
+    def start(self):
+        """开始监听，失败时抛出OSError"""
+        socket_path = self.config["daemon_socket"]
+        if socket_path:
+            if _UnixServer is None:
+                raise OSError("当前系统不支持Unix套接字，请改用daemon_port")
+            # 清理上次异常退出时留下的套接字文件
+            if os.path.exists(socket_path) and stat.S_ISSOCK(os.stat(socket_path).st_mode):
+                os.remove(socket_path)
+            self._server = _UnixServer(socket_path, _Handler)
+            os.chmod(socket_path, 0o600)
+            self._socket_path = socket_path
+            self.address = f"unix:{socket_path}"
+        else:
+            self._server = ThreadingHTTPServer(("127.0.0.1", self.config["daemon_port"]), _TcpHandler)
+            self.address = f"http://127.0.0.1:{self._server.server_address[1]}"
+        self._server.daemon = self
+        self._write_daemon_file()
+        threading.Thread(target=self._server.serve_forever, name="daemon-server", daemon=True).start()
+        logging.info(f"本地翻译服务已启动: {self.address}")
+
+    def _write_daemon_file(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.daemon_file)), mode=0o700, exist_ok=True)
+        fd = os.open(self.daemon_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump({"address": self.address, "token": self.token, "pid": os.getpid()}, f)
+
+    def stop(self):
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._server = None
+        for path in (self.daemon_file, self._socket_path):
+            if path and os.path.exists(path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+
+def start_daemon(config, scheduler):
+    """按配置启动本地翻译服务，未启用或启动失败时返回None"""
+    if not config["daemon_port"] and not config["daemon_socket"]:
+        return None
+    daemon = TranslationDaemon(scheduler, config)
+    try:
+        daemon.start()
+    except OSError as e:
+        logging.error(f"启动本地翻译服务失败: {str(e)}")
+        return None
+    atexit.register(daemon.stop)
+    return daemon
@@ -0,0 +1,236 @@
+"""
+离线词典：单词和短语直接查本地词典，不调用大语言模型
+
+词典由ECDICT格式的CSV（word, phonetic, definition, translation, ..., exchange, ...）
+预先转换为SQLite索引文件：
+
+    python -m utils.dictionary build ecdict.csv -o dictionary.db
+    python -m utils.dictionary lookup running
+
+查询只读取B树索引中的几个页面，不会把整个词典加载到内存。
+"""
+import os
+import re
+import csv
+import sys
+import time
+import sqlite3
+import logging
+import argparse
+import threading
+
+from utils.cache import normalize_text
+
+# 词典索引文件路径
+DICTIONARY_FILE = "dictionary.db"
+
+# 只有不超过该词数的纯英文文本才查词典
+MAX_QUERY_WORDS = 4
+MAX_QUERY_CHARS = 64
+
+_QUERY_PATTERN = re.compile(r"^[a-z][a-z'\-. ]*$")
+
+# ECDICT的exchange字段中表示词形变化的类型：过去式、过去分词、现在分词、三单、比较级、最高级、复数
+_INFLECTION_TYPES = set("pdi3rts")
+
+
+def _candidates(word):
+    """按常见英语屈折规则猜测单词的原形，按可能性排列"""
+    candidates = []
+
+    def add(base):
+        if len(base) >= 2 and base != word and base not in candidates:
+            candidates.append(base)
+
+    if word.endswith("ies"):
+        add(word[:-3] + "y")
+    if word.endswith("es"):
+        add(word[:-2])
+    if word.endswith("s") and not word.endswith("ss"):
+        add(word[:-1])
+    for suffix in ("ing", "ed", "er", "est"):
+        if not word.endswith(suffix):
+            continue
+        stem = word[:-len(suffix)]
+        # running -> run, stopped -> stop
+        if len(stem) >= 3 and stem[-1] == stem[-2]:
+            add(stem[:-1])
+        add(stem)
+        add(stem + "e")
+        if stem.endswith("i"):
+            add(stem[:-1] + "y")
+    return candidates
+
+
+def _format_entry(word, phonetic, translation, lemma_of=None):
+    lines = []
+    header = word if not lemma_of else f"{lemma_of} → {word}"
+    lines.append(f"{header}  [{phonetic}]" if phonetic else header)
+    # ECDICT中的多个义项以字面的\n分隔
+    lines.extend(line.strip() for line in translation.replace("\\n", "\n").splitlines() if line.strip())
+    return "\n".join(lines)
+
+
+class Dictionary:
+    """
+    只读的本地词典
+
+    先精确匹配，其次查词形变化表（来自ECDICT的exchange字段），
+    最后按屈折规则猜测原形，例如running -> run。
+    """
+
+    def __init__(self, path=DICTIONARY_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        uri = "file:" + os.path.abspath(path).replace("\\", "/") + "?mode=ro"
+        self._db = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        self._db.execute("PRAGMA query_only = 1")
+
+    @staticmethod
+    def is_query(text):
+        """判断文本是否是适合查词典的英文单词或短语"""
+        if len(text) > MAX_QUERY_CHARS:
+            return False
+        text = normalize_text(text).lower()
+        return bool(_QUERY_PATTERN.match(text)) and len(text.split()) <= MAX_QUERY_WORDS
+
+    def _get(self, word):
+        return self._db.execute(
+            "SELECT word, phonetic, translation FROM words WHERE key = ?", (word,)
+        ).fetchone()
+
+    def lookup(self, text):
+        """查询单词或短语，返回格式化的释义，未收录时返回None"""
+        query = normalize_text(text).lower().strip(" .")
+        if not query:
+            return None
+        with self._lock:
+            try:
+                row = self._get(query)
+                if row is not None:
+                    return _format_entry(*row)
+                if " " in query:
+                    return None
+                lemma = self._db.execute("SELECT lemma FROM lemmas WHERE form = ?", (query,)).fetchone()
+                candidates = [lemma[0]] if lemma else []
+                candidates.extend(_candidates(query))
+                for candidate in candidates:
+                    row = self._get(candidate)
+                    if row is not None:
+                        return _format_entry(*row, lemma_of=query)
+            except sqlite3.Error as e:
+                logging.error(f"查询离线词典失败: {str(e)}")
+        return None
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def build_index(csv_path, db_path=DICTIONARY_FILE):
+    """
+    将ECDICT格式的CSV转换为SQLite词典索引
+
+    只保留音标和中文释义（没有中文释义时退而使用英文释义），
+    返回收录的词条数。
+    """
+    tmp_path = db_path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    db = sqlite3.connect(tmp_path)
+    db.execute("PRAGMA journal_mode = OFF")
+    db.execute("PRAGMA synchronous = OFF")
+    db.execute(
+        "CREATE TABLE words (key TEXT PRIMARY KEY, word TEXT NOT NULL, "
+        "phonetic TEXT, translation TEXT NOT NULL) WITHOUT ROWID"
+    )
+    db.execute("CREATE TABLE lemmas (form TEXT PRIMARY KEY, lemma TEXT NOT NULL) WITHOUT ROWID")
+
+    count = 0
+    words = []
+    lemmas = []
+
+    def flush():
+        db.executemany("INSERT OR IGNORE INTO words VALUES (?, ?, ?, ?)", words)
+        db.executemany("INSERT OR IGNORE INTO lemmas VALUES (?, ?)", lemmas)
+        words.clear()
+        lemmas.clear()
+
+    with open(csv_path, 'r', encoding='utf-8', newline='') as f:
+        for row in csv.DictReader(f):
+            word = (row.get("word") or "").strip()
+            translation = (row.get("translation") or row.get("definition") or "").strip()
+            if not word or not translation:
+                continue
+            key = word.lower()
+            words.append((key, word, (row.get("phonetic") or "").strip(), translation))
+            count += 1
+            for item in (row.get("exchange") or "").split("/"):
+                kind, _, form = item.partition(":")
+                form = form.strip().lower()
+                if kind in _INFLECTION_TYPES and form and form != key:
+                    lemmas.append((form, key))
+            if len(words) >= 10000:
+                flush()
+    flush()
+    db.commit()
+    db.execute("VACUUM")
+    db.close()
+    os.replace(tmp_path, db_path)
+    return count
+
+
+_dictionary = None
+_dictionary_path = None
+_dictionary_lock = threading.Lock()
+
+
+def get_dictionary(config):
+    """获取全局词典实例；未启用或词典文件不存在时返回None"""
+    global _dictionary, _dictionary_path
+    if not config["dictionary_enabled"]:
+        return None
+    path = config["dictionary_file"]
+    if _dictionary_path != path:
+        with _dictionary_lock:
+            if _dictionary_path != path:
+                _dictionary = None
+                if os.path.exists(path):
+                    try:
+                        _dictionary = Dictionary(path)
+                        logging.info(f"已加载离线词典: {path}")
+                    except sqlite3.Error as e:
+                        logging.error(f"打开离线词典失败: {str(e)}")
+                _dictionary_path = path
+    return _dictionary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="离线词典工具")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build = subparsers.add_parser("build", help="由ECDICT格式的CSV生成词典索引")
+    build.add_argument("csv", help="ECDICT格式的CSV文件")
+    build.add_argument("-o", "--output", default=DICTIONARY_FILE, help="输出的词典索引文件")
+    lookup = subparsers.add_parser("lookup", help="查询单词或短语")
+    lookup.add_argument("words", nargs="+", help="要查询的单词或短语")
+    lookup.add_argument("-d", "--dictionary", default=DICTIONARY_FILE, help="词典索引文件")
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        start = time.perf_counter()
+        count = build_index(args.csv, args.output)
+        print(f"已收录 {count} 个词条，耗时 {time.perf_counter() - start:.1f} 秒: {args.output}")
+        return 0
+
+    dictionary = Dictionary(args.dictionary)
+    text = " ".join(args.words)
+    start = time.perf_counter()
+    result = dictionary.lookup(text)
+    elapsed = (time.perf_counter() - start) * 1000
+    print(result if result is not None else f"未收录: {text}")
+    print(f"({elapsed:.3f} ms)")
+    return 0 if result is not None else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,258 @@
+"""
+翻译历史：记录每次翻译的原文、译文、时间、模型和耗时，支持全文搜索
+
+记录保存在SQLite中，用FTS5的trigram分词建立全文索引（中英文都可以按任意子串搜索）。
+写入先放入队列，由后台线程按批提交，不阻塞界面线程。
+
+    python -m utils.history search "connection refused"
+    python -m utils.history stats
+"""
+import sys
+import time
+import queue
+import sqlite3
+import logging
+import argparse
+import threading
+
+# 翻译历史路径
+HISTORY_FILE = "history.db"
+
+# 每页显示的记录数
+PAGE_SIZE = 50
+
+# trigram分词只能索引不少于3个字符的词
+_MIN_INDEXED_CHARS = 3
+
+# 较短的关键词无法使用索引，每次搜索最多逐行检查的记录数
+_SCAN_WINDOW = 20000
+
+_STOP = object()
+
+
+class HistoryEntry:
+    """一条翻译历史"""
+
+    def __init__(self, id, created, source, result, model, latency_ms):
+        self.id = id
+        self.created = created
+        self.source = source
+        self.result = result
+        self.model = model
+        self.latency_ms = latency_ms
+
+
+def _fts_phrase(term):
+    """把用户输入的词转成FTS5短语，避免引号、星号等被当作查询语法"""
+    return '"' + term.replace('"', '""') + '"'
+
+
+def _like_pattern(term):
+    escaped = term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+class HistoryStore:
+    """
+    基于SQLite FTS5的翻译历史
+
+    add()只把记录放入队列，后台线程每flush_interval秒或攒够batch_size条时在一个事务中写入。
+    search()按时间倒序分页返回，用id作为翻页位置，不使用OFFSET，翻到后面的页同样快。
+    """
+
+    def __init__(self, path=HISTORY_FILE, flush_interval=1.0, batch_size=200):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode = WAL")
+        self._db.execute("PRAGMA synchronous = NORMAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS entries (
+                id INTEGER PRIMARY KEY, created REAL NOT NULL, source TEXT NOT NULL,
+                result TEXT NOT NULL, model TEXT NOT NULL, latency_ms REAL);
+            CREATE VIRTUAL TABLE IF NOT EXISTS entries_fts USING fts5(
+                source, result, content='entries', content_rowid='id', tokenize='trigram');
+            CREATE TRIGGER IF NOT EXISTS entries_ai AFTER INSERT ON entries BEGIN
+                INSERT INTO entries_fts (rowid, source, result) VALUES (new.id, new.source, new.result);
+            END;
+            CREATE TRIGGER IF NOT EXISTS entries_ad AFTER DELETE ON entries BEGIN
+                INSERT INTO entries_fts (entries_fts, rowid, source, result)
+                VALUES ('delete', old.id, old.source, old.result);
+            END;
+        """)
+        self._db.commit()
+        self._queue = queue.Queue()
+        self._writer = threading.Thread(target=self._run, name="history-writer", daemon=True)
+        self._writer.start()
+
+    def add(self, source, result, model="", latency_ms=None):
+        """记录一次翻译（异步写入）"""
+        if source and result:
+            self._queue.put((time.time(), source, result, model or "", latency_ms))
+
+    def _run(self):
+        while True:
+            batch = []
+            marker = None
+            item = self._queue.get()
+            deadline = time.monotonic() + self.flush_interval
+            # 攒一批再写，减少事务提交的次数；遇到flush或close的标记时立即写入
+            while True:
+                if item is _STOP or isinstance(item, threading.Event):
+                    marker = item
+                    break
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+            if batch:
+                self._write(batch)
+            if marker is _STOP:
+                return
+            if marker is not None:
+                marker.set()
+
+    def _write(self, batch):
+        with self._lock:
+            try:
+                self._db.executemany(
+                    "INSERT INTO entries (created, source, result, model, latency_ms) VALUES (?, ?, ?, ?, ?)",
+                    batch
+                )
+                self._db.commit()
+            except sqlite3.Error as e:
+                self._db.rollback()
+                logging.error(f"写入翻译历史失败: {str(e)}")
+
+    def search(self, query="", before_id=None, limit=PAGE_SIZE):
+        """
+        搜索原文或译文中包含所有关键词（空格分隔）的记录
+
+        不少于3个字符的关键词使用全文索引。只有较短的关键词时无法使用索引，
+        每次最多逐行检查_SCAN_WINDOW条记录，没找够一页时可以继续向前翻。
+
+        Args:
+            query: 关键词，留空返回全部记录
+            before_id: 只返回id小于它的记录，用于翻页（传入上一次返回的翻页位置）
+            limit: 每页条数
+
+        Returns:
+            (HistoryEntry列表（按时间从新到旧）, 下一页的before_id)；没有更多记录时后者为None
+        """
+        terms = query.split()
+        indexed = [term for term in terms if len(term) >= _MIN_INDEXED_CHARS]
+        short = [term for term in terms if len(term) < _MIN_INDEXED_CHARS]
+
+        conditions = []
+        params = []
+        if indexed:
+            source = "entries_fts f JOIN entries e ON e.id = f.rowid"
+            order = "f.rowid"
+            conditions.append("entries_fts MATCH ?")
+            params.append(" ".join(_fts_phrase(term) for term in indexed))
+        else:
+            source = "entries e"
+            order = "e.id"
+        for term in short:
+            conditions.append("(e.source LIKE ? ESCAPE '\\' OR e.result LIKE ? ESCAPE '\\')")
+            params.extend([_like_pattern(term)] * 2)
+        if before_id is not None:
+            conditions.append(f"{order} < ?")
+            params.append(before_id)
+
+        with self._lock:
+            try:
+                window_start = None
+                if short and not indexed:
+                    # 逐行匹配时限制每次检查的范围，保证输入时的响应速度
+                    upper = before_id
+                    if upper is None:
+                        upper = (self._db.execute("SELECT MAX(id) FROM entries").fetchone()[0] or 0) + 1
+                    window_start = upper - _SCAN_WINDOW
+                    conditions.append("e.id >= ?")
+                    params.append(window_start)
+                where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+                rows = self._db.execute(
+                    f"SELECT e.id, e.created, e.source, e.result, e.model, e.latency_ms FROM {source} "
+                    f"{where} ORDER BY {order} DESC LIMIT ?",
+                    (*params, limit)
+                ).fetchall()
+            except sqlite3.Error as e:
+                logging.error(f"搜索翻译历史失败: {str(e)}")
+                return [], None
+        entries = [HistoryEntry(*row) for row in rows]
+        if len(entries) == limit:
+            return entries, entries[-1].id
+        if window_start is not None and window_start > 1:
+            return entries, window_start
+        return entries, None
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def flush(self, timeout=5):
+        """等待队列中已有的记录全部写入"""
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait(timeout)
+
+    def close(self):
+        self._queue.put(_STOP)
+        self._writer.join()
+        with self._lock:
+            self._db.close()
+
+
+_history = None
+_history_lock = threading.Lock()
+
+
+def get_history(config):
+    """获取全局翻译历史实例，未启用时返回None"""
+    global _history
+    if not config["history_enabled"]:
+        return None
+    if _history is None:
+        with _history_lock:
+            if _history is None:
+                try:
+                    _history = HistoryStore(HISTORY_FILE)
+                except sqlite3.Error as e:
+                    logging.error(f"打开翻译历史失败: {str(e)}")
+                    return None
+    return _history
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="翻译历史工具")
+    parser.add_argument("-f", "--file", default=HISTORY_FILE, help="翻译历史文件")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    search = subparsers.add_parser("search", help="搜索原文或译文")
+    search.add_argument("query", nargs="*")
+    search.add_argument("-n", "--limit", type=int, default=20)
+    subparsers.add_parser("stats", help="显示记录条数")
+    args = parser.parse_args(argv)
+
+    history = HistoryStore(args.file)
+    if args.command == "stats":
+        print(f"共 {len(history)} 条记录")
+    else:
+        start = time.perf_counter()
+        entries, _ = history.search(" ".join(args.query), limit=args.limit)
+        elapsed = (time.perf_counter() - start) * 1000
+        for entry in entries:
+            created = time.strftime("%Y-%m-%d %H:%M", time.localtime(entry.created))
+            print(f"[{created}] {entry.source}\n    → {entry.result}")
+        print(f"({len(entries)} 条, {elapsed:.2f} ms)")
+    history.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,421 @@
+"""
+全局热键
+
+keyboard.add_hotkey会安装全局键盘钩子，系统中每一次按键都要经过Python代码处理。
+这里优先只向系统注册热键本身，平时打字不会唤醒本程序：
+
+- win32: RegisterHotKey，在专门的线程中等待WM_HOTKEY消息
+- x11: XGrabKey（通过ctypes调用libX11），在专门的线程中等待按键事件
+- keyboard: 原来的全局钩子，以上两种不可用时（macOS、Wayland、热键被其他程序占用）使用
+
+热键按下时调用回调（一般是发射Qt信号，由主线程处理），短时间内的重复触发会被忽略。
+"""
+import os
+import sys
+import time
+import select
+import ctypes
+import ctypes.util
+import logging
+import threading
+
+from utils.config import DEFAULT_CONFIG
+
+# 修饰键的别名
+_MODIFIER_ALIASES = {
+    "ctrl": "ctrl", "control": "ctrl",
+    "alt": "alt", "option": "alt",
+    "shift": "shift",
+    "win": "win", "windows": "win", "super": "win", "meta": "win", "cmd": "win", "command": "win",
+}
+
+# keyboard库中修饰键的名称
+_KEYBOARD_NAMES = {"ctrl": "ctrl", "alt": "alt", "shift": "shift", "win": "windows"}
+
+
+class Chord:
+    """解析后的热键，如"win+space"解析为modifiers={"win"}、key="space" """
+
+    def __init__(self, text):
+        parts = [part.strip().lower() for part in text.split("+") if part.strip()]
+        if not parts:
+            raise ValueError(f"热键格式错误: {text}")
+        self.modifiers = set()
+        for part in parts[:-1]:
+            if part not in _MODIFIER_ALIASES:
+                raise ValueError(f"未知的修饰键: {part}")
+            self.modifiers.add(_MODIFIER_ALIASES[part])
+        self.key = parts[-1]
+        self.text = text
+
+    def display(self):
+        """用于界面提示的写法，如Win+Space"""
+        names = [name.capitalize() for name in ("ctrl", "alt", "shift", "win") if name in self.modifiers]
+        return "+".join(names + [self.key.capitalize()])
+
+
+class _Debounced:
+    """忽略interval秒内的重复触发（按住不放时的自动重复、抖动）"""
+
+    def __init__(self, callback, interval):
+        self.callback = callback
+        self.interval = interval
+        self._last = None
+
+    def __call__(self):
+        now = time.monotonic()
+        if self._last is not None and now - self._last < self.interval:
+            logging.debug("忽略重复的热键触发")
+            return
+        self._last = now
+        self.callback()
+
+
+class HotkeyBackend:
+    """热键后端接口"""
+    name = ""
+
+    def __init__(self, chord):
+        self.chord = chord
+
+    @classmethod
+    def available(cls):
+        return True
+
+    def register(self, callback):
+        """注册热键，失败时抛出OSError"""
+        raise NotImplementedError
+
+    def unregister(self):
+        pass
+
+    def modifiers_pressed(self):
+        """热键中的修饰键是否仍被按下（模拟Ctrl+C之前要等待松开），无法查询时返回False"""
+        return False
+
+
+class _ListenerThread(HotkeyBackend):
+    """在专门的线程中注册热键并等待事件，register()等待注册结果"""
+
+    def __init__(self, chord):
+        super().__init__(chord)
+        self._thread = None
+        self._error = None
+        self._ready = threading.Event()
+
+    def register(self, callback):
+        self._thread = threading.Thread(target=self._run, args=(callback,), name=f"hotkey-{self.name}", daemon=True)
+        self._thread.start()
+        self._ready.wait(5)
+        if self._error is not None:
+            raise OSError(self._error)
+        if not self._ready.is_set():
+            raise OSError("注册热键超时")
+
+    def _run(self, callback):
+        raise NotImplementedError
+
+
+class WindowsHotkey(_ListenerThread):
+    """通过RegisterHotKey注册热键，只有按下该组合键时系统才会通知本程序"""
+    name = "win32"
+
+    _HOTKEY_ID = 1
+    _WM_HOTKEY = 0x0312
+    _WM_QUIT = 0x0012
+    _MOD_FLAGS = {"alt": 0x0001, "ctrl": 0x0002, "shift": 0x0004, "win": 0x0008}
+    # 按住不放时不重复发送WM_HOTKEY
+    _MOD_NOREPEAT = 0x4000
+    _MODIFIER_VKS = {"ctrl": (0x11,), "alt": (0x12,), "shift": (0x10,), "win": (0x5B, 0x5C)}
+    _NAMED_VKS = {
+        "space": 0x20, "enter": 0x0D, "return": 0x0D, "tab": 0x09, "esc": 0x1B, "escape": 0x1B,
+        "backspace": 0x08, "insert": 0x2D, "delete": 0x2E, "home": 0x24, "end": 0x23,
+        "pageup": 0x21, "pagedown": 0x22, "up": 0x26, "down": 0x28, "left": 0x25, "right": 0x27,
+    }
+
+    @classmethod
+    def available(cls):
+        return sys.platform == "win32"
+
+    def _virtual_key(self):
+        key = self.chord.key
+        if key in self._NAMED_VKS:
+            return self._NAMED_VKS[key]
+        if len(key) == 1 and key.isalnum():
+            return ord(key.upper())
+        if key[0] == "f" and key[1:].isdigit() and 1 <= int(key[1:]) <= 24:
+            return 0x70 + int(key[1:]) - 1
+        raise ValueError(f"不支持的热键: {key}")
+
+    def _run(self, callback):
+        from ctypes import wintypes
+        user32 = ctypes.WinDLL("user32", use_last_error=True)
+        kernel32 = ctypes.WinDLL("kernel32")
+        modifiers = self._MOD_NOREPEAT
+        for name in self.chord.modifiers:
+            modifiers |= self._MOD_FLAGS[name]
+        try:
+            vk = self._virtual_key()
+        except ValueError as e:
+            self._error = str(e)
+            self._ready.set()
+            return
+        # hWnd为NULL时WM_HOTKEY发送到注册热键的线程的消息队列
+        if not user32.RegisterHotKey(None, self._HOTKEY_ID, modifiers, vk):
+            self._error = f"RegisterHotKey失败（热键可能已被系统或其他程序占用）: {ctypes.get_last_error()}"
+            self._ready.set()
+            return
+        self._thread_id = kernel32.GetCurrentThreadId()
+        self._ready.set()
+        msg = wintypes.MSG()
+        try:
+            while user32.GetMessageW(ctypes.byref(msg), None, 0, 0) > 0:
+                if msg.message == self._WM_HOTKEY and msg.wParam == self._HOTKEY_ID:
+                    try:
+                        callback()
+                    except Exception as e:
+                        logging.error(f"处理热键时发生错误: {str(e)}")
+        finally:
+            user32.UnregisterHotKey(None, self._HOTKEY_ID)
+
+    def unregister(self):
+        if self._thread is not None and self._error is None:
+            ctypes.windll.user32.PostThreadMessageW(self._thread_id, self._WM_QUIT, 0, 0)
+            self._thread.join(1)
+            self._thread = None
+
+    def modifiers_pressed(self):
+        user32 = ctypes.windll.user32
+        return any(user32.GetAsyncKeyState(vk) & 0x8000
+                   for name in self.chord.modifiers for vk in self._MODIFIER_VKS[name])
+
+
+class _XKeyEvent(ctypes.Structure):
+    _fields_ = [
+        ("type", ctypes.c_int), ("serial", ctypes.c_ulong), ("send_event", ctypes.c_int),
+        ("display", ctypes.c_void_p), ("window", ctypes.c_ulong), ("root", ctypes.c_ulong),
+        ("subwindow", ctypes.c_ulong), ("time", ctypes.c_ulong),
+        ("x", ctypes.c_int), ("y", ctypes.c_int), ("x_root", ctypes.c_int), ("y_root", ctypes.c_int),
+        ("state", ctypes.c_uint), ("keycode", ctypes.c_uint), ("same_screen", ctypes.c_int),
+    ]
+
+
+class _XEvent(ctypes.Union):
+    _fields_ = [("type", ctypes.c_int), ("xkey", _XKeyEvent), ("pad", ctypes.c_long * 24)]
+
+
+_X_ERROR_HANDLER = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_void_p, ctypes.c_void_p)
+
+
+class X11Hotkey(_ListenerThread):
+    """
+    通过XGrabKey在根窗口上抓取热键，只有按下该组合键时X服务器才会发送事件
+
+    使用单独的X连接，只在监听线程中访问。NumLock和CapsLock开启时的组合也一并抓取。
+    """
+    name = "x11"
+
+    _KEY_PRESS = 2
+    _KEY_RELEASE = 3
+    _GRAB_MODE_ASYNC = 1
+    _MASKS = {"shift": 1 << 0, "ctrl": 1 << 2, "alt": 1 << 3, "win": 1 << 6}
+    # LockMask（CapsLock）和Mod2Mask（NumLock）
+    _IGNORED_MASKS = (0, 1 << 1, 1 << 4, (1 << 1) | (1 << 4))
+    _KEYSYM_NAMES = {
+        "space": "space", "enter": "Return", "return": "Return", "tab": "Tab", "esc": "Escape",
+        "escape": "Escape", "backspace": "BackSpace", "insert": "Insert", "delete": "Delete",
+        "home": "Home", "end": "End", "pageup": "Prior", "pagedown": "Next",
+        "up": "Up", "down": "Down", "left": "Left", "right": "Right",
+    }
+
+    def __init__(self, chord):
+        super().__init__(chord)
+        self._wake_r, self._wake_w = None, None
+        self._grab_failed = False
+        # 保持对错误回调的引用，避免被回收
+        self._error_handler = _X_ERROR_HANDLER(self._on_x_error)
+
+    @classmethod
+    def available(cls):
+        return (sys.platform.startswith("linux") and bool(os.environ.get("DISPLAY"))
+                and ctypes.util.find_library("X11") is not None)
+
+    def _on_x_error(self, display, event):
+        # XGrabKey失败（BadAccess）时X库默认会结束进程，这里只记下失败
+        self._grab_failed = True
+        return 0
+
+    def _keysym_name(self):
+        key = self.chord.key
+        if key in self._KEYSYM_NAMES:
+            return self._KEYSYM_NAMES[key]
+        if key[0] == "f" and key[1:].isdigit():
+            return key.upper()
+        return key
+
+    @staticmethod
+    def _load_xlib():
+        xlib = ctypes.CDLL(ctypes.util.find_library("X11"))
+        xlib.XOpenDisplay.argtypes = [ctypes.c_char_p]
+        xlib.XOpenDisplay.restype = ctypes.c_void_p
+        xlib.XDefaultRootWindow.argtypes = [ctypes.c_void_p]
+        xlib.XDefaultRootWindow.restype = ctypes.c_ulong
+        xlib.XStringToKeysym.argtypes = [ctypes.c_char_p]
+        xlib.XStringToKeysym.restype = ctypes.c_ulong
+        xlib.XKeysymToKeycode.argtypes = [ctypes.c_void_p, ctypes.c_ulong]
+        xlib.XKeysymToKeycode.restype = ctypes.c_ubyte
+        xlib.XGrabKey.argtypes = [ctypes.c_void_p, ctypes.c_int, ctypes.c_uint, ctypes.c_ulong,
+                                  ctypes.c_int, ctypes.c_int, ctypes.c_int]
+        xlib.XUngrabKey.argtypes = [ctypes.c_void_p, ctypes.c_int, ctypes.c_uint, ctypes.c_ulong]
+        xlib.XSync.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        xlib.XConnectionNumber.argtypes = [ctypes.c_void_p]
+        xlib.XPending.argtypes = [ctypes.c_void_p]
+        xlib.XNextEvent.argtypes = [ctypes.c_void_p, ctypes.POINTER(_XEvent)]
+        xlib.XSetErrorHandler.argtypes = [_X_ERROR_HANDLER]
+        xlib.XSetErrorHandler.restype = ctypes.c_void_p
+        xlib.XkbSetDetectableAutoRepeat.argtypes = [ctypes.c_void_p, ctypes.c_int, ctypes.c_void_p]
+        xlib.XCloseDisplay.argtypes = [ctypes.c_void_p]
+        return xlib
+
+    def _run(self, callback):
+        try:
+            xlib = self._load_xlib()
+        except (OSError, AttributeError) as e:
+            self._error = f"加载libX11失败: {e}"
+            self._ready.set()
+            return
+        display = xlib.XOpenDisplay(None)
+        if not display:
+            self._error = "无法连接X服务器"
+            self._ready.set()
+            return
+        root = xlib.XDefaultRootWindow(display)
+        keycode = xlib.XKeysymToKeycode(display, xlib.XStringToKeysym(self._keysym_name().encode('ascii')))
+        if not keycode:
+            self._error = f"不支持的热键: {self.chord.key}"
+            xlib.XCloseDisplay(display)
+            self._ready.set()
+            return
+        modifiers = 0
+        for name in self.chord.modifiers:
+            modifiers |= self._MASKS[name]
+
+        previous_handler = xlib.XSetErrorHandler(self._error_handler)
+        for extra in self._IGNORED_MASKS:
+            xlib.XGrabKey(display, keycode, modifiers | extra, root, 0, self._GRAB_MODE_ASYNC, self._GRAB_MODE_ASYNC)
+        xlib.XSync(display, 0)
+        if self._grab_failed:
+            for extra in self._IGNORED_MASKS:
+                xlib.XUngrabKey(display, keycode, modifiers | extra, root)
+            xlib.XSync(display, 0)
+        # 抓取结果已经确认：错误处理函数是整个进程共用的，立即恢复原来的，
+        # 以免吞掉进程中其他使用Xlib的代码（如Qt）之后产生的错误
+        xlib.XSetErrorHandler(ctypes.cast(previous_handler, _X_ERROR_HANDLER))
+        if self._grab_failed:
+            xlib.XCloseDisplay(display)
+            self._error = "热键已被其他程序占用"
+            self._ready.set()
+            return
+        # 按住不放时X服务器只重复发送按下事件，不再夹带松开事件，便于忽略自动重复
+        xlib.XkbSetDetectableAutoRepeat(display, 1, None)
+        self._wake_r, self._wake_w = os.pipe()
+        self._ready.set()
+
+        x_fd = xlib.XConnectionNumber(display)
+        event = _XEvent()
+        held = False
+        try:
+            while True:
+                readable, _, _ = select.select([x_fd, self._wake_r], [], [])
+                if self._wake_r in readable:
+                    break
+                while xlib.XPending(display):
+                    xlib.XNextEvent(display, ctypes.byref(event))
+                    if event.type == self._KEY_RELEASE and event.xkey.keycode == keycode:
+                        held = False
+                    elif event.type == self._KEY_PRESS and event.xkey.keycode == keycode:
+                        if held:
+                            continue
+                        held = True
+                        try:
+                            callback()
+                        except Exception as e:
+                            logging.error(f"处理热键时发生错误: {str(e)}")
+        finally:
+            for extra in self._IGNORED_MASKS:
+                xlib.XUngrabKey(display, keycode, modifiers | extra, root)
+            xlib.XCloseDisplay(display)
+            os.close(self._wake_r)
+
+    def unregister(self):
+        if self._thread is not None and self._wake_w is not None:
+            os.write(self._wake_w, b"x")
+            self._thread.join(1)
+            os.close(self._wake_w)
+            self._wake_w = None
+            self._thread = None
+
+
+class KeyboardHotkey(HotkeyBackend):
+    """keyboard库的全局键盘钩子（原来的实现），其他后端不可用时使用"""
+    name = "keyboard"
+
+    def __init__(self, chord):
+        super().__init__(chord)
+        self._handle = None
+
+    def register(self, callback):
+        names = [_KEYBOARD_NAMES[name] for name in sorted(self.chord.modifiers)] + [self.chord.key]
+        try:
+            import keyboard
+            self._handle = keyboard.add_hotkey("+".join(names), callback)
+        except Exception as e:
+            # 例如Linux下没有权限读取输入设备、按键名称无法识别
+            raise OSError(f"keyboard注册热键失败: {type(e).__name__} {e}")
+
+    def unregister(self):
+        if self._handle is not None:
+            import keyboard
+            keyboard.remove_hotkey(self._handle)
+            self._handle = None
+
+    def modifiers_pressed(self):
+        import keyboard
+        return any(keyboard.is_pressed(_KEYBOARD_NAMES[name]) for name in self.chord.modifiers)
+
+
+_NATIVE_BACKENDS = (WindowsHotkey, X11Hotkey)
+
+
+def create_hotkey(config, callback):
+    """
+    按配置注册全局热键
+
+    hotkey_backend为auto时优先使用系统原生的注册方式，失败时退回keyboard；
+    为native或keyboard时只使用指定的方式。
+
+    Returns:
+        注册成功的HotkeyBackend；全部失败时返回None
+    """
+    try:
+        chord = Chord(config["hotkey"])
+    except ValueError as e:
+        logging.error(f"{str(e)}，使用默认热键")
+        chord = Chord(DEFAULT_CONFIG["hotkey"])
+    debounced = _Debounced(callback, config["hotkey_debounce_ms"] / 1000)
+    candidates = []
+    if config["hotkey_backend"] in ("auto", "native"):
+        candidates.extend(backend for backend in _NATIVE_BACKENDS if backend.available())
+    if config["hotkey_backend"] in ("auto", "keyboard"):
+        candidates.append(KeyboardHotkey)
+    for backend_class in candidates:
+        backend = backend_class(chord)
+        try:
+            backend.register(debounced)
+        except OSError as e:
+            logging.warning(f"热键后端 {backend.name} 不可用: {str(e)}")
+            continue
+        logging.info(f"已注册热键 {chord.display()} (后端: {backend.name})")
+        return backend
+    logging.error(f"无法注册热键 {chord.display()}")
+    return None
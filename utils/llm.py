@@ -1,64 +1,1199 @@
+import json
+import math
+import time
+import asyncio
+import threading
+import contextvars
 import requests
 import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+try:
+    import httpx
+except ImportError:
+    # 未安装httpx时，异步接口退化为在线程池中执行同步请求
+    httpx = None
 from utils.config import get_config
+from utils.cache import get_cache, make_cache_key
+from utils.dictionary import Dictionary, get_dictionary
+from utils.translation_memory import get_memory
+from utils.segmenter import split_text, estimate_tokens, join_separator, join_translations
+from utils.backends import TranslationBackend, register_backend, get_backend, route
+from utils import metrics, quota
+from utils.logger import snippet
+from utils.langdetect import detect, choose_target
+from utils.quota import QuotaExceeded
+from utils.resilience import (RETRYABLE_STATUS, AllEndpointsUnavailable, get_endpoints,
+                              parse_retry_after, backoff_delay, get_breaker, get_latency_tracker)
 
 # 翻译提示词
 TRANSLATION_SYSTEM_PROMPT = """
 你是一个翻译助手，可以提供中英相互翻译，如果是英文则翻译为中文，反之亦然
 返回结果只有翻译后的内容，不要包含其他内容
 """
+# 已在本地判断出翻译方向时使用的较短提示词，按目标语言区分
+DIRECTION_PROMPTS = {
+    "zh": "把用户给出的文本翻译成简体中文，只输出译文",
+    "en": "Translate the user's text into English. Output only the translation.",
+}
+# 提示词版本，修改提示词后需递增，使旧的缓存结果失效
+PROMPT_VERSION = 2
 
-def translate_text(text):
+class TranslationCancelled(Exception):
+    """翻译被调用方取消（例如已有更新的翻译请求）"""
+
+# 按API地址复用的HTTP会话，保持长连接以避免每次翻译重复DNS/TCP/TLS握手
+_sessions = {}
+_last_used = {}
+_sessions_lock = threading.Lock()
+
+def get_session(api_base_url, config=None):
+    """
+    获取指定API地址的共享会话（带连接池和keep-alive）
+
+    会话在所有翻译线程间共享，连接池大小由配置项http_pool_size决定。
+    """
+    key = api_base_url.rstrip('/')
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            config = config or get_config()
+            pool_size = config["http_pool_size"]
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _sessions[key] = session
+    _touch(key)
+    return session
+
+def _touch(key):
+    """记录API地址最近一次使用的时间"""
+    _last_used[key] = time.monotonic()
+
+def prewarm(config=None, force=False):
+    """
+    在后台线程中预先建立到API地址的连接
+
+    启动时调用一次；之后仅在连接空闲超过http_idle_rewarm_seconds
+    （服务器可能已关闭长连接）时才重新预热，force=True时总是预热。
+    """
+    config = config or get_config()
+    api_base_url = get_endpoints(config)[0]["api_base_url"].rstrip('/')
+    if not api_base_url:
+        return
+    idle = time.monotonic() - _last_used.get(api_base_url, float('-inf'))
+    if not force and idle < config["http_idle_rewarm_seconds"]:
+        return
+    if _async_client is not None and httpx is not None:
+        # 热键翻译走异步客户端，预热它的连接池
+        _async_client.submit(_async_client.prewarm(api_base_url, config))
+        return
+    session = get_session(api_base_url, config)
+
+    def do_prewarm():
+        try:
+            # 只需完成握手并让连接回到连接池，响应状态无关紧要
+            session.head(api_base_url, timeout=5)
+            logging.info(f"已预热API连接: {api_base_url}")
+        except requests.exceptions.RequestException as e:
+            logging.warning(f"预热API连接失败: {str(e)}")
+
+    threading.Thread(target=do_prewarm, daemon=True).start()
+
+def _thread_call_later(delay, callback):
+    """在后台定时器线程中延迟调用callback（沿用当前的Trace等上下文），返回可cancel()的对象"""
+    context = contextvars.copy_context()
+    timer = threading.Timer(delay, context.run, (callback,))
+    timer.daemon = True
+    timer.start()
+    return timer
+
+class _DeltaCoalescer:
+    """
+    合并流式增量内容
+
+    增量内容会按flush_interval合并后再回调on_delta，避免过于频繁地刷新界面；
+    第一段内容总是立即回调，以尽快显示首个token。流暂停时由定时器补发已合并的内容，
+    界面显示的内容最多落后flush_interval。定时器中回调抛出的异常（如TranslationCancelled）
+    会在读取流的线程中下一次调用add()或close()时重新抛出。
+
+    call_later(delay, callback)用于安排定时器，默认使用后台线程；异步版本传入loop.call_later。
+    """
+
+    def __init__(self, on_delta, flush_interval, call_later=None):
+        self.on_delta = on_delta
+        self.flush_interval = flush_interval
+        self.parts = []
+        self.pending = []
+        self.last_flush = 0.0
+        self._call_later = call_later or _thread_call_later
+        # 保证定时器和读取线程的回调不会交错、乱序
+        self._lock = threading.Lock()
+        self._timer = None
+        self._error = None
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def add(self, delta):
+        self._raise_error()
+        self.parts.append(delta)
+        with self._lock:
+            self.pending.append(delta)
+            wait = self.last_flush + self.flush_interval - time.monotonic()
+            if 0 < wait and self._timer is None:
+                self._timer = self._call_later(wait, self._flush_from_timer)
+        if wait <= 0:
+            self.flush()
+
+    def _flush_from_timer(self):
+        try:
+            self.flush()
+        except Exception as e:
+            self._error = e
+
+    def flush(self):
+        with self._lock:
+            self._cancel_timer()
+            self.last_flush = time.monotonic()
+            if self.pending:
+                text = "".join(self.pending)
+                self.pending.clear()
+                self.on_delta(text)
+
+    def _cancel_timer(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def close(self):
+        """流正常结束：回调剩余的内容"""
+        self.flush()
+        self._raise_error()
+
+    def cancel(self):
+        """流异常中止：取消定时器，不再回调"""
+        with self._lock:
+            self._cancel_timer()
+            self.pending.clear()
+
+    def result(self):
+        return "".join(self.parts)
+
+_STREAM_DONE = object()
+
+def _record_usage(usage):
+    """响应中的token用量计入当前Trace，并用于修正限流额度和每日花费"""
+    metrics.record_usage(usage)
+    quota.record_usage(usage)
+
+def _parse_sse_line(line):
+    """
+    解析一行SSE数据，返回增量内容、None（无内容）或_STREAM_DONE
+
+    携带usage字段的数据块（stream_options.include_usage）会计入当前Trace。
+    """
+    line = line.strip()
+    if not line.startswith("data:"):
+        return None
+    payload = line[len("data:"):].strip()
+    if payload == "[DONE]":
+        return _STREAM_DONE
+    chunk = json.loads(payload)
+    if chunk.get("usage"):
+        _record_usage(chunk["usage"])
+    choices = chunk.get("choices") or []
+    if not choices:
+        return None
+    return (choices[0].get("delta") or {}).get("content") or None
+
+def _read_stream(response, on_delta, flush_interval):
+    """
+    解析OpenAI兼容的SSE流式响应
+
+    Returns:
+        完整的翻译结果
+    """
+    coalescer = _DeltaCoalescer(on_delta, flush_interval)
+    try:
+        for raw_line in response.iter_lines():
+            # SSE响应通常不声明字符集，这里统一按UTF-8解码
+            delta = _parse_sse_line(raw_line.decode('utf-8'))
+            if delta is _STREAM_DONE:
+                break
+            if delta:
+                coalescer.add(delta)
+        coalescer.close()
+    finally:
+        coalescer.cancel()
+    return coalescer.result()
+
+async def _read_stream_async(response, on_delta, flush_interval):
+    """_read_stream的异步版本，用于httpx的流式响应"""
+    coalescer = _DeltaCoalescer(on_delta, flush_interval, asyncio.get_running_loop().call_later)
+    try:
+        async for line in response.aiter_lines():
+            delta = _parse_sse_line(line)
+            if delta is _STREAM_DONE:
+                break
+            if delta:
+                coalescer.add(delta)
+        coalescer.close()
+    finally:
+        coalescer.cancel()
+    return coalescer.result()
+
+def _build_request(messages, config, stream):
+    """构造/chat/completions请求的地址、请求头和请求体"""
+    url = f"{config['api_base_url'].rstrip('/')}/chat/completions"
+    headers = {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {config['api_key']}"
+    }
+    data = {
+        "model": config["model"],
+        "messages": messages
+    }
+    if config["max_tokens"] > 0:
+        data["max_tokens"] = config["max_tokens"]
+    if stream:
+        data["stream"] = True
+        if config["stream_include_usage"]:
+            data["stream_options"] = {"include_usage": True}
+    return url, headers, data
+
+def _chat_completion_once(messages, config, on_delta, timeout):
+    """向单个端点发送一次/chat/completions请求，不做重试"""
+    stream = on_delta is not None and config["stream"]
+    url, headers, data = _build_request(messages, config, stream)
+    
+    session = get_session(config["api_base_url"], config)
+    response = session.post(
+        url, 
+        headers=headers, 
+        json=data, 
+        timeout=timeout,
+        stream=stream
+    )
+    metrics.record("headers", response.elapsed.total_seconds() * 1000)
+    response.raise_for_status()
+    if stream:
+        flush_interval = config["stream_flush_interval_ms"] / 1000
+        with response:
+            return _read_stream(response, on_delta, flush_interval)
+    result = response.json()
+    if result.get("usage"):
+        _record_usage(result["usage"])
+    return result["choices"][0]["message"]["content"]
+
+class _DeltaGuard:
+    """包装增量回调，记录是否已经向调用方输出过内容（输出后不能再重试或切换端点）"""
+
+    def __init__(self, on_delta):
+        self.on_delta = on_delta
+        self.started = False
+
+    def __call__(self, delta):
+        self.started = True
+        self.on_delta(delta)
+
+def _retry_info(e):
+    """判断异常是否值得重试，返回(是否可重试, 服务端要求的等待秒数, 是否为HTTP状态错误)"""
+    response = getattr(e, "response", None)
+    if response is not None:
+        retry_after = parse_retry_after(response.headers.get("Retry-After"))
+        return response.status_code in RETRYABLE_STATUS, retry_after, True
+    if isinstance(e, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True, None, False
+    if httpx is not None and isinstance(e, httpx.TransportError):
+        return True, None, False
+    return False, None, False
+
+def _record_outcome(breaker, e):
+    """根据失败类型更新熔断器：服务端返回非重试类状态码说明端点本身可用"""
+    retryable, _, is_status = _retry_info(e)
+    if is_status and not retryable:
+        breaker.record_success()
+    else:
+        breaker.record_failure()
+
+def _retrieve_exception(task):
+    """取出已结束任务的异常，避免任务被取消时出现“exception was never retrieved”警告"""
+    if not task.cancelled():
+        task.exception()
+
+def _timed_delta(on_delta, tracker, start):
+    """包装增量回调，记录首个token的延迟"""
+    state = {"first": True}
+
+    def wrapper(delta):
+        if state["first"]:
+            state["first"] = False
+            elapsed = time.monotonic() - start
+            tracker.record(elapsed)
+            metrics.record("ttfb", elapsed * 1000)
+        on_delta(delta)
+    return wrapper
+
+def chat_completion(messages, config=None, on_delta=None, timeout=10):
+    """
+    发送/chat/completions请求并返回模型输出的内容
+
+    按配置中的端点顺序依次尝试，对每个端点的临时性错误（429、5xx、连接失败）
+    做带抖动的指数退避重试，并遵循Retry-After；已熔断的端点会被跳过。
+
+    Args:
+        messages: 对话消息列表
+        config: 使用的配置，默认读取当前配置
+        on_delta: 可选的增量回调，提供且配置允许时使用流式输出
+        timeout: 单次请求超时时间（秒）
+
+    Raises:
+        requests.exceptions.RequestException: 请求失败
+        KeyError: 响应格式异常
+        AllEndpointsUnavailable: 所有端点均已熔断
+        QuotaExceeded: 超过每日花费上限或等待限流额度超时
+    """
+    config = config or get_config()
+    with quota.reserve(messages, config):
+        return _chat_completion_failover(messages, config, on_delta, timeout)
+
+class _Served:
+    """记录一次翻译中是否有请求由备用端点完成（分段翻译的线程和异步任务共用同一个对象）"""
+    fallback = False
+
+_served = contextvars.ContextVar("cuteng_served", default=None)
+
+def track_fallback():
+    """开始记录当前翻译是否有请求由备用端点完成，返回_Served对象"""
+    served = _Served()
+    _served.set(served)
+    return served
+
+def _note_success(endpoint):
+    """请求成功：由备用端点完成时记下，其译文不能当作主端点模型的结果缓存"""
+    served = _served.get()
+    if served is not None and endpoint.get("fallback"):
+        served.fallback = True
+
+def _served_by_fallback():
+    served = _served.get()
+    return served is not None and served.fallback
+
+def _chat_completion_failover(messages, config, on_delta, timeout):
+    """按端点顺序请求，每个端点带退避重试"""
+    guard = _DeltaGuard(on_delta) if on_delta is not None else None
+    last_error = None
+    for endpoint in get_endpoints(config):
+        breaker = get_breaker(endpoint)
+        if not breaker.allow():
+            logging.warning(f"端点已熔断，跳过: {endpoint['api_base_url']}")
+            continue
+        stream = guard is not None and endpoint["stream"]
+        tracker = get_latency_tracker(endpoint, stream)
+        for attempt in range(endpoint["retry_max_attempts"]):
+            start = time.monotonic()
+            try:
+                callback = _timed_delta(guard, tracker, start) if guard is not None else None
+                result = _chat_completion_once(messages, endpoint, callback, timeout)
+                if not stream:
+                    tracker.record(time.monotonic() - start)
+                breaker.record_success()
+                _note_success(endpoint)
+                return result
+            except TranslationCancelled:
+                breaker.release_probe()
+                raise
+            except Exception as e:
+                last_error = e
+                _record_outcome(breaker, e)
+                retryable, retry_after, _ = _retry_info(e)
+                if guard is not None and guard.started:
+                    # 已经输出了部分内容，无法重试
+                    raise
+                if not retryable or attempt + 1 >= endpoint["retry_max_attempts"] or not breaker.allow():
+                    break
+                delay = backoff_delay(attempt, endpoint["retry_base_delay_ms"] / 1000,
+                                      endpoint["retry_max_delay_ms"] / 1000, retry_after)
+                logging.warning(f"API请求失败，{delay:.2f}秒后重试: {str(e)}")
+                time.sleep(delay)
+        logging.warning(f"端点请求失败，尝试下一个端点: {endpoint['api_base_url']}")
+    if last_error is None:
+        raise AllEndpointsUnavailable("所有API端点均已熔断，请稍后再试")
+    raise last_error
+
+def _target_language(text, config):
+    """本地检测文本语言，返回目标语言（zh或en）"""
+    return choose_target(detect(text), config["target_language"])
+
+def _build_messages(text, context="", reference=None, target=None):
+    content = f"请翻译: {text}"
+    if reference is not None:
+        # 翻译记忆库中相似原文的已有译文，帮助模型保持用词一致
+        content = f"相似原文的已有译文（仅供参考）:\n原文: {reference.source}\n译文: {reference.target}\n\n{content}"
+    if context:
+        # 分段翻译时附带前文，只用于保持译文连贯
+        content = f"上文（仅供参考，不要翻译）:\n{context}\n\n{content}"
+    return [
+        {"role": "system", "content": DIRECTION_PROMPTS.get(target, TRANSLATION_SYSTEM_PROMPT)},
+        {"role": "user", "content": content}
+    ]
+
+def _prepare(text, config, context="", target=None):
+    """
+    查询翻译记忆库并生成请求消息
+
+    target为None时按text本身检测翻译方向；分段翻译时传入按全文检测的方向，使各段方向一致
+
+    Returns:
+        (可直接使用的历史译文或None, 请求消息)
+    """
+    target = target or _target_language(text, config)
+    memory = get_memory(config)
+    match = None
+    if memory is not None:
+        start = time.perf_counter()
+        # 只在相同翻译方向的句段中查找，避免把另一方向的译文当作结果
+        match = memory.lookup(text, target, config["tm_reference_threshold"])
+        metrics.record("memory", (time.perf_counter() - start) * 1000)
+        trace = metrics.current_trace()
+        if trace is not None and match is not None:
+            trace.set(tm_score=round(match.score, 3))
+    # 只有原文完全相同、且由当前的模型和提示词版本得到时才直接使用历史译文，其余只作为参考
+    if match is not None and match.exact and (match.model, match.prompt_version) == (config["model"], PROMPT_VERSION):
+        logging.info(f"命中翻译记忆库 (相似度 {match.score:.2f}): {snippet(text)}")
+        return match.target, None
+    return None, _build_messages(text, context, match, target)
+
+def _remember(source, translation, config, target=None):
+    """把新翻译的句段按翻译方向写入翻译记忆库，target为None时按source检测；备用端点的译文不记录"""
+    memory = get_memory(config)
+    if memory is not None and not _served_by_fallback():
+        memory.add(source, translation, target or _target_language(source, config), config["model"], PROMPT_VERSION)
+
+def _split_long_text(text, config):
+    """按配置切分长文本，短文本返回只有一段的列表"""
+    segments = split_text(text, config["long_text_max_tokens"], config["long_text_overlap_sentences"])
+    if len(segments) > 1:
+        logging.info(f"长文本分为{len(segments)}段并发翻译")
+        trace = metrics.current_trace()
+        if trace is not None:
+            trace.set(segments=len(segments))
+    return segments
+
+def _segment_timeout(segment):
+    """单段请求的超时时间（秒），随分段长度增加"""
+    return max(10, estimate_tokens(segment.text) // 20)
+
+def _segment_failed(index, e):
+    return f"[第{index + 1}段{_describe_error(e)}]"
+
+class _OrderedDeltas:
+    """
+    分段并发翻译时按原文顺序输出增量内容
+
+    最前面的未完成分段的增量直接转发，后面分段的增量先缓存，
+    等前面的分段完成后再依次输出，界面上的译文始终与原文顺序一致。
+    """
+
+    def __init__(self, segments, on_delta):
+        self.segments = segments
+        self.on_delta = on_delta
+        self._lock = threading.Lock()
+        self._buffers = [[] for _ in segments]
+        self._emitted = ["" for _ in segments]
+        self._started = [False] * len(segments)
+        self._results = [None] * len(segments)
+        self._head = 0
+
+    def _emit(self, index, text):
+        if not self._started[index]:
+            self._started[index] = True
+            if index:
+                text = join_separator(self._results[index - 1], self.segments[index].separator) + text
+        self._emitted[index] += text
+        if text:
+            self.on_delta(text)
+
+    def delta(self, index, text):
+        with self._lock:
+            if index == self._head:
+                self._emit(index, text)
+            else:
+                self._buffers[index].append(text)
+
+    def complete(self, index, translation):
+        with self._lock:
+            self._results[index] = translation
+            while self._head < len(self.segments) and self._results[self._head] is not None:
+                head = self._head
+                result = self._results[head]
+                if not self._started[head]:
+                    self._emit(head, result)
+                else:
+                    # 已经边收边显示的分段，只补上尚未显示的部分（例如出错信息）
+                    streamed = self._emitted[head].lstrip("\n ")
+                    self._emit(head, result[len(streamed):] if result.startswith(streamed) else "\n" + result)
+                self._head += 1
+                if self._head < len(self.segments) and self._results[self._head] is None:
+                    buffered = "".join(self._buffers[self._head])
+                    if buffered:
+                        self._emit(self._head, buffered)
+
+def _segments_target(segments, config):
+    """按全文检测翻译方向，避免夹杂其他语言句子的段落被译成另一种语言"""
+    return _target_language("".join(segment.text for segment in segments), config)
+
+def _translate_segments(segments, config, on_delta=None):
+    """
+    用线程池并发翻译各分段，返回(译文, 是否全部成功)
+
+    单个分段失败时在对应位置显示错误信息，不影响其他分段。
+    """
+    ordered = _OrderedDeltas(segments, on_delta) if on_delta is not None else None
+    target = _segments_target(segments, config)
+
+    def translate_one(index):
+        segment = segments[index]
+        callback = (lambda delta: ordered.delta(index, delta)) if ordered is not None else None
+        try:
+            translation, messages = _prepare(segment.text, config, segment.context, target)
+            if translation is None:
+                translation = chat_completion(messages, config, callback, _segment_timeout(segment))
+                _remember(segment.text, translation, config, target)
+            ok = True
+        except TranslationCancelled:
+            raise
+        except Exception as e:
+            translation, ok = _segment_failed(index, e), False
+        if ordered is not None:
+            ordered.complete(index, translation)
+        return translation, ok
+
+    # 各分段在线程池中沿用当前的Trace（用于计时和判断限流优先级）
+    contexts = [contextvars.copy_context() for _ in segments]
+    with ThreadPoolExecutor(max_workers=config["long_text_concurrency"]) as executor:
+        results = list(executor.map(lambda i: contexts[i].run(translate_one, i), range(len(segments))))
+    return join_translations(segments, [t for t, _ in results]), all(ok for _, ok in results)
+
+def _untranslatable(text, config):
+    """
+    本地判断文本是否不需要翻译（数字、网址、路径、代码，或已经是目标语言）
+
+    Returns:
+        不需要翻译的原因，需要翻译时返回None
+    """
+    detection = detect(text)
+    reason = detection.skip
+    if reason is None and choose_target(detection, config["target_language"]) is None:
+        reason = "target_language"
+    trace = metrics.current_trace()
+    if trace is not None:
+        trace.set(lang=detection.lang, single_token=detection.single_token)
+        if reason is not None:
+            trace.set(skipped=reason)
+    if reason is not None:
+        logging.info(f"无需翻译 ({reason}): {snippet(text)}")
+    return reason
+
+def _single_config(text, config):
+    """单个词的译文很短，限制输出的token数，避免模型附加解释"""
+    if config["single_token_max_tokens"] > 0 and detect(text).single_token:
+        return dict(config, max_tokens=config["single_token_max_tokens"])
+    return config
+
+def _lookup_dictionary(text, config):
+    """单词和短语先查离线词典，返回释义，未收录或不适合查词典时返回None"""
+    if not Dictionary.is_query(text):
+        return None
+    dictionary = get_dictionary(config)
+    if dictionary is None:
+        return None
+    start = time.perf_counter()
+    entry = dictionary.lookup(text)
+    metrics.record("dictionary", (time.perf_counter() - start) * 1000)
+    trace = metrics.current_trace()
+    if trace is not None:
+        trace.set(chars=len(text), dictionary_hit=entry is not None)
+    if entry is not None:
+        logging.info(f"命中离线词典: {snippet(text)}")
+    return entry
+
+def select_local_backend(text, config):
+    """按文本长度选择本地后端，应交给远程API时返回None"""
+    name = route(text, config)
+    if name is None:
+        return None
+    backend = get_backend(name, config)
+    if backend is None or not backend.available():
+        return None
+    return backend
+
+def cache_key_for(text, config, backend=None):
+    """翻译结果的缓存键，不同后端（模型、地址）和不同翻译方向的结果分开缓存"""
+    model, base_url = backend.cache_id if backend is not None else (config["model"], config["api_base_url"])
+    return make_cache_key(text, model, base_url, PROMPT_VERSION, _target_language(text, config))
+
+def _lookup_cache(text, config, backend=None):
+    """返回(缓存实例, 缓存键, 缓存结果)，未启用缓存时缓存实例为None"""
+    start = time.perf_counter()
+    cache = get_cache(config) if config["cache_enabled"] else None
+    cache_key = cache_key_for(text, config, backend)
+    cached = cache.get(cache_key) if cache is not None else None
+    metrics.record("cache", (time.perf_counter() - start) * 1000)
+    trace = metrics.current_trace()
+    if trace is not None:
+        model = backend.cache_id[0] if backend is not None else config["model"]
+        trace.set(model=model, chars=len(text), cache_hit=cached is not None)
+    if cached is not None:
+        logging.info(f"命中翻译缓存: {snippet(text)}")
+    return cache, cache_key, cached
+
+def _store(cache, cache_key, translation, ok, served):
+    """写入缓存；缓存键对应主端点的模型，有请求由备用端点完成时不写入"""
+    if cache is None or not ok:
+        return
+    if served.fallback:
+        logging.info("译文由备用端点完成，不写入缓存")
+        return
+    cache.put(cache_key, translation)
+
+def _http_trace_hook():
+    """
+    生成httpx的trace回调，记录建立连接和等待响应头的耗时
+
+    复用连接池中的连接时不会触发建连事件，连接耗时记为0。
+    """
+    start = time.perf_counter()
+    state = {}
+
+    async def hook(event_name, info):
+        now = time.perf_counter()
+        if event_name == "connection.connect_tcp.started":
+            state["connect"] = now
+        elif event_name.endswith("send_request_headers.started") and "sent" not in state:
+            state["sent"] = now
+            metrics.record("connect", (now - state.get("connect", now)) * 1000)
+        elif event_name.endswith("receive_response_headers.complete"):
+            metrics.record("headers", (now - start) * 1000)
+    return hook
+
+def _describe_error(e):
+    """记录翻译过程中的异常并返回显示给用户的错误信息"""
+    if isinstance(e, requests.exceptions.RequestException) or (httpx is not None and isinstance(e, httpx.HTTPError)):
+        logging.error(f"API请求错误: {str(e)}")
+        return f"翻译出错: API请求失败\n{str(e)}"
+    if isinstance(e, QuotaExceeded):
+        logging.warning(f"请求被限额拦截: {str(e)}")
+        return f"翻译出错: {str(e)}"
+    if isinstance(e, asyncio.TimeoutError):
+        logging.error("翻译超时")
+        return "翻译出错: 翻译超时"
+    if isinstance(e, KeyError):
+        logging.error(f"API响应解析错误: {str(e)}")
+        return f"翻译出错: API响应格式异常\n{str(e)}"
+    logging.error(f"未知错误: {str(e)}")
+    return f"翻译出错: {str(e)}"
+
+def _local_failed(backend, e, config, guard):
+    """本地后端翻译失败：可以改用远程API时记录警告，否则向上抛出"""
+    if isinstance(e, TranslationCancelled) or not config["api_key"] or (guard is not None and guard.started):
+        raise e
+    logging.warning(f"本地翻译后端（{backend.name}）失败，改用远程API: {str(e)}")
+
+def _translate_local(backend, text, config, on_delta):
+    """
+    使用本地后端翻译短文本
+
+    Returns:
+        译文；本地翻译失败且可以改用远程API时返回None
+    """
+    guard = _DeltaGuard(on_delta) if on_delta is not None else None
+    start = time.perf_counter()
+    try:
+        translation = backend.translate(text, guard, config["local_timeout_seconds"])
+    except Exception as e:
+        _local_failed(backend, e, config, guard)
+        return None
+    metrics.record("local", (time.perf_counter() - start) * 1000)
+    return translation
+
+def translate_text(text, on_delta=None, trace=None):
     """
     调用大语言模型API进行翻译
     
     Args:
         text: 要翻译的文本
+        on_delta: 可选的回调函数，启用流式输出时会陆续收到增量翻译内容；
+            回调抛出TranslationCancelled时会中止请求并向上抛出
+        trace: 可选的metrics.Trace，记录各阶段耗时和token用量
         
     Returns:
         翻译结果或错误信息
     """
+    if trace is not None:
+        metrics.use_trace(trace)
     config = get_config()
-    api_base_url = config["api_base_url"]
-    api_key = config["api_key"]
-    model = config["model"]
     
-    if not api_key:
+    # 数字、网址、代码等原样返回，不调用API
+    if config["skip_untranslatable"] and _untranslatable(text, config):
+        return text
+    
+    # 单词和短语优先查离线词典，无需API密钥
+    entry = _lookup_dictionary(text, config)
+    if entry is not None:
+        return entry
+    
+    # 短文本可以交给本地后端，不需要API密钥
+    backend = select_local_backend(text, config)
+    if backend is None and not config["api_key"]:
         logging.warning("API密钥未设置")
+        if trace is not None:
+            trace.set(error="MissingApiKey")
         return "错误: 请先设置API密钥"
     
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {api_key}"
-    }
-    
-    data = {
-        "model": model,
-        "messages": [
-            {"role": "system", "content": TRANSLATION_SYSTEM_PROMPT},
-            {"role": "user", "content": f"请翻译: {text}"}
-        ]
-    }
+    # 先查缓存，命中则直接返回
+    cache, cache_key, cached = _lookup_cache(text, config, backend)
+    if cached is not None:
+        return cached
     
+    served = track_fallback()
     try:
-        logging.info(f"开始翻译: {text[:30]}...")
-        response = requests.post(
-            f"{api_base_url.rstrip('/')}/chat/completions", 
-            headers=headers, 
-            json=data, 
-            timeout=10
-        )
-        response.raise_for_status()
-        result = response.json()
-        translation = result["choices"][0]["message"]["content"]
+        logging.info(f"开始翻译: {snippet(text)}")
+        start = time.perf_counter()
+        translation = _translate_local(backend, text, config, on_delta) if backend is not None else None
+        # 本地翻译失败时改用远程API，远程译文不以本地后端的缓存键保存
+        ok = backend is None or translation is not None
+        if translation is None:
+            segments = _split_long_text(text, config)
+            if len(segments) > 1:
+                translation, ok = _translate_segments(segments, config, on_delta)
+            else:
+                translation, messages = _prepare(text, config)
+                if translation is None:
+                    translation = chat_completion(messages, _single_config(text, config), on_delta)
+                    _remember(text, translation, config)
+        metrics.record("completion", (time.perf_counter() - start) * 1000)
         logging.info("翻译成功")
+        _store(cache, cache_key, translation, ok, served)
         return translation
-    except requests.exceptions.RequestException as e:
-        logging.error(f"API请求错误: {str(e)}")
-        return f"翻译出错: API请求失败\n{str(e)}"
-    except KeyError as e:
-        logging.error(f"API响应解析错误: {str(e)}")
-        return f"翻译出错: API响应格式异常\n{str(e)}"
+    except TranslationCancelled:
+        logging.info("翻译已取消")
+        raise
     except Exception as e:
-        logging.error(f"未知错误: {str(e)}")
-        return f"翻译出错: {str(e)}" 
\ No newline at end of file
+        if trace is not None:
+            trace.set(error=type(e).__name__)
+        return _describe_error(e)
+
+class AsyncLLMClient:
+    """
+    基于asyncio的LLM客户端
+
+    所有请求都在同一个后台事件循环线程上执行，不再为每次翻译占用一个线程。
+    submit()返回concurrent.futures.Future，可在任意线程（包括Qt主线程）中
+    等待或取消；取消会真正中断正在进行的HTTP请求。
+    """
+
+    def __init__(self):
+        self._loop = asyncio.new_event_loop()
+        self._clients = {}
+        self._thread = threading.Thread(target=self._run_loop, name="llm-asyncio", daemon=True)
+        self._thread.start()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    def submit(self, coro):
+        """在事件循环线程上运行协程，返回concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def _get_client(self, api_base_url, config):
+        """获取指定API地址的httpx异步客户端（只在事件循环线程中调用）"""
+        key = api_base_url.rstrip('/')
+        client = self._clients.get(key)
+        if client is None:
+            limits = httpx.Limits(
+                max_connections=config["http_pool_size"],
+                max_keepalive_connections=config["http_pool_size"]
+            )
+            try:
+                client = httpx.AsyncClient(http2=config["http2"], limits=limits)
+            except ImportError:
+                logging.warning("未安装h2，无法启用HTTP/2，使用HTTP/1.1")
+                client = httpx.AsyncClient(limits=limits)
+            self._clients[key] = client
+        _touch(key)
+        return client
+
+    async def prewarm(self, api_base_url, config):
+        """预先建立到API地址的连接"""
+        if httpx is None:
+            return
+        try:
+            await self._get_client(api_base_url, config).head(api_base_url, timeout=5)
+            logging.info(f"已预热API连接: {api_base_url}")
+        except httpx.HTTPError as e:
+            logging.warning(f"预热API连接失败: {str(e)}")
+
+    async def _chat_completion_once(self, messages, config, on_delta, timeout):
+        """向单个端点发送一次请求，不做重试"""
+        stream = on_delta is not None and config["stream"]
+        url, headers, data = _build_request(messages, config, stream)
+        client = self._get_client(config["api_base_url"], config)
+        extensions = {"trace": _http_trace_hook()}
+        if stream:
+            async with client.stream("POST", url, headers=headers, json=data, timeout=timeout,
+                                     extensions=extensions) as response:
+                response.raise_for_status()
+                flush_interval = config["stream_flush_interval_ms"] / 1000
+                return await _read_stream_async(response, on_delta, flush_interval)
+        response = await client.post(url, headers=headers, json=data, timeout=timeout, extensions=extensions)
+        response.raise_for_status()
+        result = response.json()
+        if result.get("usage"):
+            _record_usage(result["usage"])
+        return result["choices"][0]["message"]["content"]
+
+    async def _try_endpoint(self, messages, endpoint, on_delta, guard, timeout):
+        """对单个端点带退避重试地请求，失败时抛出最后一次的异常"""
+        breaker = get_breaker(endpoint)
+        stream = on_delta is not None and endpoint["stream"]
+        tracker = get_latency_tracker(endpoint, stream)
+        for attempt in range(endpoint["retry_max_attempts"]):
+            start = time.monotonic()
+            try:
+                callback = _timed_delta(on_delta, tracker, start) if on_delta is not None else None
+                result = await self._chat_completion_once(messages, endpoint, callback, timeout)
+                if not stream:
+                    tracker.record(time.monotonic() - start)
+                breaker.record_success()
+                _note_success(endpoint)
+                return result
+            except (TranslationCancelled, asyncio.CancelledError):
+                # 用户取消或对冲落败时请求没有结果，不计成功也不计失败
+                breaker.release_probe()
+                raise
+            except Exception as e:
+                _record_outcome(breaker, e)
+                retryable, retry_after, _ = _retry_info(e)
+                if (guard is not None and guard.started) or not retryable \
+                        or attempt + 1 >= endpoint["retry_max_attempts"] or not breaker.allow():
+                    raise
+                delay = backoff_delay(attempt, endpoint["retry_base_delay_ms"] / 1000,
+                                      endpoint["retry_max_delay_ms"] / 1000, retry_after)
+                logging.warning(f"API请求失败，{delay:.2f}秒后重试: {str(e)}")
+                await asyncio.sleep(delay)
+
+    def _hedge_delay(self, endpoint, stream):
+        """主端点的对冲触发时间：最近请求耗时的指定百分位，样本不足时返回None"""
+        if not endpoint["hedge_enabled"]:
+            return None
+        tracker = get_latency_tracker(endpoint, stream)
+        if len(tracker) < endpoint["hedge_min_samples"]:
+            return None
+        return tracker.percentile(endpoint["hedge_percentile"])
+
+    async def _hedged(self, messages, primary, remaining, guard, timeout):
+        """
+        主端点超过延迟百分位仍未返回时，向下一个端点发起对冲请求，采用先完成的结果
+
+        流式请求以先输出内容的一方为准，另一方立即取消。
+        """
+        stream = guard is not None and primary["stream"]
+        delay = self._hedge_delay(primary, stream)
+        if delay is None or not remaining:
+            return await self._try_endpoint(messages, primary, guard, guard, timeout)
+
+        tasks = {}
+        winner = []
+
+        def arbitrated(name):
+            def on_delta(delta):
+                if not winner:
+                    winner.append(name)
+                    for other, task in tasks.items():
+                        if other != name:
+                            task.cancel()
+                if winner[0] != name:
+                    raise TranslationCancelled()
+                guard(delta)
+            return on_delta if guard is not None else None
+
+        tasks["primary"] = asyncio.ensure_future(
+            self._try_endpoint(messages, primary, arbitrated("primary"), guard, timeout))
+        tasks["primary"].add_done_callback(_retrieve_exception)
+        try:
+            done, _ = await asyncio.wait([tasks["primary"]], timeout=delay)
+            if done or winner or not get_breaker(remaining[0]).allow():
+                return await tasks["primary"]
+
+            secondary = remaining.popleft()
+            logging.info(f"主端点超过{delay:.2f}秒未响应，向 {secondary['api_base_url']} 发起对冲请求")
+            tasks["secondary"] = asyncio.ensure_future(
+                self._try_endpoint(messages, secondary, arbitrated("secondary"), guard, timeout))
+            tasks["secondary"].add_done_callback(_retrieve_exception)
+            pending = set(tasks.values())
+            last_error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.cancelled():
+                        continue
+                    if task.exception() is None:
+                        return task.result()
+                    if not isinstance(task.exception(), TranslationCancelled):
+                        last_error = task.exception()
+            raise last_error or TranslationCancelled()
+        finally:
+            for task in tasks.values():
+                task.cancel()
+
+    async def chat_completion(self, messages, config=None, on_delta=None, timeout=10):
+        """
+        chat_completion的异步版本
+
+        同样按端点顺序失败切换并退避重试，另外支持对冲请求（hedge_enabled）。
+        异常类型为httpx.HTTPError、KeyError、AllEndpointsUnavailable或QuotaExceeded。
+        """
+        config = config or get_config()
+        if httpx is None:
+            return await self._loop.run_in_executor(
+                None, chat_completion, messages, config, on_delta, timeout
+            )
+        with await quota.reserve_async(messages, config):
+            return await self._failover(messages, config, on_delta, timeout)
+
+    async def _failover(self, messages, config, on_delta, timeout):
+        """按端点顺序请求，主端点可带对冲请求"""
+        guard = _DeltaGuard(on_delta) if on_delta is not None else None
+        remaining = deque(get_endpoints(config))
+        last_error = None
+        while remaining:
+            endpoint = remaining.popleft()
+            if not get_breaker(endpoint).allow():
+                logging.warning(f"端点已熔断，跳过: {endpoint['api_base_url']}")
+                continue
+            try:
+                return await self._hedged(messages, endpoint, remaining, guard, timeout)
+            except (TranslationCancelled, asyncio.CancelledError):
+                raise
+            except Exception as e:
+                last_error = e
+                if guard is not None and guard.started:
+                    raise
+                logging.warning(f"端点请求失败，尝试下一个端点: {endpoint['api_base_url']}")
+        if last_error is None:
+            raise AllEndpointsUnavailable("所有API端点均已熔断，请稍后再试")
+        raise last_error
+
+    async def _blocking(self, func, *args):
+        """在线程池中执行翻译记忆库的查询等磁盘I/O，不阻塞事件循环（保留当前Trace）"""
+        context = contextvars.copy_context()
+        return await self._loop.run_in_executor(None, context.run, func, *args)
+
+    def _remember_later(self, source, translation, config, target=None):
+        """在线程池中写入翻译记忆库，不等待写入完成"""
+        context = contextvars.copy_context()
+        self._loop.run_in_executor(None, context.run, _remember, source, translation, config, target)
+
+    async def _translate_single(self, text, config, on_delta):
+        translation, messages = await self._blocking(_prepare, text, config)
+        if translation is None:
+            translation = await self.chat_completion(messages, _single_config(text, config), on_delta)
+            self._remember_later(text, translation, config)
+        return translation, True
+
+    async def _translate_local(self, backend, text, config, on_delta):
+        """_translate_local的异步版本，本地翻译失败时改用远程API（结果不缓存）"""
+        guard = _DeltaGuard(on_delta) if on_delta is not None else None
+        start = time.perf_counter()
+        try:
+            translation = await backend.translate_async(text, guard, config["local_timeout_seconds"])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            _local_failed(backend, e, config, guard)
+            translation, _ = await self._translate_single(text, config, on_delta)
+            return translation, False
+        metrics.record("local", (time.perf_counter() - start) * 1000)
+        return translation, True
+
+    async def _translate_segments(self, segments, config, on_delta):
+        """_translate_segments的异步版本，各分段作为并发任务执行"""
+        ordered = _OrderedDeltas(segments, on_delta) if on_delta is not None else None
+        semaphore = asyncio.Semaphore(config["long_text_concurrency"])
+        target = _segments_target(segments, config)
+
+        async def translate_one(index):
+            segment = segments[index]
+            callback = (lambda delta: ordered.delta(index, delta)) if ordered is not None else None
+            async with semaphore:
+                try:
+                    translation, messages = await self._blocking(
+                        _prepare, segment.text, config, segment.context, target)
+                    if translation is None:
+                        translation = await self.chat_completion(messages, config, callback,
+                                                                 _segment_timeout(segment))
+                        self._remember_later(segment.text, translation, config, target)
+                    ok = True
+                except TranslationCancelled:
+                    raise
+                except Exception as e:
+                    translation, ok = _segment_failed(index, e), False
+            if ordered is not None:
+                ordered.complete(index, translation)
+            return translation, ok
+
+        tasks = [asyncio.ensure_future(translate_one(i)) for i in range(len(segments))]
+        for task in tasks:
+            task.add_done_callback(_retrieve_exception)
+        try:
+            results = await asyncio.gather(*tasks)
+        finally:
+            # 取消或某段抛出TranslationCancelled时，结束其余分段的请求
+            for task in tasks:
+                task.cancel()
+        return join_translations(segments, [t for t, _ in results]), all(ok for _, ok in results)
+
+    async def translate(self, text, on_delta=None, deadline=None, trace=None):
+        """
+        translate_text的异步版本
+
+        Args:
+            deadline: 整个翻译过程的时限（秒），超时返回错误信息
+            trace: 可选的metrics.Trace，只作用于当前任务
+
+        Returns:
+            翻译结果或错误信息；任务被取消时抛出asyncio.CancelledError
+        """
+        if trace is not None:
+            metrics.use_trace(trace)
+        config = get_config()
+        if config["skip_untranslatable"] and _untranslatable(text, config):
+            return text
+        entry = _lookup_dictionary(text, config)
+        if entry is not None:
+            return entry
+        backend = select_local_backend(text, config)
+        if backend is None and not config["api_key"]:
+            logging.warning("API密钥未设置")
+            if trace is not None:
+                trace.set(error="MissingApiKey")
+            return "错误: 请先设置API密钥"
+
+        cache, cache_key, cached = _lookup_cache(text, config, backend)
+        if cached is not None:
+            return cached
+
+        served = track_fallback()
+        try:
+            logging.info(f"开始翻译: {snippet(text)}")
+            start = time.perf_counter()
+            segments = _split_long_text(text, config)
+            if backend is not None:
+                coroutine = self._translate_local(backend, text, config, on_delta)
+            elif len(segments) > 1:
+                coroutine = self._translate_segments(segments, config, on_delta)
+                if deadline is not None:
+                    # 时限按需要几轮并发来放宽
+                    deadline *= math.ceil(len(segments) / config["long_text_concurrency"])
+            else:
+                coroutine = self._translate_single(text, config, on_delta)
+            task = asyncio.ensure_future(coroutine)
+            task.add_done_callback(_retrieve_exception)
+            translation, ok = await asyncio.wait_for(task, timeout=deadline)
+            metrics.record("completion", (time.perf_counter() - start) * 1000)
+            logging.info("翻译成功")
+            _store(cache, cache_key, translation, ok, served)
+            return translation
+        except asyncio.CancelledError:
+            logging.info("翻译已取消")
+            raise
+        except TranslationCancelled:
+            logging.info("翻译已取消")
+            raise
+        except Exception as e:
+            if trace is not None:
+                trace.set(error=type(e).__name__)
+            return _describe_error(e)
+
+_async_client = None
+_async_client_lock = threading.Lock()
+
+def get_async_client():
+    """获取全局异步客户端，首次调用时启动事件循环线程"""
+    global _async_client
+    if _async_client is None:
+        with _async_client_lock:
+            if _async_client is None:
+                _async_client = AsyncLLMClient()
+    return _async_client
+
+def translate_text_async(text, on_delta=None, deadline=None, trace=None):
+    """
+    在异步客户端上发起翻译，立即返回concurrent.futures.Future
+
+    调用result()可同步等待结果，调用cancel()可中断正在进行的请求。
+    """
+    client = get_async_client()
+    return client.submit(client.translate(text, on_delta, deadline, trace))
+
+class OpenAIBackend(TranslationBackend):
+    """
+    通过OpenAI兼容的/chat/completions接口翻译
+
+    远程API由translate_text等直接处理（还要查询翻译记忆库、切分长文本），不作为后端注册；
+    这里只是本机OpenAI兼容服务（LlamaCppBackend）的基类，复用同一套请求代码。
+    """
+
+    def _endpoint_config(self):
+        return self.config
+
+    @property
+    def cache_id(self):
+        config = self._endpoint_config()
+        return (config["model"], config["api_base_url"])
+
+    def warm(self):
+        config = self._endpoint_config()
+        get_session(config["api_base_url"], config)
+
+    def _request(self, text):
+        config = self._endpoint_config()
+        return _build_messages(text, target=_target_language(text, config)), _single_config(text, config)
+
+    def translate(self, text, on_delta=None, timeout=10):
+        messages, config = self._request(text)
+        return chat_completion(messages, config, on_delta, timeout)
+
+    async def translate_async(self, text, on_delta=None, timeout=10):
+        messages, config = self._request(text)
+        return await get_async_client().chat_completion(messages, config, on_delta, timeout)
+
+class LlamaCppBackend(OpenAIBackend):
+    """
+    本机的llama.cpp服务（llama-server）
+
+    与远程API使用同一套请求代码，只是地址指向本机，并且不做重试、失败切换和对冲；
+    模型常驻在服务进程中，并发请求由服务端合并批处理（启动时加--parallel）。
+    """
+    name = "llama_cpp"
+
+    def _endpoint_config(self):
+        return dict(
+            self.config,
+            api_base_url=self.config["local_llama_url"],
+            api_key=self.config["api_key"] or "local",
+            model=self.config["local_llama_model"],
+            endpoints=[],
+            retry_max_attempts=1,
+            hedge_enabled=False,
+            quota_enabled=False
+        )
+
+register_backend(LlamaCppBackend.name, LlamaCppBackend)
@@ -0,0 +1,159 @@
+"""
+日志
+
+各线程只把日志记录放入队列（QueueHandler），由后台线程（QueueListener）格式化并写入文件和控制台，
+磁盘和控制台的I/O不再占用热键和翻译线程的时间。日志文件超过大小或使用天数上限时轮转，
+旧文件压缩为.gz，只保留最近的若干个。
+
+选中的文本通过snippet()写入日志，按配置截断或只记录长度和摘要。
+"""
+import os
+import sys
+import gzip
+import json
+import time
+import queue
+import atexit
+import shutil
+import hashlib
+import logging
+import logging.handlers
+
+from utils import metrics
+
+LOG_FILE = "translator.log"
+
+# 选中文本在日志中的记录方式，由setup_logging()按配置设置
+_text_mode = "truncate"
+_text_max_chars = 30
+
+_listener = None
+
+
+def snippet(text):
+    """
+    返回写入日志的选中文本
+
+    truncate: 只保留前log_text_max_chars个字符；redact: 只记录长度和摘要；full: 完整记录
+    """
+    if text is None:
+        return ""
+    if _text_mode == "full":
+        return text
+    if _text_mode == "redact":
+        digest = hashlib.sha1(text.encode('utf-8')).hexdigest()[:8]
+        return f"<{len(text)}字 {digest}>"
+    if len(text) <= _text_max_chars:
+        return text
+    return text[:_text_max_chars] + "..."
+
+
+class JsonFormatter(logging.Formatter):
+    """每条日志输出为一行紧凑的JSON"""
+
+    def format(self, record):
+        data = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "thread": record.threadName,
+            "msg": record.getMessage(),
+        }
+        trace_id = getattr(record, "trace_id", None)
+        if trace_id:
+            data["trace"] = trace_id
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+
+class _TraceFilter(logging.Filter):
+    """在产生日志的线程中记下当前Trace的id，便于和性能记录对应"""
+
+    def filter(self, record):
+        trace = metrics.current_trace()
+        record.trace_id = trace.id if trace is not None else None
+        return True
+
+
+class CompressingRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """文件超过maxBytes或使用超过max_age秒时轮转，轮转出的旧文件用gzip压缩"""
+
+    def __init__(self, filename, max_bytes, max_age, backup_count):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8', delay=True)
+        self.max_age = max_age
+        self.namer = lambda name: name + ".gz"
+        self.rotator = self._compress
+        try:
+            self._opened_at = os.path.getmtime(filename)
+        except OSError:
+            self._opened_at = time.time()
+
+    @staticmethod
+    def _compress(source, dest):
+        with open(source, 'rb') as f_in, gzip.open(dest, 'wb') as f_out:
+            shutil.copyfileobj(f_in, f_out)
+        os.remove(source)
+
+    def shouldRollover(self, record):
+        if self.max_age > 0 and time.time() - self._opened_at > self.max_age:
+            return os.path.exists(self.baseFilename) and os.path.getsize(self.baseFilename) > 0
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        super().doRollover()
+        self._opened_at = time.time()
+
+
+def _formatter(config):
+    if config["log_format"] == "json":
+        return JsonFormatter()
+    return logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+
+
+def setup_logging(config, log_file=LOG_FILE):
+    """
+    按配置初始化日志：根日志器只挂一个QueueHandler，文件和控制台输出在后台线程中进行
+
+    可以重复调用（例如修改配置后），会先停止之前的后台线程。
+    """
+    global _listener, _text_mode, _text_max_chars
+    _text_mode = config["log_text_mode"]
+    _text_max_chars = config["log_text_max_chars"]
+
+    handlers = [CompressingRotatingFileHandler(
+        log_file,
+        max_bytes=int(config["log_max_mb"] * 1024 * 1024),
+        max_age=config["log_max_age_days"] * 86400,
+        backup_count=config["log_backup_count"]
+    )]
+    # 打包为窗口程序时没有控制台
+    if config["log_console"] and sys.stderr is not None:
+        handlers.append(logging.StreamHandler())
+    formatter = _formatter(config)
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    if _listener is not None:
+        _listener.stop()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    queue_handler = logging.handlers.QueueHandler(queue.SimpleQueue())
+    queue_handler.addFilter(_TraceFilter())
+    root.addHandler(queue_handler)
+    root.setLevel(getattr(logging, str(config["log_level"]).upper(), logging.INFO))
+
+    _listener = logging.handlers.QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def shutdown_logging():
+    """写出队列中剩余的日志并停止后台线程"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(shutdown_logging)
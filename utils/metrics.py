@@ -0,0 +1,318 @@
+import json
+import time
+import uuid
+import queue
+import atexit
+import logging
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# 翻译流程的各个阶段
+STAGES = ("capture", "dictionary", "cache", "memory", "local", "connect", "headers", "ttfb", "completion", "render", "total")
+
+_current_trace = contextvars.ContextVar("cuteng_trace", default=None)
+
+
+class Histogram:
+    """保留最近若干个样本的滚动直方图，用于计算p50/p95/p99"""
+
+    def __init__(self, size=1000):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        with self._lock:
+            self._samples.append(value)
+            self.count += 1
+            self.sum += value
+
+    def percentiles(self, *ps):
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return [None for _ in ps]
+        return [samples[min(len(samples) - 1, int(round(p / 100 * (len(samples) - 1))))] for p in ps]
+
+
+class _RecordWriter:
+    """
+    后台写出JSONL记录
+
+    调用方只把序列化好的记录放入队列，由后台线程批量追加到文件，
+    写文件不会阻塞翻译线程，也不占用指标的锁（与utils.logger中日志的做法相同）。
+    """
+
+    def __init__(self):
+        self._queue = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def put(self, path, line):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="metrics-writer", daemon=True)
+                    self._thread.start()
+        self._queue.put((path, line))
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            # 一次取出队列中已有的全部记录，每个文件只打开一次
+            while batch[-1] is not None:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._write([item for item in batch if item is not None])
+            if batch[-1] is None:
+                return
+
+    def _write(self, batch):
+        lines = {}
+        for path, line in batch:
+            lines.setdefault(path, []).append(line + "\n")
+        for path, group in lines.items():
+            try:
+                with open(path, 'a', encoding='utf-8') as f:
+                    f.writelines(group)
+            except OSError as e:
+                logging.error(f"写入指标文件失败: {str(e)}")
+
+    def close(self, timeout=2.0):
+        """写出队列中剩余的记录并停止后台线程"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join(timeout)
+
+
+class MetricsRegistry:
+    """全局指标：各阶段耗时直方图和计数器"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {stage: Histogram() for stage in STAGES}
+        self.counters = {}
+        self.startup = {}
+        self.export_file = None
+        self._writer = _RecordWriter()
+
+    def observe(self, stage, ms):
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(stage, Histogram())
+        histogram.observe(ms)
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def summary(self):
+        """返回各阶段的样本数和p50/p95/p99（毫秒），以及所有计数器"""
+        stages = {}
+        for stage, histogram in self.histograms.items():
+            if histogram.count:
+                p50, p95, p99 = histogram.percentiles(50, 95, 99)
+                stages[stage] = {"count": histogram.count, "p50": p50, "p95": p95, "p99": p99}
+        with self._lock:
+            counters = dict(self.counters)
+        return {"stages": stages, "counters": counters}
+
+    def prometheus_text(self):
+        """以Prometheus文本格式导出指标"""
+        lines = [
+            "# HELP cuteng_stage_latency_ms Latency of translate pipeline stages in milliseconds",
+            "# TYPE cuteng_stage_latency_ms summary"
+        ]
+        for stage, histogram in self.histograms.items():
+            if not histogram.count:
+                continue
+            for p, value in zip((0.5, 0.95, 0.99), histogram.percentiles(50, 95, 99)):
+                lines.append(f'cuteng_stage_latency_ms{{stage="{stage}",quantile="{p}"}} {value:.3f}')
+            lines.append(f'cuteng_stage_latency_ms_sum{{stage="{stage}"}} {histogram.sum:.3f}')
+            lines.append(f'cuteng_stage_latency_ms_count{{stage="{stage}"}} {histogram.count}')
+        with self._lock:
+            counters = sorted(self.counters.items())
+        for name, value in counters:
+            lines.append(f"# TYPE cuteng_{name} counter")
+            lines.append(f"cuteng_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write_record(self, record):
+        """向JSONL导出文件追加一条记录（未配置导出文件时忽略），由后台线程写入"""
+        if not self.export_file:
+            return
+        self._writer.put(self.export_file, json.dumps(record, ensure_ascii=False))
+
+    def close(self):
+        """写出尚未写入文件的记录"""
+        self._writer.close()
+
+
+registry = MetricsRegistry()
+atexit.register(registry.close)
+
+
+class Trace:
+    """
+    一次翻译的计时记录
+
+    各阶段耗时同时计入全局直方图；finish()时写出一条JSONL记录。
+    """
+
+    def __init__(self, source="hotkey"):
+        self.id = uuid.uuid4().hex[:12]
+        self.source = source
+        self.started = time.perf_counter()
+        self.timestamp = time.time()
+        self.spans = {}
+        self.tokens = {}
+        self.attributes = {}
+        self.finished = False
+
+    def add(self, stage, ms):
+        self.spans[stage] = round(ms, 3)
+        registry.observe(stage, ms)
+
+    def since_start(self, stage):
+        """记录从本次翻译开始到现在的耗时"""
+        self.add(stage, (time.perf_counter() - self.started) * 1000)
+
+    @contextmanager
+    def span(self, stage):
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.add(stage, (time.perf_counter() - start) * 1000)
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def add_usage(self, usage):
+        """累加API返回的usage字段中的token数"""
+        for key in ("prompt_tokens", "completion_tokens", "total_tokens"):
+            value = usage.get(key)
+            if isinstance(value, int):
+                self.tokens[key] = self.tokens.get(key, 0) + value
+                registry.incr(key, value)
+
+    def finish(self, status="ok"):
+        if self.finished:
+            return
+        self.finished = True
+        self.since_start("total")
+        registry.incr("lookups_total")
+        registry.incr(f"lookups_{status}")
+        registry.write_record({
+            "id": self.id,
+            "ts": round(self.timestamp, 3),
+            "source": self.source,
+            "status": status,
+            "spans_ms": self.spans,
+            "tokens": self.tokens,
+            **self.attributes
+        })
+
+
+def current_trace():
+    """返回当前上下文中的Trace，没有则返回None"""
+    return _current_trace.get()
+
+
+def use_trace(trace):
+    """把trace设为当前上下文（线程或asyncio任务）的Trace"""
+    _current_trace.set(trace)
+
+
+def record(stage, ms):
+    """记录当前Trace的某个阶段耗时，没有Trace时只计入全局直方图"""
+    trace = current_trace()
+    if trace is not None:
+        trace.add(stage, ms)
+    else:
+        registry.observe(stage, ms)
+
+
+def record_usage(usage):
+    trace = current_trace()
+    if trace is not None:
+        trace.add_usage(usage)
+    else:
+        for key in ("prompt_tokens", "completion_tokens", "total_tokens"):
+            if isinstance(usage.get(key), int):
+                registry.incr(key, usage[key])
+
+
+def record_startup(**phases):
+    """
+    记录启动各阶段的耗时（毫秒）
+
+    import_ms: 导入模块；tray_ms: 托盘图标显示；interactive_ms: 热键可用；
+    backend_ms: 后台导入HTTP模块并创建调度器。全部记录后写出一条JSONL记录。
+    """
+    registry.startup.update({name: round(ms, 1) for name, ms in phases.items()})
+    logging.info("启动耗时: " + ", ".join(f"{name} {ms:.0f}ms" for name, ms in phases.items()))
+    if "backend_ms" in registry.startup and "interactive_ms" in registry.startup:
+        registry.write_record({"source": "startup", "ts": round(time.time(), 3), **registry.startup})
+
+def format_summary():
+    """生成供托盘“统计”窗口显示的文本"""
+    summary = registry.summary()
+    lines = ["各阶段耗时 (毫秒)    次数    p50    p95    p99"]
+    for stage in STAGES:
+        data = summary["stages"].get(stage)
+        if data:
+            lines.append(f"{stage:<16}{data['count']:>8}{data['p50']:>8.0f}{data['p95']:>8.0f}{data['p99']:>8.0f}")
+    counters = summary["counters"]
+    lines.append("")
+    lines.append(f"翻译次数: {counters.get('lookups_total', 0)}")
+    lines.append(f"Token: 输入 {counters.get('prompt_tokens', 0)}，输出 {counters.get('completion_tokens', 0)}")
+    startup = registry.startup
+    if "interactive_ms" in startup:
+        lines.append(f"启动: 导入 {startup.get('import_ms', 0):.0f}ms，热键可用 {startup['interactive_ms']:.0f}ms")
+    return "\n".join(lines)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = registry.prometheus_text().encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port):
+    """在127.0.0.1:port上提供Prometheus格式的/metrics接口"""
+    try:
+        server = ThreadingHTTPServer(("127.0.0.1", port), _MetricsHandler)
+    except OSError as e:
+        logging.error(f"启动指标服务失败: {str(e)}")
+        return None
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    logging.info(f"指标服务已启动: http://127.0.0.1:{port}/metrics")
+    return server
+
+
+def configure(config):
+    """根据配置启用JSONL导出和本地指标接口"""
+    registry.export_file = config["metrics_export_file"] or None
+    if config["metrics_port"]:
+        return start_metrics_server(config["metrics_port"])
+    return None
@@ -0,0 +1,176 @@
+import sys
+import time
+import logging
+import threading
+from collections import deque
+
+from utils.config import get_config
+from utils.cache import get_cache, normalize_text
+from utils.llm import cache_key_for, select_local_backend, translate_text_async
+from utils.langdetect import detect
+from utils.selection import clipboard_change, _read_primary_selection
+from utils import metrics
+from utils.logger import snippet
+
+
+class PrefetchWatcher:
+    """
+    预翻译：在后台监视剪贴板和PRIMARY选区，提前把新出现的文本翻译进缓存
+
+    内容稳定debounce秒后才会预翻译，每分钟最多max_per_minute次；
+    热键翻译进行中（is_busy返回True）时让路，不与用户的请求争抢连接。
+    之后按热键翻译同一段文本时直接命中缓存，或等待进行中的预翻译完成。
+
+    notified中的来源（"clipboard"、"primary"）由界面线程在收到变化通知时调用changed()，
+    只在变化后读取一次；PRIMARY选区需要通过子进程读取，没有变化通知时不监视。
+    获取选中文本时复制又恢复剪贴板造成的变化会被忽略。
+    """
+
+    def __init__(self, is_busy=None, poll_interval=0.4, debounce=0.5, max_per_minute=6,
+                 max_chars=2000, use_primary=True, notified=()):
+        self.is_busy = is_busy or (lambda: False)
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        self.max_per_minute = max_per_minute
+        self.max_chars = max_chars
+        self.use_primary = use_primary and sys.platform.startswith("linux") and "primary" in notified
+        self._lock = threading.Lock()
+        # 有变化通知的来源 -> 是否有待读取的变化（第一次读取的内容作为基准）
+        self._dirty = {source: True for source in notified}
+        self._stop = threading.Event()
+        self._thread = None
+        self._inflight = {}
+        self._submitted = deque()
+        self._last_sequence = None
+        self._last_seen = {}
+        self._candidate = None
+        self._changed_at = 0.0
+        self._last_prefetched = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="prefetch", daemon=True)
+        self._thread.start()
+        logging.info("预翻译已启用")
+
+    def stop(self):
+        self._stop.set()
+
+    def changed(self, source):
+        """剪贴板（"clipboard"）或PRIMARY选区（"primary"）发生了变化，由界面线程调用"""
+        with self._lock:
+            self._dirty[source] = True
+
+    def _should_read(self, source):
+        """没有变化通知的来源每次都读取，有通知的来源只在变化后读取"""
+        with self._lock:
+            if source not in self._dirty:
+                return True
+            dirty = self._dirty[source]
+            self._dirty[source] = False
+            return dirty
+
+    def pending(self, text):
+        """返回该文本进行中的预翻译（concurrent.futures.Future），没有则返回None"""
+        with self._lock:
+            return self._inflight.get(normalize_text(text))
+
+    def _read_sources(self):
+        """返回{来源: 文本}，只读取可能发生了变化的来源"""
+        sources = {}
+        if self._should_read("clipboard"):
+            # Windows下序列号没有变化时不读取剪贴板内容
+            change = clipboard_change(self._last_sequence)
+            if change is not None:
+                self._last_sequence, text, own = change
+                if own:
+                    # 获取选中文本后恢复的剪贴板内容不是新内容，只更新基准
+                    self._last_seen["clipboard"] = text
+                else:
+                    sources["clipboard"] = text
+        if self.use_primary and self._should_read("primary"):
+            primary = _read_primary_selection()
+            if primary is not None:
+                sources["primary"] = primary
+        return sources
+
+    def _run(self):
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self._poll()
+            except Exception as e:
+                logging.warning(f"预翻译监视出错: {str(e)}")
+
+    def _poll(self):
+        now = time.monotonic()
+        for source, text in self._read_sources().items():
+            if text != self._last_seen.get(source):
+                # 首次读取的内容是启动前就存在的，不预翻译
+                if source in self._last_seen:
+                    self._candidate = text
+                    self._changed_at = now
+                self._last_seen[source] = text
+        if self._candidate is None or now - self._changed_at < self.debounce:
+            return
+        text = self._candidate
+        if self.is_busy():
+            # 热键翻译进行中，稍后再试
+            return
+        self._candidate = None
+        self._prefetch(text, now)
+
+    def _within_budget(self, now):
+        while self._submitted and now - self._submitted[0] > 60:
+            self._submitted.popleft()
+        return len(self._submitted) < self.max_per_minute
+
+    def _prefetch(self, text, now):
+        key = normalize_text(text)
+        if not key or len(key) > self.max_chars or key == self._last_prefetched:
+            return
+        config = get_config()
+        # 数字、网址、代码等不需要翻译，也不占用预翻译次数
+        if config["skip_untranslatable"] and detect(text).skip is not None:
+            return
+        backend = select_local_backend(text, config)
+        if backend is None and not config["api_key"]:
+            return
+        if config["cache_enabled"]:
+            if get_cache(config).get(cache_key_for(text, config, backend)) is not None:
+                return
+        if not self._within_budget(now):
+            logging.info("预翻译次数已达每分钟上限，跳过")
+            return
+        self._submitted.append(now)
+        self._last_prefetched = key
+        logging.info(f"预翻译: {snippet(key)}")
+        trace = metrics.Trace("prefetch")
+        future = translate_text_async(text, trace=trace)
+        with self._lock:
+            self._inflight[key] = future
+
+        def done(f):
+            with self._lock:
+                if self._inflight.get(key) is f:
+                    del self._inflight[key]
+            trace.finish("cancelled" if f.cancelled() else "ok")
+
+        future.add_done_callback(done)
+
+
+def create_watcher(config, is_busy=None, notified=()):
+    """
+    根据配置创建预翻译监视器（未启动），未启用时返回None
+
+    notified为界面线程会通过changed()通知变化的来源
+    """
+    if not config["prefetch_enabled"]:
+        return None
+    return PrefetchWatcher(
+        is_busy=is_busy,
+        poll_interval=config["prefetch_poll_interval_ms"] / 1000,
+        debounce=config["prefetch_debounce_ms"] / 1000,
+        max_per_minute=config["prefetch_max_per_minute"],
+        max_chars=config["prefetch_max_chars"],
+        use_primary=config["prefetch_primary_selection"],
+        notified=notified
+    )
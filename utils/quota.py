@@ -0,0 +1,452 @@
+"""
+客户端限流与每日花费预算
+
+多台电脑共用一个API密钥时，在客户端按每分钟请求数（rpm）和每分钟token数（tpm）限流：
+发送前按估算的token数预留额度，收到响应中的usage后再按实际用量修正。
+等待额度时热键翻译优先，其次是预翻译，批量翻译最后。
+
+每日花费按配置的单价计算并保存在本地文件中。超过软上限后只允许热键翻译，
+超过硬上限后拒绝所有请求，直到第二天。
+"""
+import os
+import json
+import time
+import atexit
+import heapq
+import asyncio
+import logging
+import tempfile
+import itertools
+import threading
+import contextvars
+from contextlib import nullcontext
+
+from utils.segmenter import estimate_tokens
+from utils import metrics
+
+# 每日花费记录文件
+SPEND_FILE = "daily_spend.json"
+
+# 请求优先级，数值越小越优先
+INTERACTIVE = 0
+BACKGROUND = 1
+BATCH = 2
+
+# Trace来源对应的优先级，没有Trace的请求（批量翻译等）按BATCH处理
+_SOURCE_PRIORITY = {"hotkey": INTERACTIVE, "prefetch": BACKGROUND}
+
+# 花费记录写入文件的间隔（秒）
+_FLUSH_INTERVAL = 5.0
+
+# 等待额度时重新检查的最长间隔（秒）
+_POLL_INTERVAL = 0.05
+
+_current_reservation = contextvars.ContextVar("cuteng_reservation", default=None)
+
+
+class QuotaExceeded(Exception):
+    """等待限流额度超时，或今日花费已超过上限"""
+
+
+def current_priority():
+    """根据当前Trace的来源判断请求的优先级"""
+    trace = metrics.current_trace()
+    if trace is None:
+        return BATCH
+    return _SOURCE_PRIORITY.get(trace.source, BACKGROUND)
+
+
+def estimate_request(messages):
+    """估算一次请求的总token数：输入的所有消息，加上与待翻译内容相当的输出"""
+    prompt = sum(estimate_tokens(message["content"]) + 4 for message in messages)
+    completion = estimate_tokens(messages[-1]["content"]) if messages else 0
+    return prompt + completion
+
+
+class TokenBucket:
+    """每分钟补满的令牌桶，容量为一分钟的额度"""
+
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        """额度不足时还需等待的秒数；超过容量的请求按容量计算，避免永远等待"""
+        amount = min(amount, self.capacity)
+        return max(0.0, (amount - self.level) / self.rate)
+
+
+class RateLimiter:
+    """
+    按rpm和tpm限流，等待者按优先级排队
+
+    只有排在最前面的等待者会扣除额度，优先级更高的请求到达后立即排到前面。
+    """
+
+    def __init__(self, rpm=0, tpm=0):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.requests = TokenBucket(rpm) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm) if tpm > 0 else None
+        self._lock = threading.Lock()
+        self._waiters = []
+        self._sequence = itertools.count()
+
+    def _enter(self, priority):
+        ticket = (priority, next(self._sequence))
+        with self._lock:
+            heapq.heappush(self._waiters, ticket)
+        return ticket
+
+    def _leave(self, ticket):
+        with self._lock:
+            if ticket in self._waiters:
+                self._waiters.remove(ticket)
+                heapq.heapify(self._waiters)
+
+    def _poll(self, ticket, tokens):
+        """轮到ticket且额度足够时扣除额度并返回0，否则返回建议等待的秒数"""
+        with self._lock:
+            if self._waiters[0] != ticket:
+                return _POLL_INTERVAL
+            now = time.monotonic()
+            delay = 0.0
+            for bucket, amount in ((self.requests, 1), (self.tokens, tokens)):
+                if bucket is not None:
+                    bucket.refill(now)
+                    delay = max(delay, bucket.wait_time(amount))
+            if delay > 0:
+                return delay
+            if self.requests is not None:
+                self.requests.level -= 1
+            if self.tokens is not None:
+                self.tokens.level -= tokens
+            heapq.heappop(self._waiters)
+            return 0.0
+
+    def _check_deadline(self, deadline, delay):
+        if deadline is not None and time.monotonic() + min(delay, _POLL_INTERVAL) > deadline:
+            raise QuotaExceeded("等待限流额度超时，请稍后再试")
+
+    def acquire(self, tokens, priority=INTERACTIVE, timeout=None):
+        """阻塞直到获得一次请求和tokens个token的额度，超时抛出QuotaExceeded"""
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        ticket = self._enter(priority)
+        acquired = False
+        try:
+            while True:
+                delay = self._poll(ticket, tokens)
+                if delay == 0:
+                    acquired = True
+                    return
+                self._check_deadline(deadline, delay)
+                time.sleep(min(delay, 0.25))
+        finally:
+            if not acquired:
+                self._leave(ticket)
+
+    async def acquire_async(self, tokens, priority=INTERACTIVE, timeout=None):
+        """acquire的异步版本，等待期间不阻塞事件循环"""
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        ticket = self._enter(priority)
+        acquired = False
+        try:
+            while True:
+                delay = self._poll(ticket, tokens)
+                if delay == 0:
+                    acquired = True
+                    return
+                self._check_deadline(deadline, delay)
+                await asyncio.sleep(min(delay, 0.25))
+        finally:
+            if not acquired:
+                self._leave(ticket)
+
+    def adjust(self, estimated, actual):
+        """按实际用量修正预留的token额度（实际用量更多时额度可以为负）"""
+        if self.tokens is None:
+            return
+        with self._lock:
+            self.tokens.level = min(self.tokens.capacity, self.tokens.level + estimated - actual)
+
+
+class DailySpend:
+    """
+    当天的token用量和花费，跨天自动清零
+
+    add()只更新内存中的数值，由后台定时器每隔flush_interval秒把新增的用量与文件中的最新数值
+    合并后写回（批量翻译等其他进程的花费也会计入），退出时再写入一次，不在请求路径上读写文件。
+    """
+
+    def __init__(self, path=SPEND_FILE, flush_interval=_FLUSH_INTERVAL):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        # 同一时间只有一个线程合并和写入文件
+        self._flush_lock = threading.Lock()
+        self.date = time.strftime("%Y-%m-%d")
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost = 0.0
+        # 尚未写入文件的增量: [prompt_tokens, completion_tokens, cost]
+        self._pending = [0, 0, 0.0]
+        self._timer = None
+        stored = self._read(self.date)
+        if stored is not None:
+            self.prompt_tokens, self.completion_tokens, self.cost = stored
+        atexit.register(self.flush)
+
+    def _read(self, date):
+        """读取文件中date当天的用量，返回(prompt_tokens, completion_tokens, cost)，读取失败时返回None"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return 0, 0, 0.0
+        except (OSError, ValueError) as e:
+            logging.error(f"读取花费记录失败: {str(e)}")
+            return None
+        if data.get("date") != date:
+            return 0, 0, 0.0
+        return int(data.get("prompt_tokens", 0)), int(data.get("completion_tokens", 0)), float(data.get("cost", 0.0))
+
+    def _save(self, data):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        try:
+            fd, tmp_path = tempfile.mkstemp(prefix=".spend-", suffix=".tmp", dir=directory)
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logging.error(f"保存花费记录失败: {str(e)}")
+
+    def _roll(self):
+        today = time.strftime("%Y-%m-%d")
+        if today != self.date:
+            self.date = today
+            self.prompt_tokens = 0
+            self.completion_tokens = 0
+            self.cost = 0.0
+            self._pending = [0, 0, 0.0]
+
+    def add(self, prompt_tokens, completion_tokens, cost):
+        with self._lock:
+            self._roll()
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            self.cost += cost
+            self._pending[0] += prompt_tokens
+            self._pending[1] += completion_tokens
+            self._pending[2] += cost
+            if self._timer is None:
+                self._timer = threading.Timer(self.flush_interval, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        """把尚未写入的用量与文件中的最新数值合并后写回"""
+        with self._flush_lock:
+            with self._lock:
+                self._timer = None
+                if not any(self._pending):
+                    return
+                date = self.date
+                pending, self._pending = self._pending, [0, 0, 0.0]
+                # 读取文件失败时直接写入内存中的数值
+                written = (self.prompt_tokens, self.completion_tokens, self.cost)
+            stored = self._read(date)
+            with self._lock:
+                if stored is not None:
+                    written = (stored[0] + pending[0], stored[1] + pending[1], stored[2] + pending[2])
+                    if self.date == date:
+                        # 内存中的数值 = 文件中的数值 + 本次写入的增量 + 读取文件期间新增的增量
+                        self.prompt_tokens = written[0] + self._pending[0]
+                        self.completion_tokens = written[1] + self._pending[1]
+                        self.cost = written[2] + self._pending[2]
+            self._save({"date": date, "prompt_tokens": written[0], "completion_tokens": written[1],
+                        "cost": round(written[2], 6)})
+
+    def close(self):
+        """取消等待中的定时写入并立即写入（例如记录文件所在的目录即将被删除）"""
+        with self._lock:
+            timer, self._timer = self._timer, None
+        if timer is not None:
+            timer.cancel()
+        self.flush()
+
+    def _as_dict(self):
+        return {"date": self.date, "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens, "cost": round(self.cost, 6)}
+
+    def snapshot(self):
+        """返回当天的用量，例如{"date": ..., "prompt_tokens": ..., "completion_tokens": ..., "cost": ...}"""
+        with self._lock:
+            self._roll()
+            return self._as_dict()
+
+
+class Reservation:
+    """
+    一次请求预留的额度
+
+    作为上下文管理器使用：期间收到的usage通过record_usage()修正限流额度并计入花费；
+    请求成功但没有返回usage时，按估算的token数计入花费。
+    """
+
+    def __init__(self, limiter, estimated, config):
+        self.limiter = limiter
+        self.estimated = estimated
+        self.price_prompt = config["price_prompt_per_1k"] / 1000
+        self.price_completion = config["price_completion_per_1k"] / 1000
+        self.reported = False
+        self._token = None
+
+    def add_usage(self, usage):
+        prompt = usage.get("prompt_tokens") or 0
+        completion = usage.get("completion_tokens") or 0
+        actual = usage.get("total_tokens") or prompt + completion
+        if self.limiter is not None:
+            # 对冲请求可能各自返回usage，只有第一次抵扣预留的额度
+            self.limiter.adjust(0 if self.reported else self.estimated, actual)
+        self.reported = True
+        _charge(prompt, completion, prompt * self.price_prompt + completion * self.price_completion)
+
+    def __enter__(self):
+        self._token = _current_reservation.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_reservation.reset(self._token)
+        if exc_type is None and not self.reported:
+            half = self.estimated // 2
+            _charge(0, 0, half * self.price_prompt + (self.estimated - half) * self.price_completion)
+        return False
+
+
+_limiters = {}
+_spend = None
+_state_lock = threading.Lock()
+_budget_listener = None
+_notified = set()
+
+
+def get_spend():
+    """获取全局的每日花费记录"""
+    global _spend
+    if _spend is None:
+        with _state_lock:
+            if _spend is None:
+                _spend = DailySpend(SPEND_FILE)
+    return _spend
+
+
+def set_budget_listener(callback):
+    """设置花费超过软上限或硬上限时的回调（每天各通知一次），callback接收提示文本"""
+    global _budget_listener
+    _budget_listener = callback
+
+
+def _notify(level, message):
+    key = (time.strftime("%Y-%m-%d"), level)
+    if key in _notified:
+        return
+    _notified.add(key)
+    logging.warning(message)
+    if _budget_listener is not None:
+        try:
+            _budget_listener(message)
+        except Exception as e:
+            logging.error(f"花费提醒回调出错: {str(e)}")
+
+
+def _charge(prompt_tokens, completion_tokens, cost):
+    get_spend().add(prompt_tokens, completion_tokens, cost)
+
+
+def _get_limiter(config):
+    """同一API密钥共用一个限流器，未设置rpm和tpm时返回None"""
+    rpm, tpm = config["rate_limit_rpm"], config["rate_limit_tpm"]
+    if rpm <= 0 and tpm <= 0:
+        return None
+    key = config["api_key"]
+    with _state_lock:
+        limiter = _limiters.get(key)
+        if limiter is None or (limiter.rpm, limiter.tpm) != (rpm, tpm):
+            limiter = RateLimiter(rpm, tpm)
+            _limiters[key] = limiter
+    return limiter
+
+
+def check_budget(config, priority):
+    """检查今日花费，超过硬上限，或超过软上限且不是热键翻译时抛出QuotaExceeded"""
+    soft, hard = config["daily_budget_soft"], config["daily_budget_hard"]
+    if soft <= 0 and hard <= 0:
+        return
+    spent = get_spend().snapshot()["cost"]
+    if hard > 0 and spent >= hard:
+        _notify("hard", f"今日API花费 ${spent:.2f} 已达上限 ${hard:.2f}，暂停翻译")
+        raise QuotaExceeded(f"今日API花费已达上限 ${hard:.2f}")
+    if soft > 0 and spent >= soft:
+        _notify("soft", f"今日API花费 ${spent:.2f} 已超过 ${soft:.2f}，暂停预翻译和批量翻译")
+        if priority != INTERACTIVE:
+            raise QuotaExceeded(f"今日API花费已超过 ${soft:.2f}，只允许热键翻译")
+
+
+def _prepare(messages, config):
+    priority = current_priority()
+    check_budget(config, priority)
+    limiter = _get_limiter(config)
+    return Reservation(limiter, estimate_request(messages), config), priority
+
+
+def reserve(messages, config):
+    """
+    发送请求前调用：检查花费上限，按估算的token数等待限流额度
+
+    Returns:
+        Reservation，请求过程应在with语句中进行；quota_enabled为False时不做任何限制
+
+    Raises:
+        QuotaExceeded: 超过花费上限或等待额度超时
+    """
+    if not config["quota_enabled"]:
+        return nullcontext()
+    reservation, priority = _prepare(messages, config)
+    if reservation.limiter is not None:
+        reservation.limiter.acquire(reservation.estimated, priority, config["rate_limit_max_wait_seconds"])
+    return reservation
+
+
+async def reserve_async(messages, config):
+    """reserve的异步版本"""
+    if not config["quota_enabled"]:
+        return nullcontext()
+    reservation, priority = _prepare(messages, config)
+    if reservation.limiter is not None:
+        await reservation.limiter.acquire_async(reservation.estimated, priority,
+                                                config["rate_limit_max_wait_seconds"])
+    return reservation
+
+
+def record_usage(usage):
+    """把响应中的usage计入当前请求的Reservation"""
+    reservation = _current_reservation.get()
+    if reservation is not None:
+        reservation.add_usage(usage)
+
+
+def format_spend(config):
+    """生成托盘菜单中显示的今日花费文本"""
+    spend = get_spend().snapshot()
+    text = f"今日花费: ${spend['cost']:.2f}"
+    limit = config["daily_budget_hard"] or config["daily_budget_soft"]
+    if limit > 0:
+        text += f" / ${limit:.2f}"
+    tokens = spend["prompt_tokens"] + spend["completion_tokens"]
+    return f"{text}（{tokens} tokens）"
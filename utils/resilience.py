@@ -0,0 +1,155 @@
+import time
+import random
+import threading
+from collections import deque
+from email.utils import parsedate_to_datetime
+
+# 可重试的HTTP状态码
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+class AllEndpointsUnavailable(Exception):
+    """所有API端点都处于熔断状态"""
+
+
+def get_endpoints(config):
+    """
+    返回按优先级排列的API端点配置列表
+
+    配置项endpoints中的每一项可覆盖api_base_url、api_key和model，
+    未填写的字段沿用顶层配置；endpoints为空时只使用顶层配置。
+    第一个之后的端点带有"fallback": True，由它们完成的翻译不以主端点的缓存键保存。
+    """
+    endpoints = [dict(config, **endpoint) for endpoint in config["endpoints"] if isinstance(endpoint, dict)]
+    for index, endpoint in enumerate(endpoints):
+        endpoint["fallback"] = index > 0
+    return endpoints or [config]
+
+
+def parse_retry_after(value):
+    """解析Retry-After响应头（秒数或HTTP日期），无法解析时返回None"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt, base_delay, max_delay, retry_after=None):
+    """
+    计算第attempt次重试前的等待时间（秒）
+
+    使用带完全抖动的指数退避；服务端给出Retry-After时以其为下限。
+    """
+    delay = random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, max_delay))
+    return delay
+
+
+class CircuitBreaker:
+    """
+    单个端点的熔断器
+
+    连续失败达到阈值后熔断，熔断期间直接跳过该端点；
+    超过reset_timeout后放行一次试探请求，成功则恢复，失败则继续熔断。
+    试探请求被取消时应调用release_probe()；未释放的试探超过reset_timeout后也会失效，
+    不会让端点一直被跳过。
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+        self._probe_started = None
+
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            now = time.monotonic()
+            if now - self._opened_at < self.reset_timeout:
+                return False
+            if self._probing and now - self._probe_started < self.reset_timeout:
+                return False
+            self._probing = True
+            self._probe_started = now
+            return True
+
+    def release_probe(self):
+        """试探请求被取消、没有结果时释放试探名额，下一次请求可以重新试探"""
+        with self._lock:
+            self._probing = False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._probing = False
+
+    @property
+    def is_open(self):
+        return self._opened_at is not None
+
+
+class LatencyTracker:
+    """记录最近若干次请求的耗时，用于计算对冲请求的触发时机"""
+
+    def __init__(self, size=200):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def __len__(self):
+        return len(self._samples)
+
+    def percentile(self, p):
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        index = min(len(samples) - 1, int(round(p / 100 * (len(samples) - 1))))
+        return samples[index]
+
+
+_breakers = {}
+_trackers = {}
+_registry_lock = threading.Lock()
+
+
+def get_breaker(endpoint):
+    key = (endpoint["api_base_url"].rstrip('/'), endpoint["model"])
+    with _registry_lock:
+        breaker = _breakers.get(key)
+        if breaker is None:
+            breaker = CircuitBreaker(endpoint["circuit_failure_threshold"], endpoint["circuit_reset_seconds"])
+            _breakers[key] = breaker
+    return breaker
+
+
+def get_latency_tracker(endpoint, stream):
+    key = (endpoint["api_base_url"].rstrip('/'), endpoint["model"], bool(stream))
+    with _registry_lock:
+        tracker = _trackers.get(key)
+        if tracker is None:
+            tracker = LatencyTracker()
+            _trackers[key] = tracker
+    return tracker
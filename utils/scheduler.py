@@ -0,0 +1,189 @@
+import time
+import asyncio
+import logging
+import threading
+from concurrent.futures import CancelledError
+
+from utils.cache import normalize_text
+from utils.config import get_config
+from utils.llm import TranslationCancelled, get_async_client
+from utils.batch import translate_segments_async
+from utils import metrics
+
+
+class TranslationScheduler:
+    """
+    热键翻译调度器
+
+    - 所有翻译在异步客户端的事件循环上执行，用信号量限制同时进行的API请求数
+    - 相同文本的并发请求共享同一个任务
+    - 每次提交生成新的代号，只有最新一次请求的结果（包括流式增量）会送达界面，
+      被取代的请求（无论是否已开始）都会被取消
+
+    on_result(result, trace)在翻译完成时被调用，由调用方在显示结果后结束trace。
+    提供prefetcher时，相同文本的预翻译仍在进行中则等待它完成，而不是再发一次请求。
+    提供history时，送达界面的翻译结果会记录到翻译历史中。
+    """
+
+    def __init__(self, on_result, on_delta=None, max_concurrent=2, deadline=None, client=None,
+                 prefetcher=None, history=None):
+        self._client = client or get_async_client()
+        self._prefetcher = prefetcher
+        self._history = history
+        self._on_result = on_result
+        self._on_delta = on_delta
+        self._max_concurrent = max_concurrent
+        self._deadline = deadline
+        # 信号量需要在事件循环线程中创建
+        self._semaphore = None
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._inflight = {}
+        # 每个文本最近一次被请求时的代号
+        self._latest = {}
+        # 进行中任务已收到的增量内容，供后加入的相同请求补发
+        self._partials = {}
+
+    def submit(self, text, trace=None):
+        """提交翻译请求，返回本次请求的代号"""
+        key = normalize_text(text)
+        with self._lock:
+            self._generation += 1
+            generation = self._generation
+
+            # 取消其他文本的旧请求
+            for other_key, other_future in list(self._inflight.items()):
+                if other_key != key:
+                    other_future.cancel()
+                    self._forget(other_key)
+
+            future = self._inflight.get(key)
+            if future is None:
+                partial = []
+                self._partials[key] = partial
+                future = self._client.submit(self._run(key, text, partial, trace))
+                self._inflight[key] = future
+            else:
+                logging.info("相同文本正在翻译，复用进行中的请求")
+                if trace is not None:
+                    trace.set(shared=True)
+                replay = "".join(self._partials.get(key, []))
+                if replay and self._on_delta is not None:
+                    self._on_delta(replay)
+            self._latest[key] = generation
+
+        future.add_done_callback(lambda f: self._deliver(f, generation, trace, text))
+        return generation
+
+    def translate(self, text, on_delta=None, trace=None):
+        """
+        在同一个并发上限下翻译一段文本，返回concurrent.futures.Future
+
+        供本地翻译服务（utils.daemon）使用：不参与代号和取消逻辑，结果不送达界面，
+        各调用方的请求互不取代。
+        """
+        return self._client.submit(self._run_limited(text, on_delta, trace))
+
+    async def _run_limited(self, text, on_delta, trace):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._max_concurrent)
+        async with self._semaphore:
+            return await self._client.translate(text, on_delta=on_delta, deadline=self._deadline, trace=trace)
+
+    def translate_batch(self, texts, trace=None):
+        """
+        把一组短文本打包成一次请求翻译，返回concurrent.futures.Future
+
+        结果为与texts一一对应的(译文, 错误信息)列表；与translate()共用同一个并发上限。
+        """
+        return self._client.submit(self._run_batch_limited(texts, trace))
+
+    async def _run_batch_limited(self, texts, trace):
+        if trace is not None:
+            metrics.use_trace(trace)
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._max_concurrent)
+        async with self._semaphore:
+            return await translate_segments_async(texts, get_config(), self._client)
+
+    def cancel_all(self):
+        """取消所有进行中的翻译（例如用户关闭了翻译窗口）"""
+        with self._lock:
+            self._generation += 1
+            for key, future in list(self._inflight.items()):
+                future.cancel()
+                self._forget(key)
+
+    def is_current(self, generation):
+        return generation == self._generation
+
+    def is_busy(self):
+        """是否有进行中的翻译"""
+        with self._lock:
+            return bool(self._inflight)
+
+    def _forget(self, key):
+        self._inflight.pop(key, None)
+        self._latest.pop(key, None)
+        self._partials.pop(key, None)
+
+    async def _run(self, key, text, partial, trace):
+        def on_delta(delta):
+            with self._lock:
+                if self._latest.get(key) != self._generation:
+                    raise TranslationCancelled()
+                partial.append(delta)
+            if self._on_delta is not None:
+                self._on_delta(delta)
+
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._max_concurrent)
+        try:
+            pending = self._prefetcher.pending(text) if self._prefetcher is not None else None
+            if pending is not None:
+                logging.info("等待进行中的预翻译")
+                # 本任务被取消时不影响预翻译本身，其结果仍会写入缓存
+                await asyncio.shield(asyncio.wrap_future(pending))
+            async with self._semaphore:
+                return await self._client.translate(text, on_delta=on_delta, deadline=self._deadline, trace=trace)
+        finally:
+            with self._lock:
+                # 只清理属于本任务的记录，同一文本可能已有新的任务
+                if self._partials.get(key) is partial:
+                    self._forget(key)
+
+    def _record(self, text, result, trace):
+        """记录到翻译历史，出错或无需翻译的文本不记录"""
+        model = ""
+        latency_ms = None
+        if trace is not None:
+            if "error" in trace.attributes or "skipped" in trace.attributes:
+                return
+            model = "dictionary" if trace.attributes.get("dictionary_hit") else trace.attributes.get("model", "")
+            latency_ms = round((time.perf_counter() - trace.started) * 1000, 1)
+        self._history.add(text, result, model, latency_ms)
+
+    def _deliver(self, future, generation, trace, text):
+        if future.cancelled():
+            if trace is not None:
+                trace.finish("cancelled")
+            return
+        if not self.is_current(generation):
+            logging.info(f"丢弃过期的翻译结果 (代号 {generation})")
+            if trace is not None:
+                trace.finish("superseded")
+            return
+        try:
+            result = future.result()
+        except (TranslationCancelled, CancelledError):
+            if trace is not None:
+                trace.finish("cancelled")
+            return
+        except Exception as e:
+            logging.error(f"翻译线程中发生错误: {str(e)}")
+            self._on_result(f"翻译过程中发生错误: {str(e)}", trace)
+            return
+        logging.info("翻译完成")
+        self._on_result(result, trace)
+        if self._history is not None:
+            self._record(text, result, trace)
@@ -0,0 +1,148 @@
+"""
+长文本分段
+
+按段落和句子边界把长文本切分为不超过token预算的若干段，分段并发翻译后再按顺序拼接。
+每段附带前一段末尾的几个句子作为上下文，使译文前后连贯。
+"""
+import re
+
+# 句末标点（中英文），后面可能跟着引号或括号
+_SENTENCE_END = re.compile(r'(?<=[.!?;。！？；…])["\'”’)）\]]*\s+|(?<=[。！？；…])(?![。！？；…])["\'”’)）\]]*')
+_PARAGRAPH_SPLIT = re.compile(r'(\n\s*)')
+
+
+def _is_cjk(char):
+    return ('\u4e00' <= char <= '\u9fff' or '\u3000' <= char <= '\u30ff'
+            or '\uff00' <= char <= '\uffef')
+
+
+def estimate_tokens(text):
+    """粗略估算token数：中日文字符按1个token计，其余按4个字符1个token计"""
+    cjk = sum(1 for char in text if _is_cjk(char))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+class Segment:
+    """一段待翻译的文本：separator为它与前一段之间的原始空白，context为前文"""
+
+    def __init__(self, text, separator="", context=""):
+        self.text = text
+        self.separator = separator
+        self.context = context
+
+
+def _split_sentences(paragraph):
+    """返回(句子, 与下一句之间是否有空白)列表"""
+    sentences = []
+    start = 0
+    for match in _SENTENCE_END.finditer(paragraph):
+        end = match.end()
+        if end > start:
+            raw = paragraph[start:end]
+            sentences.append((raw.strip(), raw[-1:].isspace()))
+            start = end
+    if start < len(paragraph):
+        sentences.append((paragraph[start:].strip(), False))
+    return [(sentence, spaced) for sentence, spaced in sentences if sentence]
+
+
+def _split_oversized(sentence, max_tokens):
+    """超过预算的单个句子按词（英文）或字符（中文）硬切分"""
+    words = sentence.split(" ")
+    joiner = " "
+    if len(words) == 1:
+        words = list(sentence)
+        joiner = ""
+    pieces = []
+    current = []
+    for word in words:
+        if current and estimate_tokens(joiner.join(current + [word])) > max_tokens:
+            pieces.append(joiner.join(current))
+            current = []
+        current.append(word)
+    if current:
+        pieces.append(joiner.join(current))
+    return pieces
+
+
+def _units(text, max_tokens):
+    """把文本拆成(句子, 前置分隔符)序列，分隔符为换行或空格"""
+    units = []
+    separator = ""
+    for part in _PARAGRAPH_SPLIT.split(text):
+        if not part.strip():
+            if "\n" in part:
+                # 保留段落之间的换行（最多两个）
+                separator = "\n\n" if part.count("\n") > 1 else "\n"
+            continue
+        for sentence, spaced in _split_sentences(part):
+            oversized = estimate_tokens(sentence) > max_tokens
+            pieces = _split_oversized(sentence, max_tokens) if oversized else [sentence]
+            for piece in pieces:
+                units.append((piece, separator if units else ""))
+                separator = " " if not oversized or " " in sentence else ""
+            separator = " " if spaced else ""
+    return units
+
+
+def split_text(text, max_tokens=800, overlap_sentences=1):
+    """
+    在句子和段落边界处切分文本，每段估算不超过max_tokens个token
+
+    Returns:
+        Segment列表；文本不需要切分时只有一段
+    """
+    units = _units(text.strip(), max_tokens)
+    if not units:
+        return [Segment(text)]
+
+    segments = []
+    current = []
+    current_tokens = 0
+    previous = []
+    for sentence, separator in units:
+        tokens = estimate_tokens(sentence)
+        # 段内的句子之间还有分隔符；每段的第一句不带分隔符
+        if current and current_tokens + estimate_tokens(separator) + tokens > max_tokens:
+            segments.append((current, previous))
+            previous = current
+            current = []
+            current_tokens = 0
+        if current:
+            current_tokens += estimate_tokens(separator)
+        current.append((sentence, separator))
+        current_tokens += tokens
+    segments.append((current, previous))
+
+    if len(segments) == 1:
+        return [Segment(text)]
+    result = []
+    for units_in_segment, previous in segments:
+        body = units_in_segment[0][0] + "".join(sep + sentence for sentence, sep in units_in_segment[1:])
+        context_units = previous[-overlap_sentences:] if overlap_sentences > 0 else []
+        context = " ".join(sentence for sentence, _ in context_units)
+        result.append(Segment(body, units_in_segment[0][1], context))
+    return result
+
+
+def join_separator(previous_translation, separator):
+    """
+    拼接相邻两段译文时使用的分隔符
+
+    原文在段落处切分则保留换行；在句子处切分时，前一段译文以中文结尾则直接相连，否则加空格。
+    """
+    if "\n" in separator:
+        return separator
+    if previous_translation and _is_cjk(previous_translation.rstrip()[-1:] or " "):
+        return ""
+    return " "
+
+
+def join_translations(segments, translations):
+    """按原文顺序拼接各段译文"""
+    parts = []
+    for i, (segment, translation) in enumerate(zip(segments, translations)):
+        if i:
+            parts.append(join_separator(translations[i - 1], segment.separator))
+        parts.append(translation)
+    return "".join(parts)
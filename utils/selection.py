@@ -0,0 +1,178 @@
+import os
+import sys
+import time
+import shutil
+import logging
+import threading
+import subprocess
+from collections import deque
+
+import pyperclip
+
+# 热键中需要等待松开的修饰键，否则模拟的Ctrl+C会变成Win+Ctrl+C
+HOTKEY_MODIFIERS = ("windows", "alt", "shift")
+
+
+def _clipboard_sequence():
+    """
+    返回当前剪贴板的变化标识
+
+    Windows下使用GetClipboardSequenceNumber，开销极小；
+    其他平台退化为剪贴板内容本身。
+    """
+    if sys.platform == "win32":
+        import ctypes
+        return ctypes.windll.user32.GetClipboardSequenceNumber()
+    return pyperclip.paste()
+
+
+def _read_primary_selection():
+    """
+    读取X11/Wayland的PRIMARY选区（即当前选中的文本），无需模拟Ctrl+C
+
+    没有可用的命令行工具或读取失败时返回None。
+    """
+    if os.environ.get("WAYLAND_DISPLAY") and shutil.which("wl-paste"):
+        cmd = ["wl-paste", "--primary", "--no-newline"]
+    elif shutil.which("xclip"):
+        cmd = ["xclip", "-o", "-selection", "primary"]
+    elif shutil.which("xsel"):
+        cmd = ["xsel", "--primary", "--output"]
+    else:
+        return None
+    try:
+        result = subprocess.run(cmd, capture_output=True, timeout=0.5)
+        if result.returncode != 0:
+            return None
+        return result.stdout.decode("utf-8", errors="replace")
+    except (OSError, subprocess.SubprocessError) as e:
+        logging.warning(f"读取PRIMARY选区失败: {str(e)}")
+        return None
+
+
+class SelectionCapture:
+    """
+    事件驱动的选中文本获取
+
+    发送Ctrl+C后轮询剪贴板序列号，一旦变化立即返回，不再固定等待。
+    等待上限根据最近几次的实际耗时自适应调整，超时则退回剪贴板中已有的内容。
+    """
+
+    def __init__(self, min_timeout=0.1, max_timeout=0.6, poll_interval=0.005):
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.poll_interval = poll_interval
+        self._recent = deque(maxlen=20)
+        # 判断热键修饰键是否仍被按下的函数，由热键后端提供；
+        # 未提供时使用keyboard.is_pressed（会安装全局键盘钩子）
+        self.modifiers_pressed = None
+        # 最近一次获取的耗时（毫秒），供日志和统计使用
+        self.last_elapsed_ms = None
+        # 模拟复制到恢复剪贴板期间持有，后台监视剪贴板时借此跳过中间状态
+        self.clipboard_lock = threading.Lock()
+        # 恢复剪贴板之后的变化标识，用于识别由获取选中文本本身造成的剪贴板变化
+        self.restored_sequence = None
+
+    def _copy_timeout(self):
+        """取最近耗时最大值的3倍作为等待上限"""
+        if not self._recent:
+            return self.max_timeout
+        return min(self.max_timeout, max(self.min_timeout, 3 * max(self._recent)))
+
+    def _wait_modifiers_released(self, timeout=0.5):
+        """等待热键中的修饰键松开"""
+        deadline = time.perf_counter() + timeout
+        while time.perf_counter() < deadline:
+            if self.modifiers_pressed is not None:
+                pressed = self.modifiers_pressed()
+            else:
+                import keyboard
+                pressed = any(keyboard.is_pressed(key) for key in HOTKEY_MODIFIERS)
+            if not pressed:
+                return
+            time.sleep(self.poll_interval)
+
+    def _capture_via_copy(self):
+        with self.clipboard_lock:
+            return self._copy_and_restore()
+
+    def _copy_and_restore(self):
+        # keyboard只在需要模拟按键时导入，不拖慢启动（与hotkey.py中的做法相同）
+        import keyboard
+        old_clipboard = pyperclip.paste()
+        self._wait_modifiers_released()
+
+        sequence = _clipboard_sequence()
+        copy_start = time.perf_counter()
+        keyboard.press_and_release('ctrl+c')
+
+        deadline = copy_start + self._copy_timeout()
+        while time.perf_counter() < deadline:
+            if _clipboard_sequence() != sequence:
+                break
+            time.sleep(self.poll_interval)
+        else:
+            # 剪贴板没有变化：可能没有选中文本，或选中内容与剪贴板相同
+            logging.info("剪贴板未变化，使用剪贴板中已有的内容")
+            return old_clipboard
+
+        self._recent.append(time.perf_counter() - copy_start)
+        selected_text = pyperclip.paste()
+        pyperclip.copy(old_clipboard)
+        self.restored_sequence = _clipboard_sequence()
+        return selected_text
+
+    def capture(self):
+        """获取当前选中的文本，失败时返回None"""
+        start = time.perf_counter()
+        try:
+            if sys.platform.startswith("linux"):
+                selected_text = _read_primary_selection()
+                if selected_text is None:
+                    selected_text = pyperclip.paste()
+            else:
+                selected_text = self._capture_via_copy()
+            return selected_text
+        except Exception as e:
+            logging.error(f"获取选中文本时出错: {str(e)}")
+            return None
+        finally:
+            self.last_elapsed_ms = (time.perf_counter() - start) * 1000
+            logging.info(f"获取选中文本耗时: {self.last_elapsed_ms:.1f}ms")
+
+
+_capture = SelectionCapture()
+
+
+def set_modifiers_check(check):
+    """设置判断热键修饰键是否仍被按下的函数（utils.hotkey中各后端的modifiers_pressed）"""
+    _capture.modifiers_pressed = check
+
+
+def get_selected_text():
+    """获取当前选中的文本"""
+    return _capture.capture()
+
+
+def clipboard_change(last_sequence):
+    """
+    检查剪贴板自last_sequence之后是否发生了变化，供预翻译等后台监视使用
+
+    Returns:
+        (变化标识, 剪贴板内容, 是否由获取选中文本造成)；
+        没有变化或正在获取选中文本时返回None
+    """
+    if not _capture.clipboard_lock.acquire(blocking=False):
+        return None
+    try:
+        sequence = _clipboard_sequence()
+        if sequence == last_sequence:
+            return None
+        # 非Windows平台的变化标识就是剪贴板内容本身
+        text = pyperclip.paste() if sys.platform == "win32" else sequence
+        own = sequence == _capture.restored_sequence
+        if own:
+            _capture.restored_sequence = None
+        return sequence, text, own
+    finally:
+        _capture.clipboard_lock.release()
@@ -0,0 +1,377 @@
+"""
+翻译记忆库：记录每次翻译的原文/译文句段，并支持模糊匹配
+
+用字符3-gram的MinHash签名做LSH分桶索引（存放在SQLite中），查询时只比较落在相同桶中的
+少量候选句段，十万条以上的记忆库也能在几毫秒内完成查询。句段按翻译方向（目标语言）分开
+记录和查询，同一段原文译成中文和译成英文的结果互不干扰。只有规范化后完全相同的原文才直接
+使用历史译文；字符相似度无法区分"is running"和"is not running"这类只差一个词的句子，
+相似的历史译文只作为参考提供给模型。
+
+    python -m utils.translation_memory export tm.tmx
+    python -m utils.translation_memory import old_tm.jsonl
+    python -m utils.translation_memory lookup "Build 1234 failed on step 5"
+"""
+import re
+import sys
+import json
+import time
+import zlib
+import random
+import sqlite3
+import logging
+import argparse
+import threading
+import xml.etree.ElementTree as ET
+
+from utils.cache import normalize_text
+from utils.langdetect import detect, choose_target
+
+# 翻译记忆库路径
+MEMORY_FILE = "translation_memory.db"
+
+# MinHash签名长度 = 分桶数 × 每桶行数；相似度约0.6以上的句段大概率落入同一个桶
+_NUM_BANDS = 8
+_ROWS_PER_BAND = 4
+_NUM_PERM = _NUM_BANDS * _ROWS_PER_BAND
+_PRIME = (1 << 61) - 1
+_MASK = (1 << 32) - 1
+_rng = random.Random(20240601)
+_PERMUTATIONS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(_NUM_PERM)]
+
+# 每次查询最多精确比较的候选数
+_MAX_CANDIDATES = 20
+
+# 每个桶最多取出的句段数（取最新的），避免大量相似句段落入同一个桶时查询变慢
+_MAX_PER_BUCKET = 50
+
+# 数据库格式版本（PRAGMA user_version）
+_SCHEMA_VERSION = 3
+
+# 超过该长度的文本不记录
+MAX_SEGMENT_CHARS = 2000
+
+_DIGITS = re.compile(r"\d+")
+
+
+def _fuzzy_form(text):
+    """用于模糊比较的形式：规范化、小写，连续数字统一替换为0"""
+    return _DIGITS.sub("0", normalize_text(text).lower())
+
+
+def _shingles(form):
+    if len(form) <= 3:
+        return {form}
+    return {form[i:i + 3] for i in range(len(form) - 2)}
+
+
+def minhash(form):
+    """计算文本的MinHash签名"""
+    hashes = [zlib.crc32(shingle.encode('utf-8')) for shingle in _shingles(form)]
+    return [min(((a * h + b) % _PRIME) & _MASK for h in hashes) for a, b in _PERMUTATIONS]
+
+
+def _band_keys(signature, target_lang):
+    """把签名按桶分组，每个桶哈希为一个带桶号的64位整数；不同翻译方向的句段落在不同的桶中"""
+    keys = []
+    for band in range(_NUM_BANDS):
+        rows = signature[band * _ROWS_PER_BAND:(band + 1) * _ROWS_PER_BAND]
+        digest = zlib.crc32(f"{target_lang}:{','.join(map(str, rows))}".encode('utf-8'))
+        # 高位存放桶号，保证不同桶的键不会相同，结果落在SQLite整数范围内
+        keys.append((band << 32) | digest)
+    return keys
+
+
+def similarity(a, b):
+    """两个模糊比较形式之间的相似度（0~1），即3-gram集合的Dice系数"""
+    if a == b:
+        return 1.0
+    x, y = _shingles(a), _shingles(b)
+    return 2 * len(x & y) / (len(x) + len(y))
+
+
+class Match:
+    """
+    一次匹配的结果
+
+    exact表示两段原文规范化后（忽略空白和大小写）完全相同，历史译文还需要由相同的模型和
+    提示词版本（model、prompt_version）得到才可以直接使用；
+    same_numbers表示两段原文中的数字完全相同，相似度相同时优先选用。
+    """
+
+    def __init__(self, source, target, score, same_numbers, exact=False, model="", prompt_version=0):
+        self.source = source
+        self.target = target
+        self.score = score
+        self.same_numbers = same_numbers
+        self.exact = exact
+        self.model = model
+        self.prompt_version = prompt_version
+
+
+class TranslationMemory:
+    """基于SQLite的翻译记忆库"""
+
+    def __init__(self, path=MEMORY_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode = WAL")
+        old_rows = []
+        version = self._db.execute("PRAGMA user_version").fetchone()[0]
+        if version < 2:
+            # 旧版本没有记录翻译方向，且为每个句段都建立了分桶索引：按新格式重建
+            if self._db.execute("SELECT 1 FROM sqlite_master WHERE name = 'segments'").fetchone():
+                old_rows = self._db.execute("SELECT source, target, created FROM segments ORDER BY id").fetchall()
+            self._db.execute("DROP TABLE IF EXISTS buckets")
+            self._db.execute("DROP TABLE IF EXISTS segments")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS segments ("
+            "id INTEGER PRIMARY KEY, source TEXT NOT NULL, target TEXT NOT NULL, target_lang TEXT NOT NULL, "
+            "key TEXT NOT NULL, form TEXT NOT NULL, created REAL NOT NULL, "
+            "model TEXT NOT NULL DEFAULT '', prompt_version INTEGER NOT NULL DEFAULT 0, "
+            "UNIQUE (target_lang, key))"
+        )
+        if version == 2:
+            # 第2版没有记录译文来自哪个模型和提示词版本：保留这些记录，但只作为参考
+            self._db.execute("ALTER TABLE segments ADD COLUMN model TEXT NOT NULL DEFAULT ''")
+            self._db.execute("ALTER TABLE segments ADD COLUMN prompt_version INTEGER NOT NULL DEFAULT 0")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS buckets ("
+            "key INTEGER NOT NULL, segment_id INTEGER NOT NULL, "
+            "PRIMARY KEY (key, segment_id)) WITHOUT ROWID"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS segments_form ON segments (target_lang, form)")
+        for source, target, created in old_rows:
+            self._insert(source, target, _target_lang_of(target), created)
+        self._db.execute(f"PRAGMA user_version = {_SCHEMA_VERSION}")
+        self._db.commit()
+
+    def _insert(self, source, target, target_lang, created, model="", prompt_version=0):
+        key = normalize_text(source).lower()
+        form = _fuzzy_form(source)
+        row = self._db.execute("SELECT id FROM segments WHERE target_lang = ? AND key = ?",
+                               (target_lang, key)).fetchone()
+        if row is not None:
+            # 相同句段只保留最新的译文
+            self._db.execute("UPDATE segments SET source = ?, target = ?, created = ?, model = ?, "
+                             "prompt_version = ? WHERE id = ?",
+                             (source, target, created, model, prompt_version, row[0]))
+            return
+        # 只有数字不同的句段（如日志）模糊形式相同，只为第一条建立分桶索引，
+        # 否则它们全部落在相同的桶中，查询时要逐一比较
+        represented = self._db.execute("SELECT 1 FROM segments WHERE target_lang = ? AND form = ? LIMIT 1",
+                                       (target_lang, form)).fetchone()
+        segment_id = self._db.execute(
+            "INSERT INTO segments (source, target, target_lang, key, form, created, model, prompt_version) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (source, target, target_lang, key, form, created, model, prompt_version)
+        ).lastrowid
+        if represented:
+            return
+        self._db.executemany("INSERT OR IGNORE INTO buckets (key, segment_id) VALUES (?, ?)",
+                             [(key, segment_id) for key in _band_keys(minhash(form), target_lang)])
+
+    def add(self, source, target, target_lang, model="", prompt_version=0):
+        """
+        记录一对原文/译文句段
+
+        target_lang为翻译方向（目标语言），model和prompt_version为得到译文的模型和提示词版本
+        """
+        source = source.strip()
+        target = target.strip()
+        if not source or not target or len(source) > MAX_SEGMENT_CHARS:
+            return
+        with self._lock:
+            try:
+                self._insert(source, target, target_lang, time.time(), model, prompt_version)
+                self._db.commit()
+            except sqlite3.Error as e:
+                logging.error(f"写入翻译记忆库失败: {str(e)}")
+
+    def lookup(self, text, target_lang, threshold=0.7):
+        """
+        在翻译方向为target_lang的句段中，返回与text最相似且相似度不低于threshold的Match，没有则返回None
+
+        先按规范化的原文精确查找，找到时返回exact为True的Match。
+        """
+        form = _fuzzy_form(text)
+        if not form:
+            return None
+        with self._lock:
+            try:
+                row = self._db.execute(
+                    "SELECT source, target, model, prompt_version FROM segments WHERE target_lang = ? AND key = ?",
+                    (target_lang, normalize_text(text).lower())
+                ).fetchone()
+                if row is not None:
+                    return Match(row[0], row[1], 1.0, True, exact=True, model=row[2], prompt_version=row[3])
+                keys = _band_keys(minhash(form), target_lang)
+                # 统计各句段命中的桶数，每个桶只取最新的若干条，查询时间与记忆库大小无关
+                hits = {}
+                for key in keys:
+                    for (segment_id,) in self._db.execute(
+                        "SELECT segment_id FROM buckets WHERE key = ? ORDER BY segment_id DESC LIMIT ?",
+                        (key, _MAX_PER_BUCKET)
+                    ):
+                        hits[segment_id] = hits.get(segment_id, 0) + 1
+                candidates = sorted(hits, key=lambda segment_id: (hits[segment_id], segment_id),
+                                    reverse=True)[:_MAX_CANDIDATES]
+                rows = self._db.execute(
+                    f"SELECT source, target, form FROM segments WHERE id IN ({','.join('?' * len(candidates))})",
+                    candidates
+                ).fetchall() if candidates else []
+            except sqlite3.Error as e:
+                logging.error(f"查询翻译记忆库失败: {str(e)}")
+                return None
+        best = None
+        numbers = _DIGITS.findall(text)
+        for source, target, candidate_form in rows:
+            score = similarity(form, candidate_form)
+            if score < threshold:
+                continue
+            match = Match(source, target, score, _DIGITS.findall(source) == numbers)
+            # 相似度相同时优先选数字也相同的句段
+            if best is None or (match.score, match.same_numbers) > (best.score, best.same_numbers):
+                best = match
+        return best
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM segments").fetchone()[0]
+
+    def iter_segments(self):
+        """按记录时间依次返回(原文, 译文, 记录时间)"""
+        with self._lock:
+            rows = self._db.execute("SELECT source, target, created FROM segments ORDER BY id").fetchall()
+        return rows
+
+    def import_pairs(self, pairs):
+        """批量导入(原文, 译文)，翻译方向按译文判断，返回导入的条数；导入的译文只作为参考"""
+        count = 0
+        now = time.time()
+        with self._lock:
+            for source, target in pairs:
+                source = (source or "").strip()
+                target = (target or "").strip()
+                if source and target and len(source) <= MAX_SEGMENT_CHARS:
+                    self._insert(source, target, _target_lang_of(target), now)
+                    count += 1
+            self._db.commit()
+        return count
+
+
+def _language_of(text):
+    return "zh-CN" if re.search(r"[\u4e00-\u9fff]", text) else "en"
+
+
+def _target_lang_of(target):
+    """按译文判断翻译方向（用于导入和升级旧记录）"""
+    return "zh" if _language_of(target) == "zh-CN" else "en"
+
+
+def export_jsonl(memory, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        for source, target, created in memory.iter_segments():
+            f.write(json.dumps({"source": source, "target": target, "created": round(created, 3)},
+                               ensure_ascii=False) + "\n")
+
+
+def import_jsonl(memory, path):
+    def pairs():
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    yield record.get("source"), record.get("target")
+    return memory.import_pairs(pairs())
+
+
+def export_tmx(memory, path):
+    """导出为TMX 1.4，语言按原文是否包含中文判断"""
+    tmx = ET.Element("tmx", version="1.4")
+    ET.SubElement(tmx, "header", {
+        "creationtool": "CutEng", "creationtoolversion": "1", "datatype": "plaintext",
+        "segtype": "sentence", "adminlang": "en", "srclang": "*all*", "o-tmf": "CutEng"
+    })
+    body = ET.SubElement(tmx, "body")
+    for source, target, created in memory.iter_segments():
+        tu = ET.SubElement(body, "tu", creationdate=time.strftime("%Y%m%dT%H%M%SZ", time.gmtime(created)))
+        for text in (source, target):
+            tuv = ET.SubElement(tu, "tuv", {"xml:lang": _language_of(text)})
+            ET.SubElement(tuv, "seg").text = text
+    ET.ElementTree(tmx).write(path, encoding="utf-8", xml_declaration=True)
+
+
+def import_tmx(memory, path):
+    """导入TMX，每个翻译单元取前两个语言变体作为原文和译文"""
+    def pairs():
+        for _, element in ET.iterparse(path):
+            if element.tag != "tu":
+                continue
+            segs = ["".join(seg.itertext()) for seg in element.iter("seg")]
+            if len(segs) >= 2:
+                yield segs[0], segs[1]
+            element.clear()
+    return memory.import_pairs(pairs())
+
+
+_memory = None
+_memory_lock = threading.Lock()
+
+
+def get_memory(config):
+    """获取全局翻译记忆库实例，未启用时返回None"""
+    global _memory
+    if not config["tm_enabled"]:
+        return None
+    if _memory is None:
+        with _memory_lock:
+            if _memory is None:
+                try:
+                    _memory = TranslationMemory(MEMORY_FILE)
+                except sqlite3.Error as e:
+                    logging.error(f"打开翻译记忆库失败: {str(e)}")
+                    return None
+    return _memory
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="翻译记忆库工具")
+    parser.add_argument("-m", "--memory", default=MEMORY_FILE, help="翻译记忆库文件")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export = subparsers.add_parser("export", help="导出为TMX或JSONL（按扩展名判断）")
+    export.add_argument("path")
+    imp = subparsers.add_parser("import", help="从TMX或JSONL导入（按扩展名判断）")
+    imp.add_argument("path")
+    lookup = subparsers.add_parser("lookup", help="模糊查询")
+    lookup.add_argument("text")
+    lookup.add_argument("--threshold", type=float, default=0.6)
+    lookup.add_argument("--target-lang", choices=["zh", "en"], help="翻译方向，省略时按原文自动判断")
+    subparsers.add_parser("stats", help="显示记录条数")
+    args = parser.parse_args(argv)
+
+    memory = TranslationMemory(args.memory)
+    is_tmx = getattr(args, "path", "").lower().endswith(".tmx")
+    if args.command == "export":
+        (export_tmx if is_tmx else export_jsonl)(memory, args.path)
+        print(f"已导出 {len(memory)} 条记录: {args.path}")
+    elif args.command == "import":
+        count = (import_tmx if is_tmx else import_jsonl)(memory, args.path)
+        print(f"已导入 {count} 条记录")
+    elif args.command == "lookup":
+        start = time.perf_counter()
+        target_lang = args.target_lang or choose_target(detect(args.text))
+        match = memory.lookup(args.text, target_lang, args.threshold)
+        elapsed = (time.perf_counter() - start) * 1000
+        if match is None:
+            print("没有相似的记录")
+        else:
+            print(f"相似度 {match.score:.2f}\n原文: {match.source}\n译文: {match.target}")
+        print(f"({elapsed:.2f} ms)")
+    else:
+        print(f"共 {len(memory)} 条记录")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())